@@ -1,4 +1,8 @@
 from .singleton import singleton
-from .redis_client import get_redis_client
+from .redis_client import get_redis_client, get_async_redis_client
 from .datetime_service import DateTimeService
 from .cache_service import CacheService
+from .rate_limiter import RateLimiter, AsyncRateLimiter
+from .http_pool import SessionPool, PoolStats
+from .concurrency_limiter import ConcurrencyLimiter, AsyncConcurrencyLimiter
+from .single_flight import SingleFlight, AsyncSingleFlight
@@ -0,0 +1,159 @@
+import time
+import asyncio
+import threading
+
+
+class AIMDLimit:
+    """
+    One concurrency window: grows by one slot per window's worth of healthy responses and is cut by BACKOFF
+    at most once per round trip on overload, so a burst of simultaneous 429s counts as a single signal.
+    Until the first cut it starts slow like TCP, one slot per healthy response, doubling every round trip.
+    Isolated rejections happen at any load, the window is only cut once the overload rate exceeds the budget.
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        # Latency without queueing: follows a faster response at once and drifts up slowly
+        self.baseline = None
+        self.decreased = 0.0
+        self.slow_start = True
+        # Moving share of overloaded responses
+        self.errors = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def track(self, latency: float, drift: float):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * drift
+
+    def count(self, overloaded: bool, smoothing: float):
+        self.errors += (overloaded - self.errors) * smoothing
+
+    def increase(self, amount: float):
+        # A window that is not used is not a proof of health, only a busy one grows
+        if self.in_flight + 1 >= self.limit / 2:
+            self.limit = min(self.maximum, self.limit + (amount / self.limit, amount)[self.slow_start])
+
+    def decrease(self, backoff: float, now: float):
+        if now - self.decreased >= (self.baseline or 0):
+            self.limit = max(self.minimum, self.limit * backoff)
+            self.decreased = now
+            self.slow_start = False
+
+
+class ConcurrencyLimiter:
+    """
+    Additive-increase/multiplicative-decrease bound on the requests in flight, process-wide and per endpoint.
+    A request holds a slot of both windows. Healthy responses raise the windows, 429s, 5xx and transport errors
+    (status None) cut them sharply once they are more than ERROR_BUDGET of the responses, a response slower
+    than TOLERANCE times the endpoint's baseline latency holds them where they are.
+    """
+    INITIAL = 8
+    MINIMUM = 1
+    INCREASE = 1.0
+    BACKOFF = 0.5
+    TOLERANCE = 2.0
+    DRIFT = 0.01
+    ERROR_BUDGET = 0.05
+    SMOOTHING = 0.02
+
+    def __init__(self, maximum: int, point_maximum: int = None):
+        self.maximum = maximum
+        self.point_maximum = point_maximum or maximum
+        self.total = AIMDLimit(initial=min(self.INITIAL, maximum), minimum=self.MINIMUM, maximum=maximum)
+        self.points = {}
+        self._condition = threading.Condition()
+
+    def _point(self, point: str) -> AIMDLimit:
+        if point not in self.points:
+            self.points[point] = AIMDLimit(initial=min(self.INITIAL, self.point_maximum), minimum=self.MINIMUM,
+                                           maximum=self.point_maximum)
+        return self.points[point]
+
+    def _admit(self, point: str) -> bool:
+        limit = self._point(point)
+        if not (self.total.available and limit.available):
+            return False
+        self.total.in_flight += 1
+        limit.in_flight += 1
+        return True
+
+    @staticmethod
+    def overloaded(status) -> bool:
+        return status is None or status == 429 or status >= 500
+
+    def _update(self, point: str, status, latency: float):
+        limit = self._point(point)
+        limit.in_flight -= 1
+        self.total.in_flight -= 1
+        overloaded = self.overloaded(status)
+        limit.count(overloaded, self.SMOOTHING)
+        self.total.count(overloaded, self.SMOOTHING)
+        if overloaded:
+            now = time.monotonic()
+            for window in (limit, self.total):
+                if window.errors > self.ERROR_BUDGET:
+                    window.decrease(self.BACKOFF, now)
+            return
+        limit.track(latency, self.DRIFT)
+        # The total baseline is the fastest endpoint's, it only paces the cuts
+        self.total.track(latency, self.DRIFT)
+        if latency <= limit.baseline * self.TOLERANCE:
+            for window in (limit, self.total):
+                if window.errors <= self.ERROR_BUDGET:
+                    window.increase(self.INCREASE)
+
+    def acquire(self, point: str):
+        with self._condition:
+            self._condition.wait_for(lambda: self._admit(point))
+
+    def release(self, point: str, status, latency: float):
+        """
+        :param status: HTTP status of the response, None when the request failed without one
+        :param latency: seconds the request was in flight
+        """
+        with self._condition:
+            self._update(point, status, latency)
+            self._condition.notify_all()
+
+    def _stats(self) -> dict:
+        return {'total': {'limit': round(self.total.limit, 2), 'in_flight': self.total.in_flight},
+                'points': {point: {'limit': round(limit.limit, 2), 'in_flight': limit.in_flight}
+                           for point, limit in self.points.items()}}
+
+    def stats(self) -> dict:
+        """
+        :return: current window and requests in flight, in total and per endpoint
+        """
+        with self._condition:
+            return self._stats()
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """
+    Event loop flavour of ConcurrencyLimiter, every coroutine of the loop shares the windows.
+    """
+
+    def __init__(self, maximum: int, point_maximum: int = None):
+        super(AsyncConcurrencyLimiter, self).__init__(maximum=maximum, point_maximum=point_maximum)
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, point: str):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._admit(point))
+
+    async def release(self, point: str, status, latency: float):
+        async with self._condition:
+            self._update(point, status, latency)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        # Single threaded, the loop cannot switch in the middle of a read
+        return self._stats()
@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from .singleton import singleton
+
+
+@singleton
+class PoolStats:
+    """
+    Process-wide connection counters of every SessionPool.
+    hits: a kept-alive connection was reused, misses: a request had to open a connection,
+    connections: TCP connects, handshakes: TLS handshakes.
+    """
+    FIELDS = ('hits', 'misses', 'connections', 'handshakes', 'rotations')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field: str, amount=1):
+        with self._lock:
+            self._counters[field] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+
+class _CountingHTTPConnection(HTTPConnection):
+
+    def connect(self):
+        super(_CountingHTTPConnection, self).connect()
+        PoolStats().incr('connections')
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+
+    def connect(self):
+        super(_CountingHTTPSConnection, self).connect()
+        stats: PoolStats = PoolStats()
+        stats.incr('connections')
+        stats.incr('handshakes')
+
+
+class _CountingPoolMixin:
+
+    def _get_conn(self, timeout=None):
+        conn = super(_CountingPoolMixin, self)._get_conn(timeout=timeout)
+        PoolStats().incr(('misses', 'hits')[conn.sock is not None])
+        return conn
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _CountingHTTPConnectionPool,
+                                                   'https': _CountingHTTPSConnectionPool}
+
+
+class _Generation:
+    __slots__ = ('session', 'in_flight', 'retired')
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.in_flight = 0
+        self.retired = False
+
+
+class SessionPool:
+    """
+    Thread-safe keep-alive pool of HTTP connections behind a requests Session.
+    pool_size connections are kept per host and callers block for a free one instead of opening
+    throwaway sockets. rotate() swaps in a fresh session, the retired one is closed only after the
+    last request that borrowed it has returned.
+    """
+
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._current = _Generation(self._new_session())
+
+    def _new_session(self) -> Session:
+        session = Session()
+        adapter = CountingHTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @contextmanager
+    def session(self) -> Session:
+        with self._lock:
+            generation = self._current
+            generation.in_flight += 1
+        try:
+            yield generation.session
+        finally:
+            with self._lock:
+                generation.in_flight -= 1
+                close = generation.retired and not generation.in_flight
+            if close:
+                generation.session.close()
+
+    def rotate(self):
+        with self._lock:
+            retired, self._current = self._current, _Generation(self._new_session())
+            retired.retired = True
+            close = not retired.in_flight
+        if close:
+            retired.session.close()
+        PoolStats().incr('rotations')
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = self._current.in_flight
+        return dict(PoolStats().snapshot(), in_flight=in_flight, pool_size=self.pool_size)
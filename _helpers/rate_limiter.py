@@ -0,0 +1,84 @@
+import time
+import asyncio
+from .redis_client import get_redis_client, get_async_redis_client
+
+
+class RateLimiter:
+    """
+    Token bucket shared through Redis, so every worker process spends from the same budget.
+    Slots are reserved: a caller over budget is handed the time its slot frees up and sleeps until then,
+    instead of failing or busy-polling Redis.
+    """
+
+    RATE_LIMIT_PREFIX = 'RL'
+    REDIS_KEYS = {
+        'bucket': f'{RATE_LIMIT_PREFIX}:BUCKET:''{name}'
+    }
+    # KEYS[1]: bucket, ARGV: capacity, refill per ms, now in ms, max wait in ms (-1 for unbounded)
+    # Returns the milliseconds to wait for the reserved slot, or -1 when it would exceed max wait.
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local max_wait = tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - 1
+    local wait = 0
+    if tokens < 0 then
+        wait = math.ceil(-tokens / rate)
+        if max_wait >= 0 and wait > max_wait then
+            return -1
+        end
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(math.max(now, ts)))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + wait + 1000)
+    return wait
+    """
+
+    def __init__(self, client=None):
+        self.client = client or get_redis_client()
+        self.script = self.client.register_script(self.SCRIPT)
+
+    @classmethod
+    def _args(cls, name: str, limit: int, period: float, max_wait: float = None) -> (list, list,):
+        keys = [cls.REDIS_KEYS['bucket'].format(name=name)]
+        args = [limit, limit / (period * 1000), int(time.time() * 1000),
+                -1 if max_wait is None else int(max_wait * 1000)]
+        return keys, args
+
+    def reserve(self, name: str, limit: int, period: float, max_wait: float = None):
+        """
+        :return: seconds until the reserved slot is usable, None when it would be later than max_wait
+        """
+        keys, args = self._args(name=name, limit=limit, period=period, max_wait=max_wait)
+        wait = self.script(keys=keys, args=args)
+        return None if wait < 0 else wait / 1000
+
+    def acquire(self, name: str, limit: int, period: float, max_wait: float = None) -> bool:
+        wait = self.reserve(name=name, limit=limit, period=period, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class AsyncRateLimiter(RateLimiter):
+
+    def __init__(self, client=None):
+        super(AsyncRateLimiter, self).__init__(client=client or get_async_redis_client())
+
+    async def reserve(self, name: str, limit: int, period: float, max_wait: float = None):
+        keys, args = self._args(name=name, limit=limit, period=period, max_wait=max_wait)
+        wait = await self.script(keys=keys, args=args)
+        return None if wait < 0 else wait / 1000
+
+    async def acquire(self, name: str, limit: int, period: float, max_wait: float = None) -> bool:
+        wait = await self.reserve(name=name, limit=limit, period=period, max_wait=max_wait)
+        if wait is None:
+            return False
+        if wait:
+            await asyncio.sleep(wait)
+        return True
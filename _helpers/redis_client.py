@@ -1,4 +1,5 @@
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from .singleton import singleton
 from django.conf import settings
 
@@ -13,3 +14,9 @@ class RedisClient:
 
 def get_redis_client() -> Redis:
     return RedisClient().client
+
+
+def get_async_redis_client() -> AsyncRedis:
+    # asyncio connections belong to the loop that opened them, so callers keep one client per loop
+    return AsyncRedis(host=settings.REDIS_HOST,
+                      port=settings.REDIS_PORT)
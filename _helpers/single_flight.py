@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls that overlap: the first caller of a key runs the call, the callers that arrive while
+    it is in flight wait for it and share its result or exception. Nothing is cached, once the call returned the
+    next caller of the key runs it again. The result is shared as is, callers must not mutate it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _join(self, group: str, key) -> (object, bool,):
+        stats = self._stats.setdefault(group, {'calls': 0, 'shared': 0})
+        stats['calls'] += 1
+        call = self._calls.get((group, key))
+        if call is not None:
+            stats['shared'] += 1
+            return call, False
+        call = self._calls[group, key] = self._call()
+        return call, True
+
+    @staticmethod
+    def _call():
+        return Future()
+
+    def do(self, group: str, key, fn, *args, **kwargs) -> (object, bool,):
+        """
+        :param group: kind of call, the statistics are kept per group
+        :return: (result of fn, whether it was shared with a call already in flight)
+        """
+        with self._lock:
+            call, leader = self._join(group, key)
+        if not leader:
+            return call.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(group, key)
+            call.set_exception(e)
+            raise
+        self._finish(group, key)
+        call.set_result(result)
+        return result, False
+
+    def _finish(self, group: str, key):
+        with self._lock:
+            del self._calls[group, key]
+
+    def stats(self) -> dict:
+        """
+        :return: group -> calls and shared, the calls that were saved by joining one in flight
+        """
+        with self._lock:
+            return {group: dict(stats) for group, stats in self._stats.items()}
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    Event loop flavour of SingleFlight, for the coroutines of one loop.
+    """
+
+    @staticmethod
+    def _call():
+        return asyncio.get_running_loop().create_future()
+
+    def _finish(self, group: str, key):
+        del self._calls[group, key]
+
+    async def do(self, group: str, key, fn, *args, **kwargs) -> (object, bool,):
+        call, leader = self._join(group, key)
+        if not leader:
+            # Shielded, a cancelled follower must not cancel the call of the others
+            return await asyncio.shield(call), True
+
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            self._finish(group, key)
+            call.cancel()
+            raise
+        except BaseException as e:
+            self._finish(group, key)
+            call.set_exception(e)
+            # Retrieved here, a call nobody joined must not be reported as a lost exception
+            call.exception()
+            raise
+        self._finish(group, key)
+        call.set_result(result)
+        return result, False
+
+    def stats(self) -> dict:
+        return {group: dict(stats) for group, stats in self._stats.items()}
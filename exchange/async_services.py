@@ -0,0 +1,183 @@
+import asyncio
+from time import perf_counter
+from functools import partial
+from aiohttp import ClientSession, TCPConnector
+from _helpers import AsyncRateLimiter, AsyncConcurrencyLimiter, AsyncSingleFlight
+from .services import BaseKuCoinService, KuCoinOperations
+from .contracts import ContractStore
+from .metrics import RequestMetrics
+from .balances import BalanceStore
+from .ledger import ExecutionLedger
+from .snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+
+
+class AsyncBaseKuCoinService(BaseKuCoinService):
+    """
+    asyncio flavour of BaseKuCoinService. It shares the REQUESTS table, endpoint formatting and signing
+    with the blocking service, only the transport is an aiohttp session bound to the running event loop,
+    so it must be opened inside the loop (``async with AsyncKuCoinService() as service:``).
+    """
+    CONNECTION_LIMIT = 1000
+
+    def __init__(self, connection_limit: int = None):
+        self.session = None
+        self.limiter = None
+        self.concurrency = None
+        self.single_flight = AsyncSingleFlight()
+        self.contracts_lock = None
+        self.batch_orders = True
+        self.metrics = RequestMetrics()
+        self.balances = BalanceStore()
+        self.ledger = ExecutionLedger()
+        self.connection_limit = connection_limit or self.CONNECTION_LIMIT
+        self.BASE_URL = (self.URLS['URL'], self.URLS['SANDBOX_URL'])[self.SANDBOX]
+
+    async def open(self):
+        if self.session is None or self.session.closed:
+            self.session = ClientSession(connector=TCPConnector(limit=self.connection_limit))
+        if self.limiter is None:
+            self.limiter = AsyncRateLimiter()
+        if self.concurrency is None:
+            self.concurrency = AsyncConcurrencyLimiter(maximum=self.connection_limit)
+        if self.contracts_lock is None:
+            self.contracts_lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.limiter is not None:
+            await self.limiter.client.close()
+            self.limiter = None
+        # The windows' condition is bound to the loop that closes now
+        self.concurrency = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def single_flight_stats(self) -> dict:
+        return self.single_flight.stats()
+
+    @staticmethod
+    async def _gather(*operations, return_exceptions=False) -> list:
+        return await asyncio.gather(*operations, return_exceptions=return_exceptions)
+
+    @staticmethod
+    def _spawn(operation) -> asyncio.Future:
+        return asyncio.ensure_future(operation)
+
+    @staticmethod
+    async def _join(future: asyncio.Future):
+        return await future
+
+    @staticmethod
+    async def _blocking(fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+
+    async def _request(self, api_key: str, api_secret: str, api_passphrase: str,
+                       method: str, endpoint: str, data=None, point: str = None, waited=0.0) -> (int, str,):
+        start = perf_counter()
+        url, header, data_json = self._prepare_request(api_key=api_key, api_secret=api_secret,
+                                                       api_passphrase=api_passphrase,
+                                                       method=method, endpoint=endpoint, data=data)
+        signed = perf_counter()
+        status = self.metrics.ERROR
+        try:
+            async with self.session.request(method=method, url=url, headers=header, data=data_json) as response:
+                status = response.status
+                return status, await response.json(content_type=None)
+        finally:
+            if self.METRICS and point:
+                self.metrics.record(point, status, wait=waited, sign=signed - start, http=perf_counter() - signed)
+
+    async def request(self, point: str, api_key: str = None, api_secret: str = None, api_passphrase: str = None,
+                      **kwargs):
+        method, endpoint, data = self._resolve(point=point, **kwargs)
+        if not self._coalesced(point=point, method=method, api_key=api_key):
+            return await self._send(point=point, method=method, endpoint=endpoint, data=data, api_key=api_key,
+                                    api_secret=api_secret, api_passphrase=api_passphrase)
+
+        response, shared = await self.single_flight.do(point, endpoint, self._send, point=point, method=method,
+                                                       endpoint=endpoint, data=data)
+        if shared and self.METRICS:
+            self.metrics.record_shared(point)
+        return response
+
+    async def _send(self, point: str, method: str, endpoint: str, data: str = None, api_key: str = None,
+                    api_secret: str = None, api_passphrase: str = None):
+        start = perf_counter()
+        if rate_limit := self._rate_limit(api_key=api_key, point=point):
+            await self.limiter.acquire(*rate_limit)
+        if not self.CONCURRENCY_LIMITED:
+            return await self._request(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
+                                       method=method, endpoint=endpoint, data=data,
+                                       point=point, waited=perf_counter() - start)
+
+        await self.concurrency.acquire(point)
+        sent, status = perf_counter(), None
+        try:
+            status, response = await self._request(api_key=api_key, api_secret=api_secret,
+                                                   api_passphrase=api_passphrase, method=method, endpoint=endpoint,
+                                                   data=data, point=point, waited=sent - start)
+            return status, response
+        finally:
+            await self.concurrency.release(point, status, perf_counter() - sent)
+
+
+class AsyncKuCoinService(KuCoinOperations, AsyncBaseKuCoinService):
+    """
+    Coroutine counterpart of KuCoinService, both run the same KuCoinOperations.
+    """
+
+    async def _contracts(self) -> ContractStore:
+        store: ContractStore = ContractStore()
+        if not store.is_fresh():
+            async with self.contracts_lock:
+                if store.claim_refresh():
+                    try:
+                        store.update(await self.fetch_contracts())
+                    except Exception as e:
+                        store.failed(e)
+        return store
+
+    async def refresh_balances(self, accounts: list, currency='USDT') -> int:
+        """
+        Fetches the balances of many accounts concurrently and publishes them as one bulk snapshot.
+        :param accounts: {api_key, api_secret, api_passphrase} of every account
+        :return: number of accounts refreshed
+        """
+        balances = await asyncio.gather(*[self.get_balance(currency=currency, **auth) for auth in accounts],
+                                        return_exceptions=True)
+        fetched = {auth['api_key']: balance for auth, balance in zip(accounts, balances)
+                   if not isinstance(balance, BaseException)}
+        await self._blocking(self.balances.put_many, fetched, currency=currency)
+        return len(fetched)
+
+    async def execute_signals(self, execution: ExecutionSnapshot, return_exceptions=True):
+        """
+        Fans a signal out to many accounts on the running loop.
+        :return: list of execute_account results (or exceptions) in the order of execution.accounts
+        """
+        # One round trip for the balance snapshots of the whole army instead of one per account, off the loop
+        snapshots = await self._blocking(self.balances.get_many, execution.api_keys)
+        # Sized and built up front in one pass, the coroutines only send orders
+        orders = await self.plan_orders(execution, snapshots=snapshots)
+        return await asyncio.gather(*[self._execute_recorded(signal=execution.signal, account=account,
+                                                             snapshots=snapshots, order=orders.get(account.pk))
+                                      for account in execution.accounts],
+                                    return_exceptions=return_exceptions)
+
+    async def _execute_recorded(self, signal: SignalSnapshot, account: AccountSnapshot, snapshots: dict,
+                                order: tuple = None):
+        started = perf_counter()
+        try:
+            result = await self.execute_account(signal=signal, account=account, snapshots=snapshots, order=order)
+        except Exception as e:
+            self.ledger.record(signal.pk, account.pk, error=e, duration=perf_counter() - started)
+            raise
+        self.ledger.record(signal.pk, account.pk, result=result, duration=perf_counter() - started)
+        return result
@@ -0,0 +1,59 @@
+import json
+from time import time
+from _helpers import singleton, get_redis_client
+
+
+@singleton
+class BalanceStore:
+    """
+    Latest available balance of every account, shared by the workers through Redis.
+    Background refreshes write it in bulk and live fetches write through, signal execution reads it instead
+    of calling the exchange and only goes live when the snapshot is older than MAX_AGE seconds.
+    """
+    PREFIX = 'KC:BALANCE'
+    REDIS_KEYS = {
+        'balance': f'{PREFIX}:''{currency}:{api_key}',
+    }
+    MAX_AGE = 60
+    # Stale snapshots are useless, Redis drops them a while after they can no longer be read
+    TTL = MAX_AGE * 10
+
+    def __init__(self):
+        self.client = get_redis_client()
+
+    def _key(self, api_key: str, currency: str) -> str:
+        return self.REDIS_KEYS.get('balance').format(currency=currency, api_key=api_key)
+
+    def put(self, api_key: str, balance: float, currency='USDT', ts: float = None):
+        self.client.set(name=self._key(api_key, currency), value=json.dumps([balance, ts or time()]), ex=self.TTL)
+
+    def put_many(self, balances: dict, currency='USDT', ts: float = None):
+        """
+        :param balances: api_key -> available balance
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        for api_key, balance in balances.items():
+            pipeline.set(name=self._key(api_key, currency), value=json.dumps([balance, ts or time()]), ex=self.TTL)
+        pipeline.execute()
+
+    def _fresh(self, snapshot: bytes, max_age: float) -> float:
+        if snapshot is None:
+            return None
+        balance, ts = json.loads(snapshot)
+        return balance if time() - ts <= (max_age or self.MAX_AGE) else None
+
+    def get(self, api_key: str, currency='USDT', max_age: float = None) -> float:
+        """
+        :return: available balance, None when there is no snapshot younger than max_age seconds
+        """
+        return self._fresh(self.client.get(self._key(api_key, currency)), max_age)
+
+    def get_many(self, api_keys: list, currency='USDT', max_age: float = None) -> dict:
+        """
+        :return: api_key -> available balance of the accounts with a fresh snapshot, in one round trip
+        """
+        if not api_keys:
+            return {}
+        snapshots = self.client.mget([self._key(api_key, currency) for api_key in api_keys])
+        balances = {api_key: self._fresh(snapshot, max_age) for api_key, snapshot in zip(api_keys, snapshots)}
+        return {api_key: balance for api_key, balance in balances.items() if balance is not None}
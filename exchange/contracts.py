@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from _helpers import singleton
+from .responses import Contract
+
+
+@singleton
+class ContractStore:
+    """
+    Process-wide symbol -> Contract table of the active KuCoin futures contracts.
+    It is bulk loaded from /api/v1/contracts/active, trusted for TTL seconds and kept warm by a daemon
+    thread, so sizing and validating an order for a whole army reads memory instead of the exchange. A failed
+    refresh keeps the previous table and is tried again after RETRY seconds.
+    """
+
+    TTL = 60 * 10
+    REFRESH_INTERVAL = 60 * 5
+    RETRY = 5
+
+    def __init__(self):
+        self._contracts = {}
+        self._loaded = 0.0
+        self._tried = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    @staticmethod
+    def _fetch() -> list:
+        from .services import KuCoinService
+        return KuCoinService().fetch_contracts()
+
+    def update(self, contracts: list):
+        """
+        :param contracts: the active contracts as the exchange lists them
+        """
+        # Rebinding the dict keeps readers lock-free, they see either the old or the new table
+        self._contracts = {contract.symbol: contract for contract in Contract.from_json_list(contracts)}
+        self._loaded = time.monotonic()
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self._loaded < self.TTL
+
+    def claim_refresh(self, force=False) -> bool:
+        """
+        :return: whether the caller fetches the table now, a stale one is tried at most every RETRY seconds
+        """
+        if not force and (self.is_fresh() or time.monotonic() - self._tried < self.RETRY):
+            return False
+        self._tried = time.monotonic()
+        return True
+
+    def failed(self, error: Exception):
+        """
+        Keeps the previous table after a failed refresh, the error is only raised when there is none.
+        """
+        if not self._contracts:
+            raise error
+        logging.error('contract refresh failed, the previous table is kept!', extra={'loaded': self._loaded,
+                                                                                    'error': repr(error)})
+
+    def refresh(self, force=False):
+        with self._lock:
+            if self.claim_refresh(force=force):
+                self.update(self._fetch())
+            self.start()
+
+    def contracts(self) -> dict:
+        if not self.is_fresh():
+            try:
+                self.refresh()
+            except Exception as e:
+                self.failed(e)
+        return self._contracts
+
+    def get(self, symbol: str) -> Contract:
+        contract = self.contracts().get(symbol)
+        if contract is None:
+            raise KeyError(f'{symbol} is not an active contract!')
+        return contract
+
+    def symbols(self) -> list:
+        return list(self.contracts().keys())
+
+    def lot_size(self, symbol: str) -> float:
+        return self.get(symbol).lot_size_contract
+
+    def _run(self):
+        while not self._stop.wait(self.REFRESH_INTERVAL):
+            try:
+                self.refresh(force=True)
+            except Exception:
+                logging.exception('contract refresh failed!', extra={'loaded': self._loaded})
+
+    def start(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._run, name='contract-store', daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,185 @@
+import os
+import json
+import socket
+import logging
+import threading
+from time import time, sleep
+from concurrent.futures import as_completed
+from django.db import close_old_connections
+from redis.exceptions import ResponseError
+from _helpers import singleton, get_redis_client
+from market.models import Signal
+from .services import KuCoinService, BaseKuCoinService
+from .snapshots import SignalSnapshot, ExecutionSnapshot
+from .scheduler import DeadlineScheduler
+from .ledger import ExecutionLedger
+from .plans import ExecutionPlanner
+
+
+@singleton
+class SignalDispatcher:
+    """
+    Splits a signal's army into shards of user ids on a Redis Stream, any number of ShardWorker processes on
+    any node consume them through one consumer group. Credentials never enter Redis, every worker loads the
+    accounts of its shard itself. Progress of every signal is counted in a hash as accounts complete.
+    """
+    PREFIX = 'KC:DISPATCH'
+    REDIS_KEYS = {
+        'stream': f'{PREFIX}:SHARDS',
+        'progress': f'{PREFIX}:PROGRESS:''{signal_id}',
+        'done': f'{PREFIX}:DONE:''{signal_id}',
+    }
+    GROUP = 'executors'
+    SHARD_SIZE = 100
+    STREAM_MAXLEN = 100000
+    PROGRESS_TTL = 24 * 60 * 60
+
+    def __init__(self):
+        self.client = get_redis_client()
+
+    @property
+    def stream(self) -> str:
+        return self.REDIS_KEYS.get('stream')
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(name=self.stream, groupname=self.GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def dispatch(self, signal: Signal) -> int:
+        """
+        :return: number of shards queued
+        """
+        user_ids = ExecutionSnapshot.army_ids(signal)
+        shards = [user_ids[it:it + self.SHARD_SIZE] for it in range(0, len(user_ids), self.SHARD_SIZE)]
+        snapshot = json.dumps(SignalSnapshot.from_signal(signal))
+        progress = self.REDIS_KEYS.get('progress').format(signal_id=signal.pk)
+
+        self.ensure_group()
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hset(progress, mapping={'accounts': len(user_ids), 'shards': len(shards), 'dispatched': time()})
+        pipeline.expire(progress, self.PROGRESS_TTL)
+        for shard in shards:
+            pipeline.xadd(self.stream, {'signal': snapshot, 'users': json.dumps(shard), 'army': len(user_ids)},
+                          maxlen=self.STREAM_MAXLEN, approximate=True)
+        pipeline.execute()
+        return len(shards)
+
+    def progress(self, signal_id: int) -> dict:
+        """
+        :return: accounts, shards, shards_done, executed, protected, failed, dropped, reclaimed, dispatched and updated
+                 (unix times) of the signal's dispatch, empty when it was not dispatched
+        """
+        progress = self.client.hgetall(self.REDIS_KEYS.get('progress').format(signal_id=signal_id))
+        progress = {field.decode(): float(value) for field, value in progress.items()}
+        return {field: value if field in ('dispatched', 'updated') else int(value) for field, value in progress.items()}
+
+
+class ShardWorker:
+    """
+    Consumer of the dispatch stream. It first takes over shards a dead consumer left pending for CLAIM_IDLE
+    milliseconds, then reads new ones. Accounts are marked done one by one and a shard is acknowledged once all
+    of its accounts ran, so a reclaimed shard only executes the accounts that did not complete; one interrupted
+    mid-order is placed again under the same clientOids. The deadline budget of a reclaimed shard starts when
+    it is taken over, it is always older than its signal's.
+    """
+    BLOCK = 5000
+    CLAIM_IDLE = 60000
+
+    def __init__(self, name: str = None, workers: int = None):
+        self.dispatcher: SignalDispatcher = SignalDispatcher()
+        self.client = self.dispatcher.client
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.service: KuCoinService = KuCoinService()
+        self.scheduler: DeadlineScheduler = DeadlineScheduler()
+        if workers:
+            self.scheduler.resize(workers)
+        self.ledger: ExecutionLedger = ExecutionLedger()
+        self.planner: ExecutionPlanner = ExecutionPlanner()
+        self._stop = threading.Event()
+
+    def _claim(self) -> list:
+        # Replied as [next start id, claimed messages, deleted ids]
+        return self.client.xautoclaim(self.dispatcher.stream, self.dispatcher.GROUP, self.name,
+                                      min_idle_time=self.CLAIM_IDLE, start_id='0-0', count=1)[1]
+
+    def _read(self) -> list:
+        messages = self.client.xreadgroup(self.dispatcher.GROUP, self.name, {self.dispatcher.stream: '>'},
+                                          count=1, block=self.BLOCK)
+        return messages[0][1] if messages else []
+
+    def _heartbeat(self, message_id):
+        # Claiming its own message resets the idle time, a long shard is not taken over while it runs
+        self.client.xclaim(self.dispatcher.stream, self.dispatcher.GROUP, self.name, min_idle_time=0,
+                           message_ids=[message_id], justid=True)
+
+    def process(self, message_id, fields: dict, reclaimed=False):
+        signal = SignalSnapshot(*json.loads(fields[b'signal']))
+        signal = signal._replace(targets=tuple(signal.targets))
+        user_ids = json.loads(fields[b'users'])
+        army = int(fields.get(b'army', len(user_ids)))
+        progress = self.dispatcher.REDIS_KEYS.get('progress').format(signal_id=signal.pk)
+        done = self.dispatcher.REDIS_KEYS.get('done').format(signal_id=signal.pk)
+
+        if reclaimed:
+            self.client.hincrby(progress, 'reclaimed', 1)
+            user_ids = [user_id for user_id, is_done in zip(user_ids, self.client.smismember(done, user_ids))
+                        if not is_done]
+
+        close_old_connections()
+        execution = ExecutionSnapshot.load_accounts(signal, user_ids) if user_ids else None
+        if execution is not None:
+            snapshots = self.service.balances.get_many(execution.api_keys)
+            plan = self.planner.plan(execution, snapshots=snapshots)
+            futures = dict(zip(self.scheduler.submit_execution(execution, snapshots, plan=plan, army=army,
+                                                               since=time() if reclaimed else None),
+                               execution.accounts))
+            for future in as_completed(futures):
+                protected = not future.exception() and BaseKuCoinService._accepted(future.result()[2])
+                dropped = isinstance(future.exception(), TimeoutError)
+                if future.exception() and not dropped:
+                    logging.error('dispatched execution failed!', extra={'signal_id': signal.pk,
+                                                                         'user_id': futures[future].pk,
+                                                                         'error': repr(future.exception())})
+                pipeline = self.client.pipeline(transaction=False)
+                pipeline.sadd(done, futures[future].pk)
+                pipeline.expire(done, self.dispatcher.PROGRESS_TTL)
+                pipeline.hincrby(progress, 'executed', 1)
+                pipeline.hincrby(progress, 'dropped' if dropped else ('failed', 'protected')[protected], 1)
+                pipeline.hset(progress, 'updated', time())
+                pipeline.execute()
+                self._heartbeat(message_id)
+
+        self.ledger.flush()
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hincrby(progress, 'shards_done', 1)
+        pipeline.xack(self.dispatcher.stream, self.dispatcher.GROUP, message_id)
+        pipeline.execute()
+
+    def run_once(self) -> bool:
+        """
+        :return: whether a shard was processed
+        """
+        for message_id, fields in self._claim():
+            if fields:
+                self.process(message_id, fields, reclaimed=True)
+                return True
+        for message_id, fields in self._read():
+            self.process(message_id, fields)
+            return True
+        return False
+
+    def run(self):
+        self.dispatcher.ensure_group()
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                # The shard stays pending and is reclaimed after CLAIM_IDLE
+                logging.exception('dispatch worker failed!', extra={'worker': self.name})
+                sleep(1)
+
+    def stop(self):
+        self._stop.set()
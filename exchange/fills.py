@@ -0,0 +1,236 @@
+import json
+import asyncio
+import logging
+from time import time
+from _helpers import singleton, get_redis_client
+from market.models import Trade
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
+from .services import BaseKuCoinService
+from .async_services import AsyncKuCoinService
+
+
+@singleton
+class FillSync:
+    """
+    Incremental sync of done orders into Trade.net.
+    Every account keeps a cursor in Redis, a cycle only lists the done orders after it. The exchange lists done
+    orders by creation time though, and take-profit and stop-loss legs are done long after they were placed, so
+    every OPEN_REFRESH the open signal orders of the account are listed and the done orders are then listed from
+    the creation of the oldest one of a live trade, and from that listing on. Legs of a trade that was closed, or
+    whose main order was never filled, stay open on the exchange but are not waited for, and nothing is listed
+    further back than MAX_LOOKBACK. Orders placed for a signal carry '{signal_id}-{user_id}-{leg}' as clientOid,
+    their fills are kept per leg in Redis so a trade's realised net can be recomputed whenever one of its legs is
+    done, and the changed trades are written in bulk.
+    """
+    PREFIX = 'KC:FILLS'
+    REDIS_KEYS = {
+        'cursor': f'{PREFIX}:CURSOR:''{user_id}',
+        'open': f'{PREFIX}:OPEN:''{user_id}',
+        'listed': f'{PREFIX}:LISTED:''{user_id}',
+        'legs': f'{PREFIX}:LEGS:''{signal_id}:{user_id}',
+    }
+    # Orders take a moment to settle after they are done, every cycle re-reads this much before the cursor
+    LOOKBACK = 60 * 1000
+    MAX_LOOKBACK = 2 * BaseKuCoinService.ORDERS_WINDOW
+    OPEN_REFRESH = 5 * 60 * 1000
+    LEGS_TTL = 90 * 24 * 60 * 60
+
+    def __init__(self):
+        self.client = get_redis_client()
+
+    @staticmethod
+    def _parse(order: dict, user_id: int):
+        """
+        :return: (signal id, user id, leg) of a signal order of the user, else None
+        """
+        parsed = BaseKuCoinService.parse_client_oid(order.get('clientOid'))
+        return parsed if parsed is not None and parsed[1] == user_id else None
+
+    @classmethod
+    def _fill(cls, order: dict, user_id: int):
+        """
+        :return: ((signal id, user id), leg, {side, size, value}) of a filled signal order of the user, else None
+        """
+        parsed = cls._parse(order, user_id)
+        if parsed is None or not float(order.get('dealSize') or 0):
+            return None
+        signal_id, _, leg = parsed
+        return (signal_id, user_id), leg, {'side': order.get('side'), 'size': float(order.get('dealSize')),
+                                           'value': float(order.get('dealValue') or 0)}
+
+    @staticmethod
+    def calculate_net(legs: dict) -> float:
+        """
+        Realised net of a trade from its filled legs, the closed part of the entry is charged at its average price.
+        :return: None while the main order has no fill
+        """
+        main = legs.get('main')
+        if not main:
+            return None
+        closed_size = sum(leg['size'] for name, leg in legs.items() if name != 'main')
+        closed_value = sum(leg['value'] for name, leg in legs.items() if name != 'main')
+        entry_value = main['value'] * min(closed_size, main['size']) / main['size']
+        return (closed_value - entry_value) * (1, -1)[main['side'] == 'sell']
+
+    def _cursors(self, user_ids: list) -> dict:
+        """
+        :return: user id -> (cursor, creation time of its oldest order of a live trade, time its open orders were
+                 last listed), any of them None when unknown
+        """
+        fields = ('cursor', 'open', 'listed')
+        keys = [self.REDIS_KEYS.get(key).format(user_id=user_id) for user_id in user_ids for key in fields]
+        values = [int(value) if value else None for value in self.client.mget(keys)]
+        return {user_id: tuple(values[len(fields) * it:len(fields) * (it + 1)]) for it, user_id in enumerate(user_ids)}
+
+    def _start_at(self, cursor: int, open_since: int, listed: int, end_at: int) -> int:
+        # A first sync only looks one window back instead of re-scanning the whole history
+        start_at = end_at - BaseKuCoinService.ORDERS_WINDOW if cursor is None else cursor - self.LOOKBACK
+        # Orders placed since the open orders were listed may still be open
+        if listed is not None:
+            start_at = min(start_at, listed - self.LOOKBACK)
+        if open_since is not None:
+            start_at = min(start_at, open_since)
+        return max(start_at, end_at - self.MAX_LOOKBACK)
+
+    def _relists(self, listed: int, end_at: int) -> bool:
+        return listed is None or end_at - listed >= self.OPEN_REFRESH
+
+    async def _open_orders(self, service: AsyncKuCoinService, user_id: int, auth: dict) -> list:
+        """
+        :return: ((signal id, user id), leg, creation time) of the user's signal orders that are still open
+        """
+        open_orders = []
+        for stop in (False, True):
+            async for order in service.iter_orders(status='active', stop=stop, **auth):
+                parsed = self._parse(order, user_id)
+                if parsed is not None:
+                    open_orders.append(((parsed[0], user_id), parsed[2], order.get('createdAt')))
+        return open_orders
+
+    async def _pull(self, service: AsyncKuCoinService, user_id: int, auth: dict, start_at: int, end_at: int,
+                    relist: bool) -> (list, list,):
+        """
+        :return: (fills of the done orders, see _open_orders, None when they were not listed)
+        """
+        # Listed first, an order done in between is then either open here or done below
+        open_orders = await self._open_orders(service, user_id, auth) if relist else None
+        fills = [fill async for order in service.iter_orders(status='done', start_at=start_at, end_at=end_at, **auth)
+                 if (fill := self._fill(order, user_id)) is not None]
+        return fills, open_orders
+
+    async def _pull_all(self, accounts: list, cursors: dict, end_at: int) -> list:
+        async with AsyncKuCoinService() as service:
+            return await asyncio.gather(*[self._pull(service, user_id, auth,
+                                                     start_at=self._start_at(*cursors[user_id], end_at=end_at),
+                                                     end_at=end_at, relist=self._relists(cursors[user_id][2], end_at))
+                                          for user_id, auth in accounts], return_exceptions=True)
+
+    @staticmethod
+    def _filled_and_open(legs: dict) -> bool:
+        main = legs.get('main')
+        return bool(main) and sum(leg['size'] for name, leg in legs.items() if name != 'main') < main['size']
+
+    def _open_since(self, open_orders: dict) -> dict:
+        """
+        :param open_orders: user id -> its open signal orders, see _open_orders
+        :return: user id -> creation time of its oldest order of a live trade, None when there is none. A trade is
+                 live while its main order is open, or filled and not closed by its legs yet
+        """
+        trades = list({trade for orders in open_orders.values() for trade, _, _ in orders})
+        main_open = {trade for orders in open_orders.values() for trade, leg, _ in orders if leg == 'main'}
+        live = {trade for trade, legs in zip(trades, self._legs(trades))
+                if trade in main_open or self._filled_and_open(legs)}
+        return {user_id: min((created for trade, _, created in orders if trade in live), default=None)
+                for user_id, orders in open_orders.items()}
+
+    def _move_cursors(self, synced: list, open_since: dict, end_at: int):
+        """
+        :param open_since: user id -> see _open_since, of the users whose open orders were listed
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.mset({self.REDIS_KEYS.get('cursor').format(user_id=user_id): end_at for user_id in synced})
+        for user_id, since in open_since.items():
+            key = self.REDIS_KEYS.get('open').format(user_id=user_id)
+            if since is None:
+                pipeline.delete(key)
+            else:
+                pipeline.set(key, since, ex=self.LEGS_TTL)
+            pipeline.set(self.REDIS_KEYS.get('listed').format(user_id=user_id), end_at, ex=self.LEGS_TTL)
+        pipeline.execute()
+
+    def _store_legs(self, fills: list) -> set:
+        pipeline = self.client.pipeline(transaction=False)
+        trades = set()
+        for trade, leg, fill in fills:
+            key = self.REDIS_KEYS.get('legs').format(signal_id=trade[0], user_id=trade[1])
+            pipeline.hset(key, leg, json.dumps(fill))
+            pipeline.expire(key, self.LEGS_TTL)
+            trades.add(trade)
+        pipeline.execute()
+        return trades
+
+    def _legs(self, trades: list) -> list:
+        """
+        :return: leg -> {side, size, value} of the filled legs of every trade
+        """
+        pipeline = self.client.pipeline(transaction=False)
+        for signal_id, user_id in trades:
+            pipeline.hgetall(self.REDIS_KEYS.get('legs').format(signal_id=signal_id, user_id=user_id))
+        return [{leg.decode(): json.loads(fill) for leg, fill in legs.items()} for legs in pipeline.execute()]
+
+    def _nets(self, trades: list) -> dict:
+        nets = {}
+        for trade, legs in zip(trades, self._legs(trades)):
+            net = self.calculate_net(legs)
+            if net is not None:
+                nets[trade] = net
+        return nets
+
+    @staticmethod
+    def _write(nets: dict) -> (int, int,):
+        existing = {(trade.signal_id, trade.user_id): trade for trade in
+                    Trade.objects.filter(signal_id__in={signal_id for signal_id, _ in nets},
+                                         user_id__in={user_id for _, user_id in nets})}
+        updated = []
+        for key, net in nets.items():
+            if key in existing:
+                existing[key].net = net
+                updated.append(existing[key])
+        created = [Trade(signal_id=signal_id, user_id=user_id, net=net)
+                   for (signal_id, user_id), net in nets.items() if (signal_id, user_id) not in existing]
+
+        if updated:
+            bulk_update_with_history(updated, Trade, fields=['net'])
+        if created:
+            bulk_create_with_history(created, Trade)
+        return len(created), len(updated)
+
+    def sync(self, accounts: list) -> dict:
+        """
+        :param accounts: (user id, {api_key, api_secret, api_passphrase}) of every account to sync
+        :return: counters of the cycle
+        """
+        end_at = int(time() * 1000)
+        cursors = self._cursors([user_id for user_id, _ in accounts])
+        results = asyncio.run(self._pull_all(accounts, cursors=cursors, end_at=end_at))
+
+        fills, synced, open_orders, failed = [], [], {}, 0
+        for (user_id, _), result in zip(accounts, results):
+            if isinstance(result, BaseException):
+                # The cursor stays put, the next cycle lists the same window again
+                logging.error('fill sync failed!', extra={'user_id': user_id, 'error': repr(result)})
+                failed += 1
+                continue
+            fills += result[0]
+            synced.append(user_id)
+            if result[1] is not None:
+                open_orders[user_id] = result[1]
+
+        trades = self._store_legs(fills) if fills else set()
+        created, updated = self._write(self._nets(list(trades))) if trades else (0, 0)
+        if synced:
+            # After the fills of the cycle are stored, a trade they closed is no longer waited for
+            self._move_cursors(synced, open_since=self._open_since(open_orders), end_at=end_at)
+
+        return {'accounts': len(accounts), 'failed': failed, 'fills': len(fills), 'trades': len(trades),
+                'created': created, 'updated': updated}
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from time import time
+from uuid import uuid4
+from _helpers import get_redis_client, get_async_redis_client
+from account.models import User
+from .services import BaseKuCoinService
+from .async_services import AsyncKuCoinService
+from .responses import Position
+
+
+class KillSwitch:
+    """
+    Emergency exit of a symbol, of a trader's army or of every account. All affected accounts are handled at
+    once on one event loop: their limit and stop orders are cancelled, then their positions closed at market.
+    Every request goes through the async service, so each account stays within its rate budgets and the
+    process within its adaptive concurrency window. Subscribers whose plan expired are included, they can
+    still hold positions. Progress is counted in a Redis hash as accounts complete. Running it again only
+    cancels and closes what is left.
+    """
+    PREFIX = 'KC:KILL'
+    REDIS_KEYS = {
+        'progress': f'{PREFIX}:''{kill_id}',
+    }
+    PROGRESS_TTL = 24 * 60 * 60
+    COUNTERS = ('done', 'failed', 'limit_orders', 'stop_orders', 'positions')
+
+    def __init__(self, symbol: str = None, trader_id: int = None):
+        """
+        :param symbol: the pair to get out of, every pair when None
+        :param trader_id: the trader whose army gets out, every account when None
+        """
+        self.symbol = symbol
+        self.trader_id = trader_id
+        self.kill_id = uuid4().hex[:16]
+
+    @classmethod
+    def _key(cls, kill_id: str) -> str:
+        return cls.REDIS_KEYS.get('progress').format(kill_id=kill_id)
+
+    def accounts(self) -> list:
+        """
+        :return: {api_key, api_secret, api_passphrase} of every affected account
+        """
+        users = User.objects.filter(kucoin__isnull=False)
+        if self.trader_id is not None:
+            users = users.filter(user_trader_id=self.trader_id)
+        return [dict(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase)
+                for api_key, api_secret, api_passphrase in users.values_list('kucoin__api_key',
+                                                                             'kucoin__api_secret',
+                                                                             'kucoin__api_passphrase')]
+
+    def _client_oid(self, symbol: str) -> str:
+        # Unique per run and symbol, the fill sync does not take it for a signal order
+        return f'kill-{self.kill_id}-{symbol}'
+
+    @staticmethod
+    def _cancelled(result) -> int:
+        return len(((result[1] or {}).get('data') or {}).get('cancelledOrderIds') or [])
+
+    async def _kill_account(self, service: AsyncKuCoinService, auth: dict) -> dict:
+        params = dict(symbol=self.symbol) if self.symbol else {}
+        limit_orders, stop_orders = await asyncio.gather(service.limit_order_mass_cancellation(**params, **auth),
+                                                         service.stop_order_mass_cancellation(**params, **auth))
+        # Listed once both cancellations went through, an order filled meanwhile has opened its position by now
+        positions = await service.get_position_list(**auth)
+        counts = {'limit_orders': self._cancelled(limit_orders), 'stop_orders': self._cancelled(stop_orders)}
+        failed = not (BaseKuCoinService._accepted(limit_orders) and BaseKuCoinService._accepted(stop_orders) and
+                      BaseKuCoinService._accepted(positions))
+
+        positions = [position for position in Position.from_json_list((positions[1] or {}).get('data'))
+                     if not position.closed and (self.symbol is None or position.symbol == self.symbol)]
+        closed = await asyncio.gather(*[service.close_position(symbol=position.symbol,
+                                                               client_oid=self._client_oid(position.symbol), **auth)
+                                        for position in positions])
+        counts['positions'] = sum(map(BaseKuCoinService._accepted, closed))
+        counts['failed'] = int(failed or counts['positions'] < len(positions))
+        return counts
+
+    async def _account(self, service: AsyncKuCoinService, client, auth: dict):
+        try:
+            counts = await self._kill_account(service, auth)
+        except Exception as e:
+            logging.error('kill switch failed on an account!', extra={'kill_id': self.kill_id,
+                                                                      'api_key': auth['api_key'], 'error': repr(e)})
+            counts = {'failed': 1}
+
+        key = self._key(self.kill_id)
+        pipeline = client.pipeline(transaction=False)
+        pipeline.hincrby(key, 'done', 1)
+        for field, count in counts.items():
+            if count:
+                pipeline.hincrby(key, field, count)
+        pipeline.hset(key, 'updated', time())
+        await pipeline.execute()
+
+    async def _run(self, accounts: list):
+        key = self._key(self.kill_id)
+        client = get_async_redis_client()
+        try:
+            await client.hset(key, mapping={'accounts': len(accounts), 'started': time(),
+                                            **dict.fromkeys(self.COUNTERS, 0)})
+            await client.expire(key, self.PROGRESS_TTL)
+            async with AsyncKuCoinService() as service:
+                await asyncio.gather(*[self._account(service, client, auth) for auth in accounts])
+            await client.hset(key, 'finished', time())
+        finally:
+            await client.close()
+
+    def run(self) -> dict:
+        """
+        :return: the final progress, see progress
+        """
+        asyncio.run(self._run(self.accounts()))
+        return self.progress(self.kill_id)
+
+    @classmethod
+    def progress(cls, kill_id: str) -> dict:
+        """
+        :return: accounts, done, failed, cancelled limit_orders and stop_orders, closed positions, started,
+                 updated and finished (unix times) and elapsed seconds of the run, empty when it is unknown
+        """
+        progress = get_redis_client().hgetall(cls._key(kill_id))
+        progress = {field.decode(): float(value) for field, value in progress.items()}
+        if 'started' in progress:
+            progress['elapsed'] = progress.get('finished', time()) - progress['started']
+        return {field: value if field in ('started', 'updated', 'finished', 'elapsed') else int(value)
+                for field, value in progress.items()}
@@ -0,0 +1,149 @@
+import logging
+import threading
+from time import time
+from datetime import datetime, timezone
+from collections import deque
+from django.apps import apps
+from django.db import close_old_connections
+from _helpers import singleton
+from .services import BaseKuCoinService
+
+
+@singleton
+class ExecutionLedger:
+    """
+    In-memory buffer of execution results in front of the Execution table.
+    Workers only append a raw tuple, a daemon thread turns them into rows and writes them with one bulk_create
+    per BATCH_SIZE, as soon as a batch is full or every FLUSH_INTERVAL seconds. A failed write is retried with
+    the next flush. Once MAX_BUFFER entries are pending a worker blocks until a flush makes room, for at most
+    FULL_TIMEOUT seconds; an entry that still does not fit is logged and counted in dropped, never discarded
+    silently. Without BACKGROUND_FLUSH (tests, benchmarks) nothing is written but by an explicit flush, in the
+    caller's thread and transaction.
+    """
+    BATCH_SIZE = 500
+    FLUSH_INTERVAL = 2
+    MAX_BUFFER = 100000
+    FULL_TIMEOUT = 5
+    BACKGROUND_FLUSH = True
+
+    def __init__(self):
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._room = threading.Condition()
+        self.dropped = 0
+        self._full = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, signal_id: int, user_id: int, result=None, error: BaseException = None,
+               queue_delay: float = None, duration: float = None, dropped=False):
+        """
+        :param result: (main_order, tp_orders, sl_order) of a completed execution
+        :param error: exception the execution raised, or why it was dropped
+        """
+        if self._thread is None and self.BACKGROUND_FLUSH:
+            self.start()
+        entry = (signal_id, user_id, result, error, queue_delay, duration, time(), dropped)
+        with self._room:
+            if not self._room.wait_for(lambda: len(self._buffer) < self.MAX_BUFFER, self.FULL_TIMEOUT):
+                self.dropped += 1
+                logging.error('execution ledger is full, an execution is not recorded!',
+                              extra={'signal_id': signal_id, 'user_id': user_id, 'dropped': self.dropped})
+                return
+            self._buffer.append(entry)
+        if len(self._buffer) >= self.BATCH_SIZE:
+            self._full.set()
+
+    @staticmethod
+    def _order_id(result) -> str:
+        if not BaseKuCoinService._accepted(result):
+            return ''
+        return (result[1].get('data') or {}).get('orderId') or ''
+
+    @staticmethod
+    def _describe(result) -> str:
+        if isinstance(result, BaseException):
+            return repr(result)
+        if isinstance(result, tuple):
+            return f'{result[0]}: {(result[1] or {}).get("msg") or (result[1] or {}).get("code")}'
+        return ''
+
+    def _row(self, entry: tuple):
+        # Resolved lazily, the models import the services that record here
+        Execution = apps.get_model('exchange', 'Execution')
+        signal_id, user_id, result, error, queue_delay, duration, executed, dropped = entry
+        row = Execution(signal_id=signal_id, user_id=user_id, queue_delay=queue_delay, duration=duration,
+                        executed=datetime.fromtimestamp(executed, tz=timezone.utc))
+        if dropped or error is not None:
+            row.status = (Execution.StatusChoices.FAILED, Execution.StatusChoices.DROPPED)[dropped]
+            row.error = self._describe(error)
+            return row
+
+        main_order, tp_orders, sl_order = result
+        row.main_order_id = self._order_id(main_order)
+        row.tp_order_ids = [order_id for order_id in map(self._order_id, tp_orders) if order_id]
+        row.sl_order_id = self._order_id(sl_order)
+        if not BaseKuCoinService._accepted(main_order):
+            row.status, row.error = Execution.StatusChoices.REJECTED, self._describe(main_order)
+        elif not BaseKuCoinService._accepted(sl_order):
+            row.status, row.error = Execution.StatusChoices.UNPROTECTED, self._describe(sl_order)
+        else:
+            row.status = Execution.StatusChoices.PROTECTED
+        return row
+
+    def _take(self) -> list:
+        batch = []
+        with self._room:
+            while self._buffer and len(batch) < self.BATCH_SIZE:
+                batch.append(self._buffer.popleft())
+            self._room.notify_all()
+        return batch
+
+    def flush(self) -> int:
+        """
+        :return: number of executions written
+        """
+        written = 0
+        # One writer at a time, the periodic flush and an explicit one never split a batch between them
+        with self._lock:
+            while batch := self._take():
+                try:
+                    apps.get_model('exchange', 'Execution').objects.bulk_create([self._row(entry) for entry in batch])
+                except Exception:
+                    # Back in front of what was recorded meanwhile, the buffer is unbounded here and loses nothing
+                    with self._room:
+                        self._buffer.extendleft(reversed(batch))
+                    raise
+                written += len(batch)
+        return written
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._full.wait(self.FLUSH_INTERVAL)
+            self._full.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logging.exception('writing the execution ledger failed!', extra={'pending': len(self._buffer)})
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='execution-ledger', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background flush once its current write is done, pending entries stay buffered.
+        """
+        thread, self._thread = self._thread, None
+        self._stop.set()
+        self._full.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
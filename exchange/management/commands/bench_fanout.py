@@ -0,0 +1,145 @@
+import time
+import asyncio
+import numpy as np
+from uuid import uuid4
+from unittest import mock
+from django.core.management.base import BaseCommand
+from account.models import User
+from market.models import Signal
+from exchange.services import KuCoinService, BaseKuCoinService
+from exchange.async_services import AsyncKuCoinService
+from exchange.contracts import ContractStore
+from exchange.ledger import ExecutionLedger
+from exchange.tasks import KuCoinTasks
+from exchange.mock_server import MockKuCoinServer
+from exchange.snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Drives a full signal fan-out against a local KuCoin mock and reports time-to-protected-position'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, nargs='+', default=[100, 1000])
+        parser.add_argument('--mode', choices=('threads', 'async'), default='async')
+        parser.add_argument('--legs-mode', choices=(BaseKuCoinService.LEGS_SEQUENTIAL,
+                                                    BaseKuCoinService.LEGS_CONCURRENT,
+                                                    BaseKuCoinService.LEGS_BATCH),
+                            default=BaseKuCoinService.LEGS_MODE)
+        parser.add_argument('--latency', type=float, default=0.05, help='mean server latency in seconds')
+        parser.add_argument('--jitter', type=float, default=0.01, help='latency standard deviation in seconds')
+        parser.add_argument('--rate-429', type=float, default=0.0, help='share of requests answered with 429')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 500')
+        parser.add_argument('--no-limiter', action='store_true', help='skip the Redis client-side rate limiter')
+        parser.add_argument('--fixed-concurrency', action='store_true',
+                            help='skip the adaptive (AIMD) bound on requests in flight')
+
+    @staticmethod
+    def _signal() -> SignalSnapshot:
+        return SignalSnapshot(pk=1, pair='XBTUSDTM', order_type=Signal.OrderChoices.LIMIT,
+                              type=Signal.TypeChoices.LONG, entry=20000, targets=(21000, 22000, 23000),
+                              stop_loss=19000, capital=0.1, leverage=5)
+
+    @staticmethod
+    def _accounts(server: MockKuCoinServer, count: int) -> list:
+        accounts = [AccountSnapshot(pk=it + 1, strategy=User.StrategyChoices.LOW, cap=None, api_key=uuid4().hex,
+                                    api_secret=uuid4().hex, api_passphrase=uuid4().hex) for it in range(count)]
+        for account in accounts:
+            server.add_account(account.api_key, account.api_secret, account.api_passphrase)
+        return accounts
+
+    @staticmethod
+    def _protected(result) -> bool:
+        main, tps, sl = result
+        return BaseKuCoinService._accepted(main) and BaseKuCoinService._accepted(sl)
+
+    def _run_threads(self, execution: ExecutionSnapshot, legs_mode: str) -> list:
+        """
+        The army goes through KuCoinTasks.trade like a published signal: planned, queued on the DeadlineScheduler
+        and recorded in the ledger, whose entries time every account.
+        """
+        service: KuCoinService = KuCoinService()
+        ledger: ExecutionLedger = ExecutionLedger()
+        recorded = []
+
+        def flush() -> int:
+            # The synthetic accounts have no rows to write, their entries time the run instead
+            while batch := ledger._take():
+                recorded.extend(batch)
+            return len(recorded)
+
+        start = time.time()
+        with mock.patch.object(ExecutionSnapshot, 'load', return_value=execution), \
+                mock.patch.object(service, 'LEGS_MODE', legs_mode), \
+                mock.patch.object(ledger, 'flush', side_effect=flush):
+            KuCoinTasks.trade(execution.signal)
+        return [(executed - start, error is None and self._protected(result))
+                for _, _, result, error, _, _, executed, _ in recorded]
+
+    async def _run_async(self, execution: ExecutionSnapshot, legs_mode: str, base_url: str, no_limiter: bool,
+                         fixed_concurrency: bool) -> list:
+        async with AsyncKuCoinService() as service:
+            service.BASE_URL = base_url
+            service.RATE_LIMITED = not no_limiter
+            service.CONCURRENCY_LIMITED = not fixed_concurrency
+            start = time.perf_counter()
+            snapshots = service.balances.get_many(execution.api_keys)
+
+            async def trade(account: AccountSnapshot):
+                try:
+                    balance = await service.get_recent_balance(**account.auth, snapshots=snapshots)
+                    result = await service.execute_signal(**account.auth, signal=execution.signal, user=account,
+                                                          usable_balance=account.usable_balance(balance,
+                                                                                                execution.signal),
+                                                          legs_mode=legs_mode)
+                    return time.perf_counter() - start, self._protected(result)
+                except Exception:
+                    return time.perf_counter() - start, False
+
+            results = await asyncio.gather(*[trade(account) for account in execution.accounts])
+            self.concurrency = service.concurrency.stats()
+            return results
+
+    def handle(self, *args, **options):
+        server = MockKuCoinServer(latency=options['latency'], jitter=options['jitter'],
+                                  rate_429=options['rate_429'], error_rate=options['error_rate'])
+        base_url = server.start()
+
+        service: KuCoinService = KuCoinService()
+        service.BASE_URL = base_url
+        service.RATE_LIMITED = not options['no_limiter']
+        service.CONCURRENCY_LIMITED = not options['fixed_concurrency']
+        ContractStore().update(service.fetch_contracts())
+        ledger: ExecutionLedger = ExecutionLedger()
+        ledger.stop()
+        ledger.BACKGROUND_FLUSH = False
+        signal = self._signal()
+
+        self.stdout.write(f'mode: {options["mode"]}, legs: {options["legs_mode"]}, '
+                          f'latency: {options["latency"] * 1000:.0f}±{options["jitter"] * 1000:.0f} ms, '
+                          f'429: {options["rate_429"]:.1%}, errors: {options["error_rate"]:.1%}')
+        try:
+            for subscribers in options['subscribers']:
+                execution = ExecutionSnapshot(signal=signal, accounts=tuple(self._accounts(server, subscribers)))
+                requests = server.counters['requests']
+                start = time.perf_counter()
+                if options['mode'] == 'threads':
+                    results = self._run_threads(execution, options['legs_mode'])
+                    self.concurrency = service.concurrency.stats()
+                else:
+                    results = asyncio.run(self._run_async(execution, options['legs_mode'], base_url,
+                                                          options['no_limiter'], options['fixed_concurrency']))
+                elapsed = time.perf_counter() - start
+                requests = server.counters['requests'] - requests
+
+                protected = np.array([took for took, ok in results if ok])
+                p50, p99 = np.percentile(protected, (50, 99)) if protected.size else (float('nan'),) * 2
+                self.stdout.write(f'subscribers: {subscribers:>6}  protected: {protected.size:>6}  '
+                                  f'p50: {p50 * 1000:8.1f} ms  p99: {p99 * 1000:8.1f} ms  '
+                                  f'wall: {elapsed:7.2f} s  throughput: {requests / elapsed:8.1f} req/s, '
+                                  f'{protected.size / elapsed:7.1f} positions/s')
+                if not options['fixed_concurrency']:
+                    points = {point: limit['limit'] for point, limit in self.concurrency['points'].items()}
+                    self.stdout.write(f'in flight limit: {self.concurrency["total"]["limit"]}, per endpoint: {points}')
+        finally:
+            server.stop()
+        self.stdout.write(f'server: {server.counters}')
@@ -0,0 +1,77 @@
+import re
+import json
+import time
+from uuid import uuid4
+from django.core.management.base import BaseCommand
+from exchange.services import BaseKuCoinService
+from .bench_signing import legacy_header
+
+
+def legacy_prepare(base_url: str, api_key: str, api_secret: str, api_passphrase: str, point: str, **kwargs):
+    """ Request encoding before compiled endpoints, kept as the benchmark baseline. """
+    req = BaseKuCoinService.REQUESTS.get(point)
+    endpoint = req.get('endpoint')
+    method = req.get('method')
+
+    keys = re.findall(r'/{(.+?)}', endpoint)
+    endpoint = endpoint.format(**{key: kwargs[key] for key in kwargs.keys()})
+    [kwargs.pop(key) for key in keys]
+
+    endpoint += '?'
+    for key in kwargs.keys():
+        endpoint += f'{key}={kwargs[key]}&'
+    endpoint = endpoint[:-1]
+
+    data_json = json.dumps(kwargs).replace(' ', '')
+    data_json = (data_json, None)[data_json in ('null', '{}')]
+    header = legacy_header(api_key, api_secret, api_passphrase, method, endpoint, data_json)
+    return f'{base_url}{endpoint}', header, data_json
+
+
+class Command(BaseCommand):
+    help = 'Measures CPU cost per request of encoding and signing the orders of a signal fan-out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=10, help='signal fan-outs to replay')
+
+    @staticmethod
+    def _requests(accounts: list) -> list:
+        service = BaseKuCoinService
+        requests = []
+        for account in accounts:
+            main, tps, sl = service._order_legs(symbol='XBTUSDTM', leverage='5', price='20000', order_type='limit',
+                                                size='25', tp_prices=[21000, 22000, 23000], stop_price='19000',
+                                                tp_sizes=[5, 7, 13], type='long')
+            requests += [(account, 'place_order', params) for params in (main, *tps, sl)]
+            requests.append((account, 'cancel_order', {'order_id': uuid4().hex}))
+            requests.append((account, 'get_order_list', {'status': 'active', 'symbol': 'XBTUSDTM'}))
+        return requests
+
+    @staticmethod
+    def _run(prepare, requests: list, rounds: int) -> float:
+        start = time.process_time()
+        for _ in range(rounds):
+            for account, point, params in requests:
+                prepare(account, point, dict(params))
+        return (time.process_time() - start) / (len(requests) * rounds)
+
+    def handle(self, *args, **options):
+        service = BaseKuCoinService()
+        accounts = [dict(api_key=uuid4().hex, api_secret=uuid4().hex, api_passphrase=uuid4().hex)
+                    for _ in range(options['accounts'])]
+        requests = self._requests(accounts)
+
+        def before(account, point, params):
+            return legacy_prepare(service.BASE_URL, point=point, **account, **params)
+
+        def after(account, point, params):
+            method, endpoint, data = service._resolve(point=point, **params)
+            return service._prepare_request(method=method, endpoint=endpoint, data=data, **account)
+
+        before_cost = self._run(before, requests, options['rounds'])
+        after_cost = self._run(after, requests, options['rounds'])
+
+        self.stdout.write(f'requests per fan-out: {len(requests)}, rounds: {options["rounds"]}')
+        self.stdout.write(f'before: {before_cost * 1e6:.2f} us CPU/request')
+        self.stdout.write(f'after: {after_cost * 1e6:.2f} us CPU/request ({before_cost / after_cost:.2f}x)')
@@ -0,0 +1,62 @@
+import time
+import base64
+import hmac
+import hashlib
+from uuid import uuid4
+from django.core.management.base import BaseCommand
+from exchange.signing import get_signer
+
+
+def legacy_header(api_key: str, api_secret: str, api_passphrase: str, method: str, endpoint: str, data=None):
+    """ Header construction before per-credential signers, kept as the benchmark baseline. """
+    now = int(time.time() * 1000)
+    str_to_sign = '{now}{method}{endpoint}'.format(now=now, method=method.upper(), endpoint=endpoint)
+    if data:
+        str_to_sign += data
+    signature = base64.b64encode(
+        hmac.new(api_secret.encode('utf-8'), str_to_sign.encode('utf-8'), hashlib.sha256).digest())
+    passphrase = base64.b64encode(
+        hmac.new(api_secret.encode('utf-8'), api_passphrase.encode('utf-8'), hashlib.sha256).digest())
+    return {
+        "KC-API-SIGN": signature,
+        "KC-API-TIMESTAMP": str(now),
+        "KC-API-KEY": api_key,
+        "KC-API-PASSPHRASE": passphrase,
+        "KC-API-KEY-VERSION": "2",
+        'Content-Type': 'application/json'
+    }
+
+
+def signed_header(api_key: str, api_secret: str, api_passphrase: str, method: str, endpoint: str, data=None):
+    return get_signer(api_key=api_key, api_secret=api_secret,
+                      api_passphrase=api_passphrase).get_header(method=method, endpoint=endpoint,
+                                                                is_json=True, data=data)
+
+
+class Command(BaseCommand):
+    help = 'Measures request headers/sec of KuCoin signing for a signal fan-out'
+
+    ENDPOINT = '/api/v1/orders'
+    DATA = '{"clientOid":"%s","side":"buy","symbol":"XBTUSDTM","leverage":"5","price":"20000","size":"25",' \
+           '"type":"limit"}' % uuid4().hex
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=20, help='signal fan-outs to replay')
+
+    def _run(self, build, accounts: list, rounds: int) -> float:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for api_key, api_secret, api_passphrase in accounts:
+                build(api_key, api_secret, api_passphrase, 'POST', self.ENDPOINT, self.DATA)
+        return len(accounts) * rounds / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        accounts = [(uuid4().hex, uuid4().hex, uuid4().hex) for _ in range(options['accounts'])]
+
+        before = self._run(legacy_header, accounts, options['rounds'])
+        after = self._run(signed_header, accounts, options['rounds'])
+
+        self.stdout.write(f'accounts: {len(accounts)}, rounds: {options["rounds"]}')
+        self.stdout.write(f'before: {before:,.0f} headers/sec')
+        self.stdout.write(f'after: {after:,.0f} headers/sec ({after / before:.2f}x)')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from exchange.dispatch import ShardWorker
+
+
+class Command(BaseCommand):
+    help = 'Executes signal shards from the dispatch stream, any number of workers may run on any node'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', type=str, default=None, help='consumer name, host:pid by default')
+        parser.add_argument('--workers', type=int, default=None, help='accounts executed concurrently')
+
+    def handle(self, *args, **options):
+        worker = ShardWorker(name=options['name'], workers=options['workers'])
+        self.stdout.write(f'consuming as {worker.name}')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,35 @@
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from exchange.kill_switch import KillSwitch
+
+
+class Command(BaseCommand):
+    help = 'Cancels the orders and closes the positions of a symbol, a trader\'s army or every account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbol', type=str, default=None, help='pair to get out of, every pair by default')
+        parser.add_argument('--trader', type=int, default=None, help='trader id whose army gets out')
+        parser.add_argument('--all', action='store_true', help='required to kill every account')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds between progress lines')
+
+    def _report(self, progress: dict):
+        self.stdout.write(f'{progress.get("done", 0)}/{progress.get("accounts", 0)} accounts, '
+                          f'failed: {progress.get("failed", 0)}, '
+                          f'limit orders: {progress.get("limit_orders", 0)}, '
+                          f'stop orders: {progress.get("stop_orders", 0)}, '
+                          f'positions: {progress.get("positions", 0)}, '
+                          f'{progress.get("elapsed", 0.0):.2f}s')
+
+    def handle(self, *args, **options):
+        if options['trader'] is None and not options['all']:
+            raise CommandError('pass --trader or, to kill every account, --all')
+
+        kill_switch = KillSwitch(symbol=options['symbol'], trader_id=options['trader'])
+        self.stdout.write(f'kill {kill_switch.kill_id}: {options["symbol"] or "every pair"} of '
+                          f'{"trader " + str(options["trader"]) if options["trader"] is not None else "every account"}')
+        thread = threading.Thread(target=kill_switch.run, name='kill-switch')
+        thread.start()
+        while thread.is_alive():
+            thread.join(options['interval'])
+            self._report(KillSwitch.progress(kill_switch.kill_id))
+        self.stdout.write('done')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from exchange.metrics import RequestMetrics
+
+
+class Command(BaseCommand):
+    help = 'Prints the KuCoin client latency and status metrics merged over every running process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='drops the published metrics')
+        parser.add_argument('--overhead', action='store_true', help='measures the CPU cost of recording a request')
+
+    def handle(self, *args, **options):
+        metrics: RequestMetrics = RequestMetrics()
+        if options['overhead']:
+            self.stdout.write(f'record: {metrics.overhead() * 1e6:.2f} us CPU/request')
+            return
+        if options['reset']:
+            metrics.reset()
+            self.stdout.write('metrics reset')
+            return
+
+        snapshot = metrics.snapshot()
+        self.stdout.write(f'processes: {snapshot["processes"]}, connections: {snapshot["connections"]}')
+        for point, data in snapshot['points'].items():
+            self.stdout.write(f'{point}: {data["count"]} requests, statuses: {data["statuses"]}, '
+                              f'429: {data["throttled"]}, retries: {data["retries"]}, shared: {data["shared"]}')
+            for phase, quantiles in data['latency_ms'].items():
+                self.stdout.write(f'    {phase:>4}  ' + '  '.join(f'{name}: {value:8.2f} ms'
+                                                               for name, value in quantiles.items()))
+        for lane, data in snapshot['lanes'].items():
+            self.stdout.write(f'{lane}: {data["count"]} executions queued  ' +
+                              '  '.join(f'{name}: {value:8.2f} ms' for name, value in data['delay_ms'].items()))
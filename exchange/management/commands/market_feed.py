@@ -0,0 +1,38 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from market.services import MarketService
+from exchange.async_services import AsyncKuCoinService
+from exchange.prices import MarkPriceBoard
+from exchange.streams import PublicStream
+
+
+class Command(BaseCommand):
+    help = 'Streams mark and last prices of the pairs with open signals into the shared mark price board'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refresh', type=int, default=60, help='seconds between open pair lookups')
+
+    @staticmethod
+    async def _open_pairs() -> list:
+        service: MarketService = MarketService()
+        return await asyncio.get_running_loop().run_in_executor(None, service.get_open_pairs)
+
+    async def _run(self, refresh: int):
+        board = MarkPriceBoard(create=True)
+        try:
+            async with AsyncKuCoinService() as service:
+                stream = PublicStream(service, board=board, symbols=await self._open_pairs())
+                task = asyncio.ensure_future(stream.run())
+                self.stdout.write(f'following {len(stream.symbols)} pairs')
+                try:
+                    while True:
+                        await asyncio.sleep(refresh)
+                        await stream.follow(await self._open_pairs())
+                finally:
+                    stream.stop()
+                    task.cancel()
+        finally:
+            board.close()
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(refresh=options['refresh']))
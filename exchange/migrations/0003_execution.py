@@ -0,0 +1,34 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:10
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0006_historicaluser_cap_user_cap'),
+        ('market', '0002_alter_historicalsignal_status_alter_signal_status'),
+        ('exchange', '0002_alter_kucoin_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Execution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('protected', 'PROTECTED'), ('unprotected', 'UNPROTECTED'), ('rejected', 'REJECTED'), ('failed', 'FAILED'), ('dropped', 'DROPPED')], max_length=12)),
+                ('main_order_id', models.CharField(blank=True, max_length=64)),
+                ('tp_order_ids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=64), blank=True, default=list, size=None)),
+                ('sl_order_id', models.CharField(blank=True, max_length=64)),
+                ('error', models.TextField(blank=True)),
+                ('queue_delay', models.FloatField(null=True)),
+                ('duration', models.FloatField(null=True)),
+                ('executed', models.DateTimeField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('signal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='executions', to='market.signal')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='executions', to='account.user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,117 @@
+import time
+import threading
+from _helpers import singleton
+from .responses import Order, Position
+
+
+class AccountMirror:
+    """
+    In-memory open orders and positions of one account. It is seeded from a REST snapshot and then kept
+    current by the private websocket feed, readers get Order and Position models without touching the exchange.
+    The feed thread writes under a lock and readers take their snapshot under the same lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.orders = {}
+        self.positions = {}
+        self.balances = {}
+        self.ready = False
+        self.updated = 0.0
+
+    def _touch(self):
+        self.updated = time.monotonic()
+
+    def load(self, orders: list, positions: list):
+        orders = {order.id: order for order in Order.from_json_list(orders)}
+        positions = {position.symbol: position
+                     for position in Position.from_json_list([position for position in positions
+                                                              if position.get('isOpen', True)])}
+        with self._lock:
+            self.orders, self.positions = orders, positions
+            self.ready = True
+            self._touch()
+
+    def apply_order(self, data: dict):
+        """
+        :param data: order change with its stream event type under changeType (type is the order type in REST)
+        """
+        # Stream messages name the id orderId while REST snapshots call it id
+        order_id = data.get('orderId') or data.get('id')
+        done = data.get('status') == 'done' or data.get('changeType') in ('canceled', 'filled', 'triggered', 'cancel')
+        with self._lock:
+            if done:
+                self.orders.pop(order_id, None)
+            elif order_id in self.orders:
+                self.orders[order_id].update(data)
+            else:
+                self.orders[order_id] = Order.from_json({**data, 'id': order_id})
+            self._touch()
+
+    def apply_position(self, data: dict, symbol: str = None):
+        symbol = data.get('symbol') or symbol
+        with self._lock:
+            position = self.positions.get(symbol)
+            if position is None:
+                position = Position.from_json({**data, 'symbol': symbol})
+            else:
+                position.update(data)
+            if position.closed:
+                self.positions.pop(symbol, None)
+            else:
+                self.positions[symbol] = position
+            self._touch()
+
+    def apply_balance(self, data: dict):
+        # Wallet pushes carry the exchange time in milliseconds
+        balance = (float(data.get('availableBalance')), (data.get('timestamp') or time.time() * 1000) / 1000)
+        with self._lock:
+            self.balances[data.get('currency')] = balance
+            self._touch()
+
+    def balance(self, currency: str, max_age: float) -> float:
+        """
+        :return: available balance pushed by the feed, None when none arrived in the last max_age seconds
+        """
+        with self._lock:
+            balance, ts = self.balances.get(currency, (None, 0.0))
+        return balance if time.time() - ts <= max_age else None
+
+    def position(self, symbol: str) -> Position:
+        """
+        :return: open position of the symbol, None when there is none
+        """
+        with self._lock:
+            return self.positions.get(symbol)
+
+    def open_orders(self, symbol: str = None) -> list:
+        with self._lock:
+            orders = list(self.orders.values())
+        return [order for order in orders if symbol is None or order.symbol == symbol]
+
+    def order(self, order_id: str) -> Order:
+        with self._lock:
+            return self.orders.get(order_id)
+
+
+@singleton
+class MirrorRegistry:
+    """
+    Process-wide api_key -> AccountMirror of the accounts that have a live private feed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mirrors = {}
+
+    def register(self, api_key: str) -> AccountMirror:
+        with self._lock:
+            return self._mirrors.setdefault(api_key, AccountMirror())
+
+    def unregister(self, api_key: str):
+        with self._lock:
+            self._mirrors.pop(api_key, None)
+
+    def get(self, api_key: str):
+        mirror = self._mirrors.get(api_key)
+        return mirror if mirror is not None and mirror.ready else None
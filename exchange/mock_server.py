@@ -0,0 +1,249 @@
+import time
+import json
+import base64
+import hmac
+import hashlib
+import random
+import asyncio
+import threading
+from uuid import uuid4
+from aiohttp import web
+from .services import BaseKuCoinService
+
+
+class MockKuCoinServer:
+    """
+    Local stand-in of the KuCoin futures REST API serving every endpoint of BaseKuCoinService.REQUESTS.
+    It checks request signatures of the registered accounts, enforces the documented per-account limits
+    and injects latency, 429s and server errors so fan-outs can be measured without the real exchange.
+    """
+
+    SUCCESS = '200000'
+    # Clock slack granted to clients pacing exactly at the documented limit
+    LIMIT_SLACK = 0.05
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, rate_429=0.0, error_rate=0.0,
+                 verify_signatures=True, enforce_limits=True, contracts: list = None, balance=1000.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.verify_signatures = verify_signatures
+        self.enforce_limits = enforce_limits
+        self.contracts = contracts or [self.contract('XBTUSDTM', mark_price=20000, multiplier=0.001)]
+        self.balance = balance
+        self.accounts = {}
+        self.buckets = {}
+        self.orders = {}
+        self.done_orders = {}
+        self.counters = {'requests': 0, 'rejected_signatures': 0, 'throttled': 0, 'errors': 0}
+        self.runner = None
+        self.url = None
+        self._loop = None
+
+    @staticmethod
+    def contract(symbol: str, mark_price: float, multiplier: float, lot_size=1, max_leverage=100) -> dict:
+        return {'symbol': symbol, 'lotSize': lot_size, 'multiplier': multiplier, 'maxOrderQty': 1000000,
+                'maxLeverage': max_leverage, 'markPrice': mark_price, 'status': 'Open', 'settleCurrency': 'USDT'}
+
+    def add_account(self, api_key: str, api_secret: str, api_passphrase: str):
+        self.accounts[api_key] = (api_secret, api_passphrase)
+
+    def add_done_orders(self, api_key: str, orders: list):
+        """
+        :param orders: done orders of the account, each with its createdAt in milliseconds
+        """
+        self.done_orders.setdefault(api_key, []).extend(orders)
+
+    @staticmethod
+    def _reply(data, code=SUCCESS, status=200, msg=None):
+        payload = {'code': code, 'data': data}
+        if msg:
+            payload['msg'] = msg
+        return web.json_response(payload, status=status)
+
+    def _authenticate(self, request, body: str) -> bool:
+        api_key = request.headers.get('KC-API-KEY')
+        if api_key not in self.accounts:
+            return False
+        api_secret, api_passphrase = self.accounts[api_key]
+        secret = api_secret.encode('utf-8')
+        str_to_sign = f'{request.headers.get("KC-API-TIMESTAMP")}{request.method}{request.raw_path}{body}'
+        sign = base64.b64encode(hmac.new(secret, str_to_sign.encode('utf-8'), hashlib.sha256).digest()).decode()
+        passphrase = base64.b64encode(hmac.new(secret, api_passphrase.encode('utf-8'), hashlib.sha256).digest()).decode()
+        return hmac.compare_digest(sign, request.headers.get('KC-API-SIGN', '')) and \
+            hmac.compare_digest(passphrase, request.headers.get('KC-API-PASSPHRASE', ''))
+
+    def _throttled(self, api_key: str, point: str) -> bool:
+        rate_limit = BaseKuCoinService.REQUESTS[point].get('rate_limit')
+        if not self.enforce_limits or not rate_limit:
+            return False
+        limit, period = rate_limit
+        now = time.monotonic()
+        tokens, ts = self.buckets.get((api_key, point), (limit, now))
+        tokens = min(limit, tokens + (now - ts) * limit / period)
+        if tokens + self.LIMIT_SLACK * limit / period < 1:
+            self.buckets[(api_key, point)] = (tokens, now)
+            return True
+        self.buckets[(api_key, point)] = (tokens - 1, now)
+        return False
+
+    def _handler(self, point: str):
+        public = BaseKuCoinService.REQUESTS[point].get('public')
+        respond = getattr(self, f'_{point}')
+
+        async def handler(request):
+            self.counters['requests'] += 1
+            body = await request.text()
+            if self.latency or self.jitter:
+                await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+            api_key = request.headers.get('KC-API-KEY')
+            if not public and self.verify_signatures and not self._authenticate(request, body):
+                self.counters['rejected_signatures'] += 1
+                return self._reply(None, code='400005', status=401, msg='Invalid KC-API-SIGN')
+            if (not public and self._throttled(api_key, point)) or random.random() < self.rate_429:
+                self.counters['throttled'] += 1
+                return self._reply(None, code='429000', status=429, msg='Too Many Requests')
+            if random.random() < self.error_rate:
+                self.counters['errors'] += 1
+                return self._reply(None, code='500000', status=500, msg='Internal Server Error')
+
+            params = dict(request.query)
+            params.update(request.match_info)
+            data = respond(api_key, params, json.loads(body) if body else None)
+            return data if isinstance(data, web.Response) else self._reply(data)
+
+        return handler
+
+    def _new_order(self, api_key: str, order: dict) -> str:
+        order_id = uuid4().hex
+        self.orders.setdefault(api_key, {})[order_id] = dict(order, id=order_id, status='open', isActive=True,
+                                                             createdAt=int(time.time() * 1000))
+        return order_id
+
+    def fill_order(self, api_key: str, order_id: str, deal_value: float, deal_size: float = None):
+        """
+        Completes an open order, it moves to the done orders filled at deal_value.
+        """
+        order = self.orders[api_key].pop(order_id)
+        self.add_done_orders(api_key, [dict(order, status='done', isActive=False,
+                                            dealSize=deal_size or order.get('size'), dealValue=deal_value)])
+
+    def _get_account_overview(self, api_key, params, body):
+        return {'availableBalance': self.balance, 'accountEquity': self.balance,
+                'currency': params.get('currency', 'USDT')}
+
+    def _place_order(self, api_key, params, body):
+        return {'orderId': self._new_order(api_key, body)}
+
+    def _place_multiple_orders(self, api_key, params, body):
+        return [{'orderId': self._new_order(api_key, order), 'clientOid': order.get('clientOid'),
+                 'symbol': order.get('symbol'), 'code': self.SUCCESS, 'msg': 'success'} for order in body]
+
+    def _cancel_order(self, api_key, params, body):
+        self.orders.get(api_key, {}).pop(params['order_id'], None)
+        return {'cancelledOrderIds': [params['order_id']]}
+
+    def _open_orders(self, api_key, params, stop: bool) -> list:
+        return [order for order in self.orders.get(api_key, {}).values()
+                if bool(order.get('stop')) == stop and params.get('symbol', order.get('symbol')) == order.get('symbol')]
+
+    @staticmethod
+    def _paginate(items: list, params: dict) -> dict:
+        page, page_size = int(params.get('currentPage', 1)), int(params.get('pageSize', 50))
+        return {'currentPage': page, 'pageSize': page_size, 'totalNum': len(items),
+                'totalPage': -(-len(items) // page_size), 'items': items[(page - 1) * page_size:page * page_size]}
+
+    def _done_orders(self, api_key, params):
+        end_at = int(params.get('endAt') or time.time() * 1000)
+        start_at = int(params.get('startAt') or end_at - 24 * 60 * 60 * 1000)
+        if end_at - start_at > BaseKuCoinService.ORDERS_WINDOW:
+            return self._reply(None, code='400100', status=400, msg='time range exceeds 7 days')
+        # Newest first, like the exchange lists them
+        return sorted([order for order in self.done_orders.get(api_key, [])
+                       if start_at <= order['createdAt'] <= end_at
+                       and params.get('symbol', order.get('symbol')) == order.get('symbol')],
+                      key=lambda order: order['createdAt'], reverse=True)
+
+    def _get_order_list(self, api_key, params, body):
+        if params.get('status') == 'active':
+            return self._paginate(self._open_orders(api_key, params, stop=False), params)
+        items = self._done_orders(api_key, params)
+        return items if isinstance(items, web.Response) else self._paginate(items, params)
+
+    def _get_untriggered_stop_order_list(self, api_key, params, body):
+        return self._paginate(self._open_orders(api_key, params, stop=True), params)
+
+    def _mass_cancellation(self, api_key, params, stop: bool):
+        cancelled = [order['id'] for order in self._open_orders(api_key, params, stop=stop)]
+        for order_id in cancelled:
+            self.orders[api_key].pop(order_id)
+        return {'cancelledOrderIds': cancelled}
+
+    def _limit_order_mass_cancellation(self, api_key, params, body):
+        return self._mass_cancellation(api_key, params, stop=False)
+
+    def _stop_order_mass_cancellation(self, api_key, params, body):
+        return self._mass_cancellation(api_key, params, stop=True)
+
+    def _get_open_contract_list(self, api_key, params, body):
+        return self.contracts
+
+    def _get_contract_info(self, api_key, params, body):
+        return next((contract for contract in self.contracts if contract['symbol'] == params['symbol']), None)
+
+    def _get_position_list(self, api_key, params, body):
+        return [{'id': f'{api_key}:{contract["symbol"]}', 'symbol': contract['symbol'], 'currentQty': 1,
+                 'isOpen': True, 'markPrice': contract['markPrice']} for contract in self.contracts]
+
+    def _token(self):
+        return {'token': uuid4().hex, 'instanceServers': [{'endpoint': f'{self.url.replace("http", "ws")}/endpoint',
+                                                           'pingInterval': 18000, 'pingTimeout': 10000,
+                                                           'protocol': 'websocket', 'encrypt': False}]}
+
+    def _get_private_token(self, api_key, params, body):
+        return self._token()
+
+    def _get_public_token(self, api_key, params, body):
+        return self._token()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        for point, req in BaseKuCoinService.REQUESTS.items():
+            app.router.add_route(req['method'], req['endpoint'], self._handler(point))
+        return app
+
+    async def start_async(self) -> str:
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port, backlog=4096).start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop_async(self):
+        await self.runner.cleanup()
+
+    def start(self) -> str:
+        """
+        Serves from a daemon thread with its own event loop, for callers that drive it with blocking code.
+        """
+        started = threading.Event()
+
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start_async())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=target, name='mock-kucoin', daemon=True).start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self.stop_async(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.postgres.fields import ArrayField
 from account.models import User
 from simple_history.models import HistoricalRecords
 from .services import KuCoinService
@@ -33,19 +34,31 @@ class KuCoin(models.Model):
     def get_balance(self, currency='USDT') -> float:
         return self._service.get_balance(**self._authenticate, currency=currency)
 
-    def get_usable_balance(self, signal: Signal, currency='USDT') -> float:
-        balance = self.get_balance(currency=currency)
+    def _usable_balance(self, balance: float, signal: Signal) -> float:
         return balance * (self.user.cap, signal.capital)[not self.user.cap]
 
+    def get_usable_balance(self, signal: Signal, currency='USDT') -> float:
+        balance = self._service.get_recent_balance(**self._authenticate, currency=currency)
+        return self._usable_balance(balance=balance, signal=signal)
+
     def get_order_list(self, **kwargs):
         return self._service.get_order_list(**self._authenticate, **kwargs)
 
     def get_untriggered_stop_order_list(self, **kwargs):
         return self._service.get_untriggered_stop_order_list(**self._authenticate, **kwargs)
 
+    def iter_orders(self, **kwargs):
+        return self._service.iter_orders(**self._authenticate, **kwargs)
+
     def get_position_list(self, **kwargs):
         return self._service.get_position_list(**self._authenticate, **kwargs)
 
+    def get_position(self, currency):
+        return self._service.get_position(**self._authenticate, symbol=currency)
+
+    def get_open_orders(self, currency=None):
+        return self._service.get_open_orders(**self._authenticate, symbol=currency)
+
     def execute_signal(self, signal: Signal):
         usable_balance = self.get_usable_balance(signal=signal)
         return self._service.execute_signal(**self._authenticate,
@@ -62,3 +75,46 @@ class KuCoin(models.Model):
 
     def close_position(self, currency):
         return self._service.close_position(**self._authenticate, symbol=currency)
+
+
+class Execution(models.Model):
+    """
+    Append-only ledger of signal executions, one row per subscriber, written in bulk by ExecutionLedger.
+    """
+    class StatusChoices(models.TextChoices):
+        PROTECTED = 'protected', 'PROTECTED'
+        UNPROTECTED = 'unprotected', 'UNPROTECTED'
+        REJECTED = 'rejected', 'REJECTED'
+        FAILED = 'failed', 'FAILED'
+        DROPPED = 'dropped', 'DROPPED'
+
+    class ExecutionManager(models.Manager):
+        def of_signal(self, signal_id: int):
+            return self.filter(signal_id=signal_id)
+
+        def summary(self, signal_id: int) -> dict:
+            executions = self.of_signal(signal_id)
+            return {
+                'statuses': dict(executions.values_list('status').annotate(count=models.Count('id'))),
+                **executions.aggregate(count=models.Count('id'),
+                                       avg_duration=models.Avg('duration'), max_duration=models.Max('duration'),
+                                       avg_queue_delay=models.Avg('queue_delay'),
+                                       max_queue_delay=models.Max('queue_delay')),
+            }
+
+    signal = models.ForeignKey(to=Signal, on_delete=models.CASCADE, related_name='executions')
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='executions')
+    status = models.CharField(choices=StatusChoices.choices, max_length=12)
+    main_order_id = models.CharField(blank=True, max_length=64)
+    tp_order_ids = ArrayField(models.CharField(max_length=64), blank=True, default=list)
+    sl_order_id = models.CharField(blank=True, max_length=64)
+    error = models.TextField(blank=True)
+    # Seconds queued before a worker started the execution, and spent executing it
+    queue_delay = models.FloatField(null=True)
+    duration = models.FloatField(null=True)
+    executed = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+    objects = ExecutionManager()
+
+    def __str__(self):
+        return f'{self.signal_id}:{self.user_id}:{self.status}'
@@ -0,0 +1,129 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from django.db import close_old_connections
+from _helpers import singleton, get_redis_client
+from market.models import Signal
+from .services import KuCoinService
+from .snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+
+
+@singleton
+class ExecutionPlanner:
+    """
+    Pre-trade stage of a signal. Once the signal is created its army is sized and the orders of every subscriber
+    are built and validated, then cached in a Redis hash, so execution only stamps, signs and sends them.
+    Credentials never enter Redis, the army is loaded again at execution. A cached order is only sent while the
+    signal, the contract's sizing fields (and for a market signal the mark price, within PRICE_DRIFT) are the
+    ones the plan was built against, and while the subscriber's strategy, cap and balance are those it was sized
+    with. Any other subscriber of the army, new ones included, is planned again at execution.
+    """
+    PREFIX = 'KC:PLAN'
+    REDIS_KEYS = {
+        'plan': f'{PREFIX}:''{signal_id}',
+    }
+    META = 'meta'
+    CONTRACT_FIELDS = ('lot_size', 'multiplier', 'max_order_qty', 'max_leverage')
+    PRICE_DRIFT = 0.001
+    TTL = 60 * 60
+    WORKERS = 2
+
+    def __init__(self):
+        self.client = get_redis_client()
+        self.service: KuCoinService = KuCoinService()
+        self.executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='execution-planner')
+
+    def _key(self, signal_id: int) -> str:
+        return self.REDIS_KEYS.get('plan').format(signal_id=signal_id)
+
+    def _meta(self, signal: SignalSnapshot, mark_price: float) -> dict:
+        contract = self.service.contracts.get(signal.pair)
+        return {'signal': json.loads(json.dumps(signal)),
+                'contract': [getattr(contract, field) for field in self.CONTRACT_FIELDS],
+                'mark_price': mark_price}
+
+    def _fingerprint(self, account: AccountSnapshot, snapshots: dict) -> list:
+        balance = self.service.snapshot_balance(account.api_key, currency='USDT',
+                                                 max_age=self.service.balances.MAX_AGE, snapshots=snapshots)
+        return [account.strategy, account.cap, balance]
+
+    def _holds(self, meta: dict, signal: SignalSnapshot, mark_price: float) -> bool:
+        try:
+            current = self._meta(signal, mark_price=mark_price)
+        except KeyError:
+            # The contract is gone, every account is planned again and fails or is recorded on its own
+            return False
+        if meta['signal'] != current['signal'] or meta['contract'] != current['contract']:
+            return False
+        if signal.order_type != Signal.OrderChoices.MARKET:
+            return True
+        # Market orders were sized at the mark price of the plan
+        return bool(mark_price and meta['mark_price']) and \
+            abs(mark_price - meta['mark_price']) <= meta['mark_price'] * self.PRICE_DRIFT
+
+    def prepare(self, signal: Signal) -> int:
+        """
+        Plans the signal for its current army and caches the plan for TTL seconds.
+        :return: number of subscribers with a ready order
+        """
+        execution = ExecutionSnapshot.load(signal)
+        snapshots = self.service.balances.get_many(execution.api_keys)
+        mark_price = self.service.get_mark_price(signal.pair)
+        orders = self.service.plan_orders(execution, snapshots=snapshots)
+
+        key = self._key(signal.pk)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.delete(key)
+        if orders:
+            accounts = {account.pk: account for account in execution.accounts}
+            mapping = {user_id: json.dumps([self._fingerprint(accounts[user_id], snapshots), order])
+                       for user_id, order in orders.items()}
+            pipeline.hset(key, mapping={self.META: json.dumps(self._meta(execution.signal, mark_price)), **mapping})
+            pipeline.expire(key, self.TTL)
+        pipeline.execute()
+        return len(orders)
+
+    def _prepare(self, signal: Signal) -> int:
+        try:
+            return self.prepare(signal)
+        except Exception:
+            # Nothing is cached, the signal is planned at execution
+            logging.exception('preparing the execution plan failed!', extra={'signal_id': signal.pk})
+            return 0
+        finally:
+            close_old_connections()
+
+    def prepare_async(self, signal: Signal) -> Future:
+        return self.executor.submit(self._prepare, signal)
+
+    def _cached(self, execution: ExecutionSnapshot, mark_price: float) -> dict:
+        fields = [self.META] + [account.pk for account in execution.accounts]
+        meta, *entries = self.client.hmget(self._key(execution.signal.pk), fields)
+        if meta is None or not self._holds(json.loads(meta), execution.signal, mark_price=mark_price):
+            return {}
+        return {account.pk: json.loads(entry) for account, entry in zip(execution.accounts, entries) if entry}
+
+    def plan(self, execution: ExecutionSnapshot, snapshots: dict = None) -> dict:
+        """
+        The orders of the execution, from the cached plan where it still holds.
+        :return: user id -> order legs, see KuCoinService.plan_orders
+        """
+        signal = execution.signal
+        mark_price = self.service.get_mark_price(signal.pair)
+        try:
+            # Checked at execution, whenever the plan was built
+            self.service.check_risk(signal=signal, mark_price=mark_price)
+        except ValueError:
+            return {}
+
+        cached = self._cached(execution, mark_price=mark_price)
+        orders, stale = {}, []
+        for account in execution.accounts:
+            entry = cached.get(account.pk)
+            if entry is not None and entry[0] == self._fingerprint(account, snapshots):
+                orders[account.pk] = entry[1]
+            else:
+                stale.append(account)
+        if stale:
+            orders.update(self.service.plan_orders(execution._replace(accounts=tuple(stale)), snapshots=snapshots))
+        return orders
@@ -0,0 +1,135 @@
+import time
+import numpy as np
+from _helpers import singleton
+from multiprocessing import shared_memory, resource_tracker
+
+
+class MarkPriceBoard:
+    """
+    Latest mark and last-trade prices of the followed contracts in a fixed shared-memory table.
+    One market feed process writes it, every worker on the host attaches by name and reads prices
+    with plain memory loads. Each slot carries a sequence number (odd while being written) so readers
+    never see a half-updated row, and a symbol keeps its slot for the life of the board.
+    """
+
+    NAME = 'cryptor-mark-prices'
+    SLOTS = 1024
+    DTYPE = np.dtype([('seq', 'u8'), ('symbol', 'S24'), ('mark', 'f8'), ('last', 'f8'), ('ts', 'f8')])
+    MAX_AGE = 10
+    # A reader gives up on a slot that stays odd this many reads, its writer died mid-update
+    READ_RETRIES = 1000
+
+    def __init__(self, create=False, name: str = None, slots: int = None):
+        self.name = name or self.NAME
+        size = self.DTYPE.itemsize * (slots or self.SLOTS)
+        if create:
+            try:
+                self.memory = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+            except FileExistsError:
+                self.memory = shared_memory.SharedMemory(name=self.name)
+        else:
+            self.memory = shared_memory.SharedMemory(name=self.name)
+            # Readers must not unlink the writer's segment when they exit
+            resource_tracker.unregister(self.memory._name, 'shared_memory')
+        self.owner = create
+        self.table = np.ndarray(shape=(self.memory.size // self.DTYPE.itemsize,), dtype=self.DTYPE,
+                                buffer=self.memory.buf)
+        self._slots = {}
+
+    @classmethod
+    def attach(cls, name: str = None):
+        try:
+            return cls(create=False, name=name)
+        except FileNotFoundError:
+            return None
+
+    def _slot(self, symbol: str, create=False):
+        if (slot := self._slots.get(symbol)) is not None:
+            return slot
+
+        key = symbol.encode()
+        found = np.flatnonzero(self.table['symbol'] == key)
+        if found.size:
+            slot = int(found[0])
+        elif create:
+            free = np.flatnonzero(self.table['symbol'] == b'')
+            if not free.size:
+                raise MemoryError('mark price board is full!')
+            slot = int(free[0])
+            self.table['symbol'][slot] = key
+        else:
+            return None
+
+        self._slots[symbol] = slot
+        return slot
+
+    def update(self, symbol: str, mark: float = None, last: float = None, ts: float = None):
+        slot = self._slot(symbol, create=True)
+        row = self.table[slot:slot + 1]
+        row['seq'] += 1
+        if mark is not None:
+            row['mark'] = mark
+            row['ts'] = ts or time.time()
+        if last is not None:
+            row['last'] = last
+        row['seq'] += 1
+
+    def read(self, symbol: str) -> (float, float, float,):
+        """
+        :return: (mark, last, time of the mark) of the symbol, None when it is not followed or its slot is
+                 never consistent within READ_RETRIES reads
+        """
+        slot = self._slot(symbol)
+        if slot is None:
+            return None
+        table = self.table
+        for _ in range(self.READ_RETRIES):
+            seq = int(table['seq'][slot])
+            mark, last, ts = float(table['mark'][slot]), float(table['last'][slot]), float(table['ts'][slot])
+            if not seq & 1 and seq == int(table['seq'][slot]):
+                return mark, last, ts
+        return None
+
+    def get_mark_price(self, symbol: str, max_age: float = None) -> float:
+        """
+        :return: mark price of the symbol, None when it is not followed or older than max_age seconds
+        """
+        price = self.read(symbol)
+        if price is None or not price[0] or time.time() - price[2] > (max_age or self.MAX_AGE):
+            return None
+        return price[0]
+
+    def symbols(self) -> list:
+        return [symbol.decode() for symbol in self.table['symbol'] if symbol]
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+@singleton
+class MarkPriceReader:
+    """
+    Process-wide reader of the board. While it finds no price, or only a stale one, it re-attaches every RETRY
+    seconds: no market feed may run yet, or a restarted feed writes to a new segment under the same name while
+    the old one, still mapped here, no longer changes.
+    """
+    RETRY = 5
+
+    def __init__(self):
+        self.board = None
+        self._tried = 0.0
+
+    def get_mark_price(self, symbol: str, max_age: float = None) -> float:
+        price = self.board.get_mark_price(symbol, max_age=max_age) if self.board else None
+        if price is None and time.monotonic() - self._tried > self.RETRY:
+            self._tried = time.monotonic()
+            # The previous segment is unmapped once no reader holds it
+            self.board = MarkPriceBoard.attach() or self.board
+            price = self.board.get_mark_price(symbol, max_age=max_age) if self.board else None
+        return price
+
+
+def get_mark_price(symbol: str, max_age: float = None) -> float:
+    return MarkPriceReader().get_mark_price(symbol, max_age=max_age)
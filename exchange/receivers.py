@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from market.models import Signal
+from .plans import ExecutionPlanner
+
+
+@receiver(post_save, sender=Signal, dispatch_uid='exchange.prepare_execution_plan')
+def prepare_execution_plan(sender, instance: Signal, created: bool, **kwargs):
+    # Off the request path, once the signal can be read by the planner's own connection
+    if created:
+        transaction.on_commit(lambda: ExecutionPlanner().prepare_async(instance))
@@ -0,0 +1,113 @@
+class Response:
+    """
+    Base of the typed KuCoin response models. FIELDS maps every slot to its key in the exchange's JSON, decoding
+    reads those keys only and the rest of the payload goes away with the dict, so a mirror of thousands of
+    orders keeps a few slots per order instead of a dict of some thirty keys.
+    """
+    __slots__ = ()
+    FIELDS = {}
+    KEYS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super(Response, cls).__init_subclass__(**kwargs)
+        cls.KEYS = tuple(cls.FIELDS.values())
+
+    def __init__(self, *values, **fields):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name in self.__slots__[len(values):]:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(*map(data.get, cls.KEYS))
+
+    @classmethod
+    def from_json_list(cls, items: list) -> list:
+        return [cls(*map(item.get, cls.KEYS)) for item in items or ()]
+
+    def update(self, data: dict):
+        # Pushes only carry the fields that changed
+        for name, key in self.FIELDS.items():
+            if key in data:
+                setattr(self, name, data[key])
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, name) for name, key in self.FIELDS.items()}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name)
+                                                 for name in self.__slots__)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)})'
+
+
+class Order(Response):
+    FIELDS = {
+        'id': 'id',
+        'symbol': 'symbol',
+        'side': 'side',
+        'type': 'type',
+        'status': 'status',
+        'price': 'price',
+        'size': 'size',
+        'stop': 'stop',
+        'stop_price': 'stopPrice',
+        'client_oid': 'clientOid',
+        'deal_size': 'dealSize',
+        'deal_value': 'dealValue',
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class Position(Response):
+    FIELDS = {
+        'id': 'id',
+        'symbol': 'symbol',
+        'current_qty': 'currentQty',
+        'is_open': 'isOpen',
+        'avg_entry_price': 'avgEntryPrice',
+        'mark_price': 'markPrice',
+        'liquidation_price': 'liquidationPrice',
+        'unrealised_pnl': 'unrealisedPnl',
+    }
+    __slots__ = tuple(FIELDS)
+
+    @property
+    def closed(self) -> bool:
+        return self.current_qty == 0 or self.is_open is False
+
+    @classmethod
+    def find(cls, items: list, symbol: str):
+        """
+        :return: position of the symbol in a position list, only that one is decoded, None when there is none
+        """
+        return next((cls.from_json(item) for item in items or () if item.get('symbol') == symbol), None)
+
+
+class Contract(Response):
+    FIELDS = {
+        'symbol': 'symbol',
+        'lot_size': 'lotSize',
+        'multiplier': 'multiplier',
+        'tick_size': 'tickSize',
+        'max_order_qty': 'maxOrderQty',
+        'max_leverage': 'maxLeverage',
+    }
+    __slots__ = tuple(FIELDS)
+
+    @property
+    def lot_size_contract(self) -> float:
+        return self.lot_size * self.multiplier
+
+
+class AccountOverview(Response):
+    FIELDS = {
+        'currency': 'currency',
+        'available_balance': 'availableBalance',
+        'account_equity': 'accountEquity',
+        'margin_balance': 'marginBalance',
+        'unrealised_pnl': 'unrealisedPNL',
+    }
+    __slots__ = tuple(FIELDS)
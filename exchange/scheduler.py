@@ -0,0 +1,227 @@
+import heapq
+import logging
+import threading
+from math import sqrt
+from time import time
+from itertools import count
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from _helpers import singleton
+from market.models import Signal
+from .services import KuCoinService, BaseKuCoinService
+from .metrics import RequestMetrics
+from .ledger import ExecutionLedger
+from .snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+
+
+class _Lane:
+    __slots__ = ('heap', 'running')
+
+    def __init__(self):
+        self.heap = []
+        self.running = 0
+
+    @property
+    def weight(self) -> float:
+        # Share of the workers grows with the backlog, but slower, a big army cannot crowd out small ones
+        return sqrt(len(self.heap) + self.running)
+
+
+@singleton
+class DeadlineScheduler:
+    """
+    Process-wide queue of order executions, served by a fixed set of workers.
+    Every trader has a lane (bulkhead). A free worker serves a lane running fewer than LANE_MINIMUM jobs first,
+    then the lane furthest below its weighted share of the workers, so a signal of a small army starts right
+    away next to a 5,000-user one. Within a lane jobs are earliest-deadline-first: a job is due
+    BUDGETS[order_type] seconds, plus one second per ARMY_RATE accounts of its fan-out, after its signal was
+    published, a market signal chases the price and overtakes limit work queued before it. Within the same
+    deadline the higher tier goes first. A job that is still queued when its deadline passes is dropped: its
+    future fails with TimeoutError. The report of a signal is kept for REPORT_TTL seconds after its last
+    execution is counted.
+    """
+    BUDGETS = {
+        Signal.OrderChoices.MARKET: 5.0,
+        Signal.OrderChoices.LIMIT: 60.0,
+    }
+    # Accounts a second a fan-out is budgeted for, well below what the workers sustain
+    ARMY_RATE = 50.0
+    LANE_MINIMUM = 4
+    REPORT_FIELDS = ('submitted', 'executed', 'protected', 'failed', 'dropped')
+    REPORT_TTL = 60 * 60
+
+    def __init__(self, workers: int = None):
+        self.service: KuCoinService = KuCoinService()
+        self.metrics: RequestMetrics = RequestMetrics()
+        self.ledger: ExecutionLedger = ExecutionLedger()
+        self.workers = workers or self.service.POOL_SIZE
+        self._lanes = {}
+        self._queued = 0
+        self._sequence = count()
+        self._condition = threading.Condition()
+        self._reports = defaultdict(lambda: dict.fromkeys(self.REPORT_FIELDS, 0))
+        self._finished = deque()
+        self._threads = []
+
+    def _start(self):
+        # Called under the condition, the workers are only spawned by the first submit
+        if self._threads:
+            return
+        for it in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'deadline-{it}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def resize(self, workers: int):
+        """
+        Sets the number of workers, the process-wide scheduler keeps its workers once they started
+        """
+        with self._condition:
+            if self._threads and workers != self.workers:
+                raise ValueError(f'scheduler already runs {self.workers} workers, cannot run {workers}')
+            self.workers = workers
+
+    def deadline(self, signal: SignalSnapshot, submitted: float, army: int = 1, since: float = None) -> float:
+        """
+        :param army: accounts of the whole fan-out
+        :param since: start of the budget, when the signal was published by default
+        """
+        budget = self.BUDGETS.get(signal.order_type, self.BUDGETS[Signal.OrderChoices.LIMIT]) + army / self.ARMY_RATE
+        return (since or signal.created or submitted) + budget
+
+    def submit(self, signal: SignalSnapshot, account: AccountSnapshot, snapshots: dict = None,
+               order: tuple = None, deadline: float = None) -> Future:
+        """
+        :param order: the account's order legs when the execution was planned up front
+        :param deadline: see deadline, for a fan-out of one account by default
+        :return: future of the execute_account result
+        """
+        submitted = time()
+        deadline = deadline or self.deadline(signal, submitted)
+        future = Future()
+        with self._condition:
+            self._start()
+            lane = self._lanes.get(signal.trader_id)
+            if lane is None:
+                lane = self._lanes[signal.trader_id] = _Lane()
+            # Ties on the deadline go to the higher tier, then first come first served
+            heapq.heappush(lane.heap, (deadline, -account.tier, next(self._sequence),
+                                       signal, account, snapshots, future, submitted, order))
+            self._queued += 1
+            self._prune()
+            report = self._reports[signal.pk]
+            report['submitted'] += 1
+            report.pop('finished', None)
+            self._condition.notify()
+        return future
+
+    def submit_execution(self, execution: ExecutionSnapshot, snapshots: dict = None, plan: dict = None,
+                         army: int = None, since: float = None) -> list:
+        """
+        :param plan: user id -> order legs, see KuCoinService.plan_orders
+        :param army: accounts of the whole fan-out when the execution is a shard of it
+        :param since: see deadline
+        """
+        deadline = self.deadline(execution.signal, time(), army=army or len(execution.accounts), since=since)
+        return [self.submit(execution.signal, account, snapshots, order=(plan or {}).get(account.pk),
+                            deadline=deadline)
+                for account in execution.accounts]
+
+    def _count(self, signal_id: int, field: str, late: float = None):
+        with self._condition:
+            report = self._reports[signal_id]
+            report[field] += 1
+            if field != 'dropped':
+                report['executed'] += 1
+            if late is not None:
+                report['max_late'] = max(report.get('max_late', 0.0), late)
+            if report['executed'] + report['dropped'] == report['submitted']:
+                report['finished'] = time()
+                self._finished.append((report['finished'], signal_id))
+
+    def _prune(self):
+        # Called under the condition, a signal that got more jobs since it finished is skipped
+        expired = time() - self.REPORT_TTL
+        while self._finished and self._finished[0][0] < expired:
+            finished, signal_id = self._finished.popleft()
+            if self._reports.get(signal_id, {}).get('finished') == finished:
+                del self._reports[signal_id]
+
+    def _pick(self) -> _Lane:
+        return min((lane for lane in self._lanes.values() if lane.heap),
+                   key=lambda lane: (lane.running >= self.LANE_MINIMUM, lane.running / lane.weight, lane.heap[0]))
+
+    def _next(self) -> tuple:
+        with self._condition:
+            while not self._queued:
+                self._condition.wait()
+            lane = self._pick()
+            lane.running += 1
+            self._queued -= 1
+            return heapq.heappop(lane.heap)
+
+    def _done(self, trader_id: int):
+        with self._condition:
+            lane = self._lanes[trader_id]
+            lane.running -= 1
+            if not lane.running and not lane.heap:
+                del self._lanes[trader_id]
+
+    def _run(self, job: tuple):
+        signal = job[3]
+        try:
+            self._execute(job)
+        finally:
+            self._done(signal.trader_id)
+
+    def _execute(self, job: tuple):
+        deadline, _, _, signal, account, snapshots, future, submitted, order = job
+        if not future.set_running_or_notify_cancel():
+            return
+        started = time()
+        self.metrics.record_queue(f'trader:{signal.trader_id}', started - submitted)
+        if started > deadline:
+            error = TimeoutError(f'deadline of signal {signal.pk} passed {started - deadline:.3f}s ago')
+            self._count(signal.pk, 'dropped', late=started - deadline)
+            self.ledger.record(signal.pk, account.pk, error=error, queue_delay=started - submitted, dropped=True)
+            future.set_exception(error)
+            return
+
+        try:
+            result = self.service.execute_account(signal, account, snapshots, order=order)
+        except Exception as e:
+            logging.error('scheduled execution failed!', extra={'signal_id': signal.pk, 'user_id': account.pk,
+                                                                'error': repr(e)})
+            self._count(signal.pk, 'failed')
+            self.ledger.record(signal.pk, account.pk, error=e, queue_delay=started - submitted,
+                               duration=time() - started)
+            future.set_exception(e)
+        else:
+            self._count(signal.pk, ('failed', 'protected')[BaseKuCoinService._accepted(result[2])])
+            self.ledger.record(signal.pk, account.pk, result=result, queue_delay=started - submitted,
+                               duration=time() - started)
+            future.set_result(result)
+
+    def _work(self):
+        while True:
+            self._run(self._next())
+
+    def pending(self) -> int:
+        with self._condition:
+            return self._queued
+
+    def lanes(self) -> dict:
+        """
+        :return: trader_id -> queued and running jobs and weight of every lane with work
+        """
+        with self._condition:
+            return {trader_id: {'queued': len(lane.heap), 'running': lane.running, 'weight': round(lane.weight, 2)}
+                    for trader_id, lane in self._lanes.items()}
+
+    def report(self, signal_id: int) -> dict:
+        """
+        :return: submitted, executed (protected or failed) and dropped executions of the signal, max_late in
+                 seconds once a job was dropped, finished (unix time) once every submitted execution is counted
+        """
+        with self._condition:
+            return dict(self._reports.get(signal_id, dict.fromkeys(self.REPORT_FIELDS, 0)))
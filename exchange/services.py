@@ -1,15 +1,26 @@
-import re
-import time
-import base64
-import hmac
-import hashlib
 import json
+import logging
+import numpy as np
+from time import time, perf_counter
+from collections import deque
+from functools import lru_cache, partial, wraps
+from inspect import isasyncgenfunction
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, Future
 from uuid import uuid4
-from requests.sessions import Session
-from _helpers import singleton
+from string import Formatter
+from _helpers import singleton, RateLimiter, SessionPool, ConcurrencyLimiter, SingleFlight
 from market.models import Signal
 from account.models import User
 from market.services import MarketService
+from .contracts import ContractStore
+from .signing import KuCoinSigner, get_signer
+from .mirrors import MirrorRegistry
+from .prices import get_mark_price
+from .metrics import RequestMetrics
+from .balances import BalanceStore
+from .snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+from .responses import Order, Position, Contract, AccountOverview
 
 
 class BaseKuCoinService:
@@ -19,23 +30,34 @@ class BaseKuCoinService:
     REQUESTS = {
         'get_account_overview': {
             'method': 'GET',
-            'endpoint': '/api/v1/account-overview'
+            'endpoint': '/api/v1/account-overview',
+            'rate_limit': (30, 3)
         },
         'place_order': {
             'method': 'POST',
-            'endpoint': '/api/v1/orders'
+            'endpoint': '/api/v1/orders',
+            'rate_limit': (30, 3)
+        },
+        'place_multiple_orders': {
+            'method': 'POST',
+            'endpoint': '/api/v1/orders/multi',
+            'body': 'orders',
+            'rate_limit': (30, 3)
         },
         'cancel_order': {
             'method': 'DELETE',
-            'endpoint': '/api/v1/orders/{order_id}'
+            'endpoint': '/api/v1/orders/{order_id}',
+            'rate_limit': (40, 3)
         },
         'get_order_list': {
             'method': 'GET',
-            'endpoint': '/api/v1/orders'
+            'endpoint': '/api/v1/orders',
+            'rate_limit': (30, 3)
         },
         'limit_order_mass_cancellation': {
             'method': 'DELETE',
-            'endpoint': '/api/v1/orders'
+            'endpoint': '/api/v1/orders',
+            'rate_limit': (9, 3)
         },
         'stop_order_mass_cancellation': {
             'method': 'DELETE',
@@ -43,127 +65,475 @@ class BaseKuCoinService:
         },
         'get_open_contract_list': {
             'method': 'GET',
-            'endpoint': '/api/v1/contracts/active'
+            'endpoint': '/api/v1/contracts/active',
+            'public': True
         },
         'get_contract_info': {
             'method': 'GET',
-            'endpoint': '/api/v1/contracts/{symbol}'
+            'endpoint': '/api/v1/contracts/{symbol}',
+            'public': True
         },
         'get_position_list': {
             'method': 'GET',
-            'endpoint': '/api/v1/positions'
+            'endpoint': '/api/v1/positions',
+            'rate_limit': (9, 3)
         },
         'get_untriggered_stop_order_list': {
             'method': 'GET',
             'endpoint': '/api/v1/stopOrders'
         },
+        'get_private_token': {
+            'method': 'POST',
+            'endpoint': '/api/v1/bullet-private'
+        },
+        'get_public_token': {
+            'method': 'POST',
+            'endpoint': '/api/v1/bullet-public',
+            'public': True
+        },
     }
-    LOCKED = False
+    ENDPOINTS = {}
+    ENCODER = json.JSONEncoder(separators=(',', ':'))
+    PUBLIC_HEADER = {'Content-Type': 'application/json'}
+    # (requests, seconds) budgets above are per account and shared by every worker through Redis
+    RATE_LIMITED = True
+    # Per point latency sketches and status counters, see RequestMetrics
+    METRICS = True
+    # Kept-alive connections, also the number of fan-out workers that can have a request in flight
+    POOL_SIZE = 64
+    # Requests in flight adapt to KuCoin's responses (AIMD) under POOL_SIZE, see ConcurrencyLimiter
+    CONCURRENCY_LIMITED = True
+    # Identical public GETs in flight at the same time share one request, see SingleFlight
+    COALESCED = True
+    # How place_order sends the take-profit and stop-loss legs once the main order is accepted
+    LEGS_SEQUENTIAL = 'sequential'
+    LEGS_CONCURRENT = 'concurrent'
+    LEGS_BATCH = 'batch'
+    LEGS_MODE = LEGS_BATCH
+    BATCH_ORDERS_LIMIT = 20
+    # Order history is paginated, done orders can only be listed in windows of at most 7 days (milliseconds)
+    ORDERS_PAGE_SIZE = 100
+    ORDERS_WINDOW = 7 * 24 * 60 * 60 * 1000
 
     def __init__(self):
-        self.session = Session()
+        self.pool = SessionPool(pool_size=self.POOL_SIZE)
+        self.legs_executor = ThreadPoolExecutor(max_workers=self.POOL_SIZE, thread_name_prefix='order-legs')
+        self.batch_orders = True
+        self.limiter = RateLimiter()
+        self.concurrency = ConcurrencyLimiter(maximum=self.POOL_SIZE)
+        self.single_flight = SingleFlight()
+        self.metrics = RequestMetrics()
+        self.balances = BalanceStore()
         self.BASE_URL = (self.URLS['URL'], self.URLS['SANDBOX_URL'])[self.SANDBOX]
 
     def refresh_session(self):
-        if not self.LOCKED:
-            self.__init__()
+        self.pool.rotate()
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
+
+    def single_flight_stats(self) -> dict:
+        return self.single_flight.stats()
 
     @staticmethod
-    def _generate_signature(api_secret: str, method: str, endpoint: str, data=None):
-        now = int(time.time() * 1000)
-        str_to_sign = '{now}{method}{endpoint}'.format(now=now,
-                                                       method=method.upper(),
-                                                       endpoint=endpoint)
-        if data:
-            str_to_sign += data
+    def get_header(api_key: str, api_secret: str, api_passphrase: str,
+                   method: str, endpoint: str, is_json=False, data=None):
+        signer: KuCoinSigner = get_signer(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase)
+        return signer.get_header(method=method, endpoint=endpoint, is_json=is_json, data=data)
 
-        signature = base64.b64encode(
-            hmac.new(api_secret.encode('utf-8'), str_to_sign.encode('utf-8'), hashlib.sha256).digest())
+    @classmethod
+    def _compile_requests(cls):
+        """
+        Pre-parses REQUESTS once per class into point -> (method, endpoint template, path keys, body key, query).
+        """
+        cls.ENDPOINTS = {
+            point: (req['method'], req['endpoint'],
+                    tuple(key for _, key, _, _ in Formatter().parse(req['endpoint']) if key),
+                    req.get('body'), req['method'] in ('GET', 'DELETE'))
+            for point, req in cls.REQUESTS.items()
+        }
+
+    def __init_subclass__(cls, **kwargs):
+        super(BaseKuCoinService, cls).__init_subclass__(**kwargs)
+        cls._compile_requests()
+
+    def _prepare_request(self, api_key: str, api_secret: str, api_passphrase: str,
+                         method: str, endpoint: str, data: str = None) -> (str, dict, str,):
+        url = f'{self.BASE_URL}{endpoint}'
 
-        return signature, now
+        # Public market endpoints are called without credentials
+        if api_key is None:
+            return url, self.PUBLIC_HEADER, data
+
+        header = self.get_header(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
+                                 method=method, endpoint=endpoint, is_json=True, data=data)
+        return url, header, data
+
+    def _request(self, api_key: str, api_secret: str, api_passphrase: str,
+                 method: str, endpoint: str, data=None, point: str = None, waited=0.0) -> (int, str,):
+        start = perf_counter()
+        url, header, data_json = self._prepare_request(api_key=api_key, api_secret=api_secret,
+                                                       api_passphrase=api_passphrase,
+                                                       method=method, endpoint=endpoint, data=data)
+        signed = perf_counter()
+        status = self.metrics.ERROR
+        try:
+            with self.pool.session() as session:
+                response = session.request(method=method, url=url, headers=header, data=data_json)
+            status = response.status_code
+            return status, response.json()
+        finally:
+            if self.METRICS and point:
+                self.metrics.record(point, status, wait=waited, sign=signed - start, http=perf_counter() - signed)
+
+    def _resolve(self, point: str, **kwargs) -> (str, str, str,):
+        """
+        Encodes a request in one pass: GET and DELETE parameters go to the query string, the others to a compact
+        JSON body. The returned endpoint is exactly the path that is requested and signed.
+        :return: (method, endpoint, JSON body or None)
+        """
+        method, endpoint, keys, body, query = self.ENDPOINTS[point]
+        if keys:
+            endpoint = endpoint.format_map({key: kwargs.pop(key) for key in keys})
+
+        # Requests such as batch orders send one parameter as the raw JSON body
+        if body:
+            return method, endpoint, self.ENCODER.encode(kwargs.pop(body))
+        if not kwargs:
+            return method, endpoint, None
+        if query:
+            return method, f'{endpoint}?{"&".join([f"{key}={value}" for key, value in kwargs.items()])}', None
+        return method, endpoint, self.ENCODER.encode(kwargs)
+
+    def _rate_limit(self, api_key: str, point: str):
+        rate_limit = self.REQUESTS[point].get('rate_limit')
+        if self.RATE_LIMITED and rate_limit and api_key:
+            return f'{api_key}:{point}', *rate_limit
+
+    def _coalesced(self, point: str, method: str, api_key: str) -> bool:
+        # Public and idempotent, every caller gets the same response
+        return self.COALESCED and api_key is None and method == 'GET' and self.REQUESTS[point].get('public')
+
+    def request(self, point: str, api_key: str = None, api_secret: str = None, api_passphrase: str = None,
+                **kwargs):
+        method, endpoint, data = self._resolve(point=point, **kwargs)
+        if not self._coalesced(point=point, method=method, api_key=api_key):
+            return self._send(point=point, method=method, endpoint=endpoint, data=data, api_key=api_key,
+                              api_secret=api_secret, api_passphrase=api_passphrase)
+
+        response, shared = self.single_flight.do(point, endpoint, self._send, point=point, method=method,
+                                                 endpoint=endpoint, data=data)
+        if shared and self.METRICS:
+            self.metrics.record_shared(point)
+        return response
+
+    def _send(self, point: str, method: str, endpoint: str, data: str = None, api_key: str = None,
+              api_secret: str = None, api_passphrase: str = None):
+        start = perf_counter()
+        if rate_limit := self._rate_limit(api_key=api_key, point=point):
+            self.limiter.acquire(*rate_limit)
+        if not self.CONCURRENCY_LIMITED:
+            return self._request(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
+                                 method=method, endpoint=endpoint, data=data,
+                                 point=point, waited=perf_counter() - start)
+
+        self.concurrency.acquire(point)
+        sent, status = perf_counter(), None
+        try:
+            status, response = self._request(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
+                                             method=method, endpoint=endpoint, data=data,
+                                             point=point, waited=sent - start)
+            return status, response
+        finally:
+            self.concurrency.release(point, status, perf_counter() - sent)
 
     @staticmethod
-    def _generate_passphrase(api_secret: str, api_passphrase: str):
-        passphrase = base64.b64encode(
-            hmac.new(api_secret.encode('utf-8'), api_passphrase.encode('utf-8'), hashlib.sha256).digest())
+    def _lot_size_contract(contract: Contract) -> float:
+        return contract.lot_size_contract
 
-        return passphrase
+    @staticmethod
+    def _calculate_lot_size(lot_size_contract: float, balance: float, price: float, leverage: int) -> int:
+        return int((balance * leverage) / (lot_size_contract * price))
 
-    @classmethod
-    def get_header(cls, api_key: str, api_secret: str, api_passphrase: str,
-                   method: str, endpoint: str, is_json=False, data=None):
-        signature, now = cls._generate_signature(api_secret=api_secret,
-                                                 method=method,
-                                                 endpoint=endpoint,
-                                                 data=data)
-        passphrase = cls._generate_passphrase(api_secret=api_secret,
-                                              api_passphrase=api_passphrase)
-
-        headers = {
-            "KC-API-SIGN": signature,
-            "KC-API-TIMESTAMP": str(now),
-            "KC-API-KEY": api_key,
-            "KC-API-PASSPHRASE": passphrase,
-            "KC-API-KEY-VERSION": "2"
+    @staticmethod
+    def _validate_order(contract: Contract, leverage: str, size: str):
+        if not 0 < int(size) <= (contract.max_order_qty or float('inf')):
+            raise ValueError(f'order size {size} is out of range for {contract.symbol}!')
+        if int(leverage) > (contract.max_leverage or float('inf')):
+            raise ValueError(f'leverage {leverage} is above the maximum of {contract.symbol}!')
+
+    @staticmethod
+    def _stop_order_params(clientOid: str, side: str, symbol: str,
+                           stop: str, stop_price: str, size: str) -> dict:
+        return {
+            'clientOid': clientOid,
+            'side': side,
+            'symbol': symbol,
+            'type': 'market',
+            'stop': stop,
+            'stopPriceType': 'TP',
+            'stopPrice': stop_price,
+            'leverage': '1',
+            'size': size,
         }
 
-        if is_json:
-            headers['Content-Type'] = 'application/json'
+    @staticmethod
+    def _client_oid(signal_id: int, user_id: int) -> str:
+        """
+        clientOid prefix of the orders of a signal execution, each leg appends its own name, see parse_client_oid.
+        """
+        return f'{signal_id}-{user_id}' if signal_id and user_id else None
+
+    @staticmethod
+    def parse_client_oid(client_oid: str) -> (int, int, str,):
+        """
+        :return: (signal id, user id, leg) of an order placed for a signal, None for any other order
+        """
+        parts = (client_oid or '').split('-')
+        if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+            return None
+        return int(parts[0]), int(parts[1]), parts[2]
 
-        return headers
+    @classmethod
+    def _order_legs(cls, symbol: str, leverage: str, price: str, order_type: str,
+                    size: str, tp_prices: str, stop_price: str, tp_sizes: list, type: str,
+                    client_oid: str = None) -> (dict, list, dict,):
+        """
+        Builds the parameters of the main order and of its take-profit and stop-loss stop orders.
+        :param client_oid: clientOid prefix of the legs (main, tp0.., sl), random ids when it is not given
+        :return: (main order params, [take-profit params], stop-loss params)
+        """
+        side = ('sell', 'buy')[type == 'long']
+        close_side = 'sell' if side == 'buy' else 'buy'
+
+        def leg_oid(leg: str) -> str:
+            return f'{client_oid}-{leg}' if client_oid else uuid4().hex
+
+        main_order = {'clientOid': leg_oid('main'),
+                      'side': side,
+                      'symbol': symbol,
+                      'leverage': leverage,
+                      'price': price,
+                      'size': size,
+                      'type': order_type}
+
+        tp_orders = [cls._stop_order_params(clientOid=leg_oid(f'tp{it}'),
+                                            side=close_side,
+                                            symbol=symbol,
+                                            stop='up' if side == 'buy' else 'down',
+                                            stop_price=tp_price,
+                                            size=tp_sizes[it]) for it, tp_price in enumerate(tp_prices)
+                     if tp_price and tp_sizes[it]]
+
+        sl_order = cls._stop_order_params(clientOid=leg_oid('sl'),
+                                          side=close_side,
+                                          symbol=symbol,
+                                          stop='down' if side == 'buy' else 'up',
+                                          stop_price=stop_price,
+                                          size=size)
+
+        return main_order, tp_orders, sl_order
 
     @staticmethod
-    def _params_to_endpoint(endpoint: str, **kwargs) -> str:
+    def _accepted(result) -> bool:
+        return isinstance(result, tuple) and result[0] == 200 and (result[1] or {}).get('code') == '200000'
 
-        endpoint += '?'
-        for key in kwargs.keys():
-            endpoint += f'{key}={kwargs[key]}&'
-        endpoint = endpoint[:-1]
+    @classmethod
+    def _batches(cls, legs: list) -> list:
+        return [legs[it:it + cls.BATCH_ORDERS_LIMIT] for it in range(0, len(legs), cls.BATCH_ORDERS_LIMIT)]
 
-        return endpoint
+    @staticmethod
+    def _split_batch(result: tuple, legs: list) -> list:
+        """
+        Turns a batch order response into one (status_code, response) per leg, like single placements return.
+        """
+        code, data = result
+        if code != 200 or not isinstance((data or {}).get('data'), list):
+            return [result] * len(legs)
+
+        placed = {item.get('clientOid'): item for item in data.get('data')}
+        missing = {'code': None, 'msg': 'missing from the batch response'}
+        return [(code, {'code': (item := placed.get(leg['clientOid'], missing)).get('code'),
+                        'msg': item.get('msg'),
+                        'data': {'orderId': item.get('orderId'), 'clientOid': leg['clientOid']}})
+                for leg in legs]
+
+    @classmethod
+    def _batch_legs(cls, batches: list, results: list) -> list:
+        """
+        :param results: response or exception of every batch
+        :return: one placement per leg, the exception of its batch in place like concurrent placements return,
+                 None for the legs of a batch that got a 404 and is to be placed one by one
+        """
+        placed = []
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                placed.extend([result] * len(batch))
+            elif result[0] == 404:
+                placed.extend([None] * len(batch))
+            else:
+                placed.extend(cls._split_batch(result, batch))
+        return placed
+
+    @classmethod
+    def _windows(cls, start_at: int, end_at: int) -> list:
+        # Both bounds are inclusive, consecutive windows neither overlap nor leave a gap
+        return [(it, min(it + cls.ORDERS_WINDOW, end_at)) for it in range(start_at, end_at + 1, cls.ORDERS_WINDOW + 1)]
+
+    def _order_queries(self, status: str, symbol: str, start_at: int, end_at: int, stop: bool) -> (str, list,):
+        """
+        :return: (point, query of every window to walk, oldest first)
+        """
+        query = dict(symbol=symbol) if symbol else {}
+        if stop:
+            return 'get_untriggered_stop_order_list', [query]
+        query['status'] = status
+        if status != 'done':
+            return 'get_order_list', [query]
+
+        end_at = end_at or int(time() * 1000)
+        start_at = start_at or end_at - self.ORDERS_WINDOW
+        return 'get_order_list', [dict(query, startAt=start, endAt=end) for start, end in self._windows(start_at, end_at)]
 
     @staticmethod
-    def _make_endpoint_format(endpoint: str, **kwargs) -> (str, list,):
-        keys = re.findall(r'/{(.+?)}', endpoint)
-        params_dict = {key: kwargs[key] for key in kwargs.keys()}
+    def _page_items(point: str, result: tuple, page: int) -> (list, bool,):
+        """
+        :return: (orders of the page, whether it is the last page)
+        """
+        code, data = result
+        if code != 200 or (data or {}).get('code') != '200000':
+            raise ConnectionError(f'{point} page {page} failed with {code}: {data}')
+        data = data.get('data')
+        return data.get('items') or [], page >= (data.get('totalPage') or 0)
 
-        endpoint = endpoint.format(**params_dict)
+    @classmethod
+    def _report_legs(cls, symbol: str, tp_orders: list, sl_order) -> list:
+        failed = [(f'tp{it}', leg) for it, leg in enumerate(tp_orders) if not cls._accepted(leg)]
+        if not cls._accepted(sl_order):
+            failed.append(('sl', sl_order))
+        if failed:
+            logging.error('protective legs failed!', extra={'symbol': symbol,
+                                                            'failed': [(name, repr(leg)) for name, leg in failed]})
+        return failed
+
+    def snapshot_balance(self, api_key: str, currency: str, max_age: float, snapshots: dict = None) -> float:
+        """
+        Available balance pushed by the account's private feed or, failing that, its shared snapshot.
+        :param snapshots: api_key -> balance prefetched with BalanceStore.get_many, read instead of Redis
+        :return: None when neither is younger than max_age seconds
+        """
+        if (mirror := MirrorRegistry().get(api_key)) and (balance := mirror.balance(currency, max_age)) is not None:
+            return balance
+        if snapshots is not None:
+            return snapshots.get(api_key)
+        return self.balances.get(api_key, currency=currency, max_age=max_age)
 
-        return endpoint, keys
+    @staticmethod
+    def get_mark_price(symbol: str, max_age: float = None) -> float:
+        """
+        Latest mark price from the shared board of the market feed, None when it is not followed or stale.
+        """
+        return get_mark_price(symbol, max_age=max_age)
 
-    def _request(self, api_key: str, api_secret: str, api_passphrase: str,
-                 method: str, endpoint: str, data=None) -> (int, str,):
-        self.LOCKED = True
+    @staticmethod
+    def _sizing_price(signal: Signal, mark_price: float = None) -> float:
+        # Market orders fill around the mark price, limit orders at the signal entry
+        if signal.order_type == Signal.OrderChoices.MARKET and mark_price:
+            return mark_price
+        return signal.entry
 
-        url = f'{self.BASE_URL}{endpoint}'
+    @staticmethod
+    def check_risk(signal: Signal, mark_price: float = None):
+        """
+        Raises a ValueError when the mark price is already past the signal's stop loss.
+        """
+        if not mark_price:
+            return
+        if (mark_price - signal.stop_loss) * (1, -1)[signal.type == Signal.TypeChoices.SHORT] <= 0:
+            raise ValueError(f'{signal.pair} mark price {mark_price} is already past the stop loss!')
 
-        data_json = json.dumps(data).replace(' ', '')
-        data_json = (data_json, None)[data_json in ('null', '{}')]
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def target_shares(strategy: str, target_count: int) -> tuple:
+        # Depends on nothing else, computed once per (strategy, target count) instead of once per subscriber
+        service: MarketService = MarketService()
+        return tuple(service.calculate_target_shares(strategy, target_count))
 
-        header = self.get_header(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
-                                 method=method, endpoint=endpoint, is_json=True, data=data_json)
-        response = self.session.request(method=method, url=url, headers=header, data=data_json)
+    @classmethod
+    def size_army(cls, signal: Signal, lot_size_contract: float, balances: np.ndarray, caps: np.ndarray,
+                  strategies: list, mark_price: float = None) -> (np.ndarray, np.ndarray,):
+        """
+        Sizes a signal for many subscribers in one pass, like get_lot_size and _signal_order do for one.
+        :param balances: available balance of every subscriber
+        :param caps: their share of the balance per signal, 0 (or nan) for the signal capital
+        :return: (main sizes, take-profit sizes of shape (subscribers, targets)), in whole lots. The take-profit
+                 sizes add up to the main size, the lots left by flooring go to the largest remainders
+        """
+        caps = np.nan_to_num(caps)
+        usable_balances = balances * np.where(caps, caps, signal.capital)
+        price = cls._sizing_price(signal=signal, mark_price=mark_price)
+        sizes = np.floor(usable_balances * signal.leverage / (lot_size_contract * price)).astype(np.int64)
 
-        self.LOCKED = False
-        return response.status_code, response.json()
+        strategies, index = np.unique(np.asarray(strategies), return_inverse=True)
+        shares = np.array([cls.target_shares(strategy, len(signal.targets)) for strategy in strategies])[index]
+        return sizes, cls._split_lots(sizes, shares)
 
-    def request(self, api_key: str, api_secret: str, api_passphrase: str, point: str, **kwargs):
-        req = self.REQUESTS.get(point)
-        endpoint = req.get('endpoint')
-        method = req.get('method')
+    @staticmethod
+    def _split_lots(sizes: np.ndarray, shares: np.ndarray) -> np.ndarray:
+        """
+        :param shares: take-profit shares of every size, shape (sizes, targets)
+        :return: take-profit sizes in whole lots adding up to each size, the lots left by flooring go to the
+                 largest remainders
+        """
+        exact = shares * sizes[:, None]
+        # The epsilon keeps 2.9999999999999996 lots from flooring to 2
+        tp_sizes = np.floor(exact + 1e-9).astype(np.int64)
+        left = sizes - tp_sizes.sum(axis=1)
+        ranks = np.argsort(np.argsort(tp_sizes - exact, axis=1, kind='stable'), axis=1, kind='stable')
+        return tp_sizes + (ranks < left[:, None])
+
+    def _plan(self, execution: ExecutionSnapshot, lot_size_contract: float, snapshots: dict,
+              mark_price: float = None) -> dict:
+        accounts, balances = [], []
+        for account in execution.accounts:
+            balance = self.snapshot_balance(account.api_key, currency='USDT', max_age=self.balances.MAX_AGE,
+                                             snapshots=snapshots)
+            if balance is not None:
+                accounts.append(account)
+                balances.append(balance)
+        if not accounts:
+            return {}
+
+        sizes, tp_sizes = self.size_army(signal=execution.signal, lot_size_contract=lot_size_contract,
+                                         balances=np.array(balances, dtype=float),
+                                         caps=np.array([account.cap or 0 for account in accounts], dtype=float),
+                                         strategies=[account.strategy for account in accounts],
+                                         mark_price=mark_price)
+        return {account.pk: (int(size), tps) for account, size, tps in zip(accounts, sizes, tp_sizes.tolist())}
 
-        endpoint, keys = self._make_endpoint_format(endpoint=endpoint, **kwargs)
-        [kwargs.pop(key) for key in keys]
+    @classmethod
+    def _signal_order(cls, signal: Signal, user: User, usable_balance_lot: int, tp_sizes: list = None) -> dict:
+        if tp_sizes is None:
+            tp_sizes = cls._split_lots(np.array([usable_balance_lot]),
+                                       np.array([cls.target_shares(user.strategy, len(signal.targets))]))[0].tolist()
+        return dict(symbol=signal.pair, leverage=str(signal.leverage),
+                    price=str(signal.entry), type=signal.type, order_type=signal.order_type,
+                    size=str(usable_balance_lot), tp_prices=signal.targets,
+                    stop_price=str(signal.stop_loss), tp_sizes=tp_sizes,
+                    client_oid=cls._client_oid(signal_id=signal.pk, user_id=user.pk))
 
-        endpoint = self._params_to_endpoint(endpoint=endpoint, **kwargs)
-        return self._request(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase,
-                             method=method, endpoint=endpoint, data=kwargs)
 
+BaseKuCoinService._compile_requests()
 
-@singleton
-class KuCoinService(BaseKuCoinService):
 
-    def get_account_overview(self, **kwargs):
+class KuCoinOperations:
+    """
+    The KuCoin operations, written once as coroutines over a transport and run by KuCoinService (blocking) and
+    AsyncKuCoinService (event loop). The transport provides request, _gather, _spawn, _join, _blocking (runs a
+    blocking call, e.g. Redis, off the loop) and _contracts.
+    """
+
+    async def get_account_overview(self, **kwargs):
         """
         HTTP Request
         GET /api/v1/account-overview
@@ -191,9 +561,9 @@ class KuCoinService(BaseKuCoinService):
         This API is restricted for each account, the request rate limit is 30 times/3s.
         """
 
-        return self.request(point='get_account_overview', **kwargs)
+        return await self.request(point='get_account_overview', **kwargs)
 
-    def _place_order(self, **kwargs):
+    async def _place_order(self, **kwargs):
         """
         You can place two types of orders: limit and market. Orders can only be placed if your account
         has sufficient funds. Once an order is placed, your funds will be put on hold for the duration of the order.
@@ -260,9 +630,33 @@ class KuCoinService(BaseKuCoinService):
 
         """
 
-        return self.request(point='place_order', **kwargs)
+        return await self.request(point='place_order', **kwargs)
 
-    def cancel_order(self, **kwargs):
+    async def _place_multiple_orders(self, **kwargs):
+        """
+        Place up to 20 orders, limit, market or stop, in one request.
+
+        HTTP Request
+        POST /api/v1/orders/multi
+
+        API Permission
+        This endpoint requires the Trade permission
+
+        Parameters
+        The body is a JSON array of orders, each with the parameters of Place Order.
+
+        RESPONSES
+        Param	Type
+        orderId	Order ID
+        clientOid	Client order id of the placed order
+        symbol	Symbol of the contract
+        code	Result code of this order, 200000 when it was placed
+        msg	Result message of this order
+        """
+
+        return await self.request(point='place_multiple_orders', **kwargs)
+
+    async def cancel_order(self, **kwargs):
         """
         Cancel an order (including a stop order).
 
@@ -288,9 +682,9 @@ class KuCoinService(BaseKuCoinService):
         cancelledOrderIds 	cancelled OrderIds.
         """
 
-        return self.request(point='cancel_order', **kwargs)
+        return await self.request(point='cancel_order', **kwargs)
 
-    def _get_open_contract_list(self, **kwargs):
+    async def _get_open_contract_list(self, **kwargs):
         """
         Submit request to get the info of all open contracts.
 
@@ -362,9 +756,9 @@ class KuCoinService(BaseKuCoinService):
         priceChg	24H Change
         """
 
-        return self.request(point='get_open_contract_list', **kwargs)
+        return await self.request(point='get_open_contract_list', **kwargs)
 
-    def stop_order_mass_cancellation(self, **kwargs):
+    async def stop_order_mass_cancellation(self, **kwargs):
         """
         Cancel all untriggered stop orders. The response is a list of orderIDs of the canceled stop orders.
          To cancel triggered stop orders, please use 'Limit Order Mass Cancelation'.
@@ -388,9 +782,9 @@ class KuCoinService(BaseKuCoinService):
         cancelledOrderIds	cancelled OrderIds.
         """
 
-        return self.request(point='stop_order_mass_cancellation', **kwargs)
+        return await self.request(point='stop_order_mass_cancellation', **kwargs)
 
-    def limit_order_mass_cancellation(self, **kwargs):
+    async def limit_order_mass_cancellation(self, **kwargs):
         """
         Cancel all open orders (excluding stop orders). The response is a list of orderIDs of the canceled orders.
 
@@ -416,9 +810,9 @@ class KuCoinService(BaseKuCoinService):
         cancelledOrderIds	cancelled OrderIds.
         """
 
-        return self.request(point='limit_order_mass_cancellation', **kwargs)
+        return await self.request(point='limit_order_mass_cancellation', **kwargs)
 
-    def _get_contract_info(self, **kwargs):
+    async def _get_contract_info(self, **kwargs):
         """
         Submit request to get info of the specified contract.
 
@@ -490,9 +884,9 @@ class KuCoinService(BaseKuCoinService):
         priceChg	24H Change
         """
 
-        return self.request(point='get_contract_info', **kwargs)
+        return await self.request(point='get_contract_info', **kwargs)
 
-    def get_order_list(self, **kwargs):
+    async def get_order_list(self, **kwargs):
         """
         List your current orders.
         HTTP Request
@@ -580,9 +974,9 @@ class KuCoinService(BaseKuCoinService):
          you may query the endpoint Get List of Orders Completed in 24h.
         """
 
-        return self.request(point='get_order_list', **kwargs)
+        return await self.request(point='get_order_list', **kwargs)
 
-    def get_position_list(self, **kwargs):
+    async def get_position_list(self, **kwargs):
         """
         Get the position details of a specified position.
         HTTP Request
@@ -639,9 +1033,9 @@ class KuCoinService(BaseKuCoinService):
         maintainMargin 	Maintenance margin requirement
         """
 
-        return self.request(point='get_position_list', **kwargs)
+        return await self.request(point='get_position_list', **kwargs)
 
-    def get_untriggered_stop_order_list(self, **kwargs):
+    async def get_untriggered_stop_order_list(self, **kwargs):
         """
         Get the un-triggered stop orders list.
         HTTP Request
@@ -706,93 +1100,366 @@ class KuCoinService(BaseKuCoinService):
         This request is paginated.
         """
 
-        return self.request(point='get_untriggered_stop_order_list', **kwargs)
+        return await self.request(point='get_untriggered_stop_order_list', **kwargs)
 
-    def get_balance(self, **kwargs) -> float:
-        code, data = self.get_account_overview(**kwargs)
-        return data.get('data').get('availableBalance') or 0
+    async def get_balance(self, **kwargs) -> float:
+        code, data = await self.get_account_overview(**kwargs)
+        return AccountOverview.from_json(data.get('data')).available_balance or 0
 
-    def get_active_contracts(self, **kwargs):
-        contracts = self._get_open_contract_list(**kwargs)[1].get('data')
-        return [contract['symbol'] for contract in contracts]
+    async def get_recent_balance(self, currency='USDT', max_age: float = None, snapshots: dict = None,
+                                 **kwargs) -> float:
+        """
+        Available balance no older than max_age seconds (BalanceStore.MAX_AGE by default), read locally
+        when a snapshot is fresh and fetched live, then written back for the other workers, otherwise.
+        :param snapshots: balances prefetched for a whole fan-out, see BalanceStore.get_many
+        """
+        max_age = max_age or self.balances.MAX_AGE
+        snapshot = partial(self.snapshot_balance, kwargs.get('api_key'), currency=currency, max_age=max_age,
+                           snapshots=snapshots)
+        # Without prefetched snapshots the shared one is read from Redis
+        balance = snapshot() if snapshots is not None else await self._blocking(snapshot)
+        if balance is None:
+            balance = await self.get_balance(currency=currency, **kwargs)
+            await self._blocking(self.balances.put, kwargs.get('api_key'), balance, currency=currency)
+        return balance
+
+    async def fetch_contracts(self) -> list:
+        contracts = await self._get_open_contract_list()
+        # A throttled or failed listing must not be taken for an empty one
+        if not self._accepted(contracts):
+            raise ConnectionError(f'get_open_contract_list failed with {contracts[0]}: {contracts[1]}')
+        return contracts[1].get('data')
+
+    async def get_active_contracts(self, **kwargs):
+        return (await self._contracts()).symbols()
+
+    async def _get_lot_size_contract(self, symbol: str, **kwargs):
+        return (await self._contracts()).lot_size(symbol)
+
+    async def get_lot_size(self, symbol: str, balance: float, price: float, leverage: int, **kwargs):
+        return self._calculate_lot_size(await self._get_lot_size_contract(symbol=symbol, **kwargs),
+                                        balance=balance, price=price, leverage=leverage)
+
+    async def place_stop_order(self, clientOid: str, side: str, symbol: str,
+                               stop: str, stop_price: str, size: str, **kwargs):
+        params = self._stop_order_params(clientOid=clientOid, side=side, symbol=symbol,
+                                         stop=stop, stop_price=stop_price, size=size)
+
+        return await self._place_order(**params, **kwargs)
+
+    async def get_position(self, symbol: str, **kwargs) -> Position:
+        """
+        Open position of the symbol, read from the account's private feed mirror when it is live.
+        :return: None when there is no open position
+        """
+        if mirror := MirrorRegistry().get(kwargs.get('api_key')):
+            return mirror.position(symbol)
 
-    def _get_lot_size_contract(self, symbol: str, **kwargs):
-        contract = self._get_contract_info(symbol=symbol, **kwargs)[1].get('data')
-        return contract.get('lotSize') * contract.get('multiplier')
+        code, data = await self.get_position_list(symbol=symbol, **kwargs)
+        return Position.find(data.get('data'), symbol=symbol)
 
-    def get_lot_size(self, symbol: str, balance: float, price: float, leverage: int, **kwargs):
-        return int((balance * leverage) / (self._get_lot_size_contract(symbol=symbol, **kwargs) * price))
+    async def get_open_orders(self, symbol: str = None, **kwargs) -> list:
+        """
+        Active limit and untriggered stop orders, read from the account's private feed mirror when it is live.
+        """
+        if mirror := MirrorRegistry().get(kwargs.get('api_key')):
+            return mirror.open_orders(symbol=symbol)
 
-    def place_stop_order(self, clientOid: str, side: str, symbol: str,
-                         stop: str, stop_price: str, size: str, **kwargs):
-        params = {
-            'clientOid': clientOid,
-            'side': side,
-            'symbol': symbol,
-            'type': 'market',
-            'stop': stop,
-            'stopPriceType': 'TP',
-            'stopPrice': stop_price,
-            'leverage': '1',
-            'size': size,
-        }
+        params = dict(symbol=symbol) if symbol else {}
+        orders, stop_orders = await self._gather(self.get_order_list(status='active', **params, **kwargs),
+                                                 self.get_untriggered_stop_order_list(**params, **kwargs))
+        return Order.from_json_list(orders[1].get('data').get('items') + stop_orders[1].get('data').get('items'))
 
-        return self._place_order(**params, **kwargs)
+    async def iter_orders(self, status='done', symbol: str = None, start_at: int = None, end_at: int = None,
+                          stop=False, concurrency=1, **kwargs):
+        """
+        Lazily walks the order history page by page and, for done orders, in 7 day windows, oldest window first.
+        Orders are yielded as their page arrives and at most concurrency + 1 pages are held at a time, so any
+        span of history streams in constant memory.
+        :param start_at: start time in milliseconds, 7 days before end_at by default
+        :param end_at: end time in milliseconds, now by default
+        :param stop: untriggered stop orders instead of the order list
+        :param concurrency: windows fetched ahead in parallel, every page still goes through the rate limiter
+        """
+        point, queries = self._order_queries(status=status, symbol=symbol, start_at=start_at, end_at=end_at, stop=stop)
+        queries = iter(queries)
+
+        def fetch(query: dict, page: int):
+            return self._spawn(self.request(point=point, currentPage=page, pageSize=self.ORDERS_PAGE_SIZE,
+                                            **query, **kwargs))
+
+        pending = deque((query, fetch(query, 1)) for query in islice(queries, concurrency))
+        future = None
+        try:
+            while pending:
+                query, future = pending.popleft()
+                for ahead in islice(queries, 1):
+                    pending.append((ahead, fetch(ahead, 1)))
+
+                page = 1
+                while future is not None:
+                    items, last = self._page_items(point, await self._join(future), page)
+                    future = None if last else fetch(query, page + 1)
+                    page += 1
+                    for item in items:
+                        yield item
+        finally:
+            # Closed early, drop the pages fetched ahead
+            for _, ahead in pending:
+                ahead.cancel()
+            if future is not None:
+                future.cancel()
+
+    async def close_position(self, symbol: str, client_oid: str = None, **kwargs):
+        """
+        :param client_oid: clientOid of the market close, the id of the current position when None
+        """
+        if client_oid is None:
+            current_position = await self.get_position(symbol=symbol, **kwargs)
+            client_oid = current_position.id if current_position else None
 
-    def close_position(self, symbol: str, **kwargs):
-        code, data = self.get_position_list(symbol=symbol, **kwargs)
-        positions = data.get('data')
+        return await self._place_order(symbol=symbol, type='market', closeOrder=True, clientOid=client_oid,
+                                       **kwargs)
 
-        current_position = ''
-        for pos in positions:
-            if pos['symbol'] == symbol:
-                current_position = pos
-                break
+    async def place_order(self, symbol: str, leverage: str, price: str, order_type: str,
+                          size: str, tp_prices: str, stop_price: str, tp_sizes: list, type: str,
+                          legs_mode: str = None, client_oid: str = None, **kwargs):
+        """
+        Places the main order and, once it is accepted, its take-profit and stop-loss legs.
+        :param legs_mode: LEGS_SEQUENTIAL, LEGS_CONCURRENT or LEGS_BATCH (falls back to concurrent), LEGS_MODE by default
+        :param client_oid: clientOid prefix of the legs, lets the fill sync map them back to their Trade
+        :return: (main_order, tp_orders, sl_order), legs are empty/None when the main order was rejected
+        """
+        return await self.place_legs(*await self.order_legs(symbol=symbol, leverage=leverage, price=price,
+                                                            order_type=order_type, size=size, tp_prices=tp_prices,
+                                                            stop_price=stop_price, tp_sizes=tp_sizes, type=type,
+                                                            client_oid=client_oid),
+                                     legs_mode=legs_mode, **kwargs)
 
-        return self._place_order(symbol=symbol, type='market',
-                                 closeOrder=True, clientOid=current_position.get('id'), **kwargs)
+    async def order_legs(self, symbol: str, leverage: str, size: str, **kwargs) -> (dict, list, dict,):
+        """
+        Validated parameters of an order and its legs, see _order_legs.
+        """
+        self._validate_order((await self._contracts()).get(symbol), leverage=leverage, size=size)
+        return self._order_legs(symbol=symbol, leverage=leverage, size=size, **kwargs)
 
-    def place_order(self, symbol: str, leverage: str, price: str, order_type: str,
-                    size: str, tp_prices: str, stop_price: str, tp_sizes: list, type: str,
-                    **kwargs):
-        side = ('sell', 'buy')[type == 'long']
+    async def place_legs(self, main_params: dict, tp_params: list, sl_params: dict, legs_mode: str = None,
+                         **kwargs):
+        """
+        Sends an order built by order_legs: the main order and, once it is accepted, its legs.
+        :return: (main_order, tp_orders, sl_order), see place_order
+        """
+        main_order = await self._place_order(**main_params, **kwargs)
+        if not self._accepted(main_order):
+            return main_order, [], None
 
-        main_order = self._place_order(clientOid=uuid4().hex,
-                                       side=side,
-                                       symbol=symbol,
-                                       leverage=leverage,
-                                       price=price,
-                                       size=size,
-                                       type=order_type,
-                                       **kwargs)
+        *tp_orders, sl_order = await self._place_legs(legs=tp_params + [sl_params],
+                                                      legs_mode=legs_mode or self.LEGS_MODE, **kwargs)
+        self._report_legs(symbol=main_params['symbol'], tp_orders=tp_orders, sl_order=sl_order)
+        return main_order, tp_orders, sl_order
+
+    async def _place_legs(self, legs: list, legs_mode: str, **kwargs) -> list:
+        """
+        Places the protective legs, failed legs are returned in place as their response or exception.
+        """
+        if legs_mode == self.LEGS_SEQUENTIAL:
+            return [await self._place_order(**params, **kwargs) for params in legs]
+
+        if legs_mode == self.LEGS_BATCH and self.batch_orders:
+            batches = self._batches(legs)
+            placed = self._batch_legs(batches, await self._gather(
+                *[self._place_multiple_orders(orders=batch, **kwargs) for batch in batches], return_exceptions=True))
+            retry = [it for it, leg in enumerate(placed) if leg is None]
+            if not retry:
+                return placed
+            # Not served by this exchange environment, stay on single placements from now on. Only the legs
+            # of the batches that got a 404 are placed again, the others were placed already
+            self.batch_orders = False
+            self.metrics.record_retry('place_multiple_orders')
+            for it, leg in zip(retry, await self._place_concurrently([legs[it] for it in retry], **kwargs)):
+                placed[it] = leg
+            return placed
+
+        return await self._place_concurrently(legs, **kwargs)
+
+    async def _place_concurrently(self, legs: list, **kwargs) -> list:
+        return await self._gather(*[self._place_order(**params, **kwargs) for params in legs], return_exceptions=True)
+
+    async def execute_signal(self, signal: Signal, user: User, usable_balance: float, **kwargs):
+        mark_price = self.get_mark_price(signal.pair)
+        self.check_risk(signal=signal, mark_price=mark_price)
+        usable_balance_lot = await self.get_lot_size(symbol=signal.pair, balance=usable_balance,
+                                                     price=self._sizing_price(signal=signal, mark_price=mark_price),
+                                                     leverage=signal.leverage, **kwargs)
+
+        return await self.place_order(**self._signal_order(signal=signal, user=user,
+                                                           usable_balance_lot=usable_balance_lot), **kwargs)
+
+    async def plan_execution(self, execution: ExecutionSnapshot, snapshots: dict = None) -> dict:
+        """
+        Checks the signal against the mark price and sizes every account with a fresh balance in one pass.
+        :return: user id -> (main size, take-profit sizes), accounts without a fresh balance are left out
+        """
+        mark_price = self.get_mark_price(execution.signal.pair)
+        try:
+            self.check_risk(signal=execution.signal, mark_price=mark_price)
+            lot_size_contract = await self._get_lot_size_contract(symbol=execution.signal.pair)
+        except (ValueError, KeyError):
+            # Nothing is planned, every account then fails its own check, or misses the contract, and is recorded
+            return {}
+        return self._plan(execution, lot_size_contract=lot_size_contract, snapshots=snapshots, mark_price=mark_price)
+
+    async def plan_orders(self, execution: ExecutionSnapshot, snapshots: dict = None) -> dict:
+        """
+        The orders of plan_execution, built and validated.
+        :return: user id -> (main order, take-profit, stop-loss params), accounts sized below one lot are left out
+        """
+        orders = {}
+        sizes = await self.plan_execution(execution, snapshots=snapshots)
+        for account in execution.accounts:
+            if account.pk not in sizes:
+                continue
+            size, tp_sizes = sizes[account.pk]
+            try:
+                orders[account.pk] = await self.order_legs(**self._signal_order(signal=execution.signal,
+                                                                                user=account,
+                                                                                usable_balance_lot=size,
+                                                                                tp_sizes=tp_sizes))
+            except (ValueError, KeyError):
+                # Sized on its own at execution, where it fails and is recorded as such
+                continue
+        return orders
+
+    async def execute_account(self, signal: SignalSnapshot, account: AccountSnapshot, snapshots: dict = None,
+                              order: tuple = None):
+        """
+        :param order: the account's order legs from plan_orders, the account is sized on its own without
+        """
+        if order is not None:
+            return await self.place_legs(*order, **account.auth)
+        balance = await self.get_recent_balance(**account.auth, snapshots=snapshots)
+        return await self.execute_signal(**account.auth, signal=signal, user=account,
+                                         usable_balance=account.usable_balance(balance=balance, signal=signal))
 
-        tp_orders = [self.place_stop_order(clientOid=uuid4().hex,
-                                           side='sell' if side == 'buy' else 'buy',
-                                           symbol=symbol,
-                                           stop='up' if side == 'buy' else 'down',
-                                           stop_price=tp_price,
-                                           size=tp_sizes[it],
-                                           **kwargs) for it, tp_price in enumerate(tp_prices) if tp_price and tp_sizes[it]]
-
-        sl_order = self.place_stop_order(clientOid=uuid4().hex,
-                                         side='sell' if side == 'buy' else 'buy',
-                                         symbol=symbol,
-                                         stop='down' if side == 'buy' else 'up',
-                                         stop_price=stop_price,
-                                         size=size,
-                                         **kwargs)
 
-        return main_order, tp_orders, sl_order
+class _BlockingOperations(KuCoinOperations):
+    """
+    KuCoinOperations over the blocking transport of a KuCoinService, every attribute is the service's own.
+    Nothing awaited here suspends, an operation runs to its end in the calling thread (see _run) and only
+    _gather and _spawn hand work to the service's threads.
+    """
 
-    def execute_signal(self, signal: Signal, user: User, usable_balance: float, **kwargs):
-        usable_balance_lot = self.get_lot_size(symbol=signal.pair, balance=usable_balance,
-                                               price=signal.entry, leverage=signal.leverage,
-                                               **kwargs)
+    def __init__(self, service: BaseKuCoinService):
+        object.__setattr__(self, 'service', service)
 
-        service: MarketService = MarketService()
-        tp_sizes = [portion * usable_balance_lot for portion in service.calculate_target_shares(user.strategy,
-                                                                                                len(signal.targets))]
-        return self.place_order(symbol=signal.pair, leverage=str(signal.leverage),
-                                price=str(signal.entry), type=signal.type, order_type=signal.order_type,
-                                size=str(usable_balance_lot), tp_prices=signal.targets,
-                                stop_price=str(signal.stop_loss), tp_sizes=tp_sizes, **kwargs)
+    def __getattr__(self, name: str):
+        return getattr(self.service, name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self.service, name, value)
+
+    async def request(self, point: str, **kwargs):
+        return self.service.request(point=point, **kwargs)
+
+    async def _gather(self, *operations, return_exceptions=False) -> list:
+        futures = [self.legs_executor.submit(_run, operation) for operation in operations]
+        if return_exceptions:
+            return [future.exception() or future.result() for future in futures]
+        return [future.result() for future in futures]
+
+    def _spawn(self, operation) -> Future:
+        future = self.legs_executor.submit(_run, operation)
+        # Cancelled before it ran, the coroutine is closed instead of left unawaited
+        future.add_done_callback(lambda done: done.cancelled() and operation.close())
+        return future
+
+    @staticmethod
+    async def _join(future: Future):
+        return future.result()
+
+    @staticmethod
+    async def _blocking(fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    @staticmethod
+    async def _contracts() -> ContractStore:
+        # Refreshed in place by the store when it is stale
+        return ContractStore()
+
+
+def _run(operation):
+    """
+    Runs a coroutine of _BlockingOperations, it completes in its first step.
+    """
+    try:
+        operation.send(None)
+    except StopIteration as done:
+        return done.value
+    operation.close()
+    raise RuntimeError('an operation suspended on the blocking transport!')
+
+
+def _blocking(name: str):
+    """
+    Blocking method running the KuCoinOperations coroutine (or async generator) of the name.
+    """
+    operation = getattr(KuCoinOperations, name)
+    if isasyncgenfunction(operation):
+        @wraps(operation)
+        def generator(self, *args, **kwargs):
+            items = operation(_BlockingOperations(self), *args, **kwargs)
+            try:
+                while True:
+                    try:
+                        yield _run(items.__anext__())
+                    except StopAsyncIteration:
+                        return
+            finally:
+                _run(items.aclose())
+        return generator
+
+    @wraps(operation)
+    def method(self, *args, **kwargs):
+        return _run(operation(_BlockingOperations(self), *args, **kwargs))
+    return method
+
+
+@singleton
+class KuCoinService(BaseKuCoinService):
+    """
+    Blocking KuCoin client, every thread of a fan-out calls it at once. Its methods run KuCoinOperations,
+    see there for the endpoint documentation.
+    """
+    get_account_overview = _blocking('get_account_overview')
+    _place_order = _blocking('_place_order')
+    _place_multiple_orders = _blocking('_place_multiple_orders')
+    cancel_order = _blocking('cancel_order')
+    _get_open_contract_list = _blocking('_get_open_contract_list')
+    stop_order_mass_cancellation = _blocking('stop_order_mass_cancellation')
+    limit_order_mass_cancellation = _blocking('limit_order_mass_cancellation')
+    _get_contract_info = _blocking('_get_contract_info')
+    get_order_list = _blocking('get_order_list')
+    get_position_list = _blocking('get_position_list')
+    get_untriggered_stop_order_list = _blocking('get_untriggered_stop_order_list')
+    get_balance = _blocking('get_balance')
+    get_recent_balance = _blocking('get_recent_balance')
+    fetch_contracts = _blocking('fetch_contracts')
+    get_active_contracts = _blocking('get_active_contracts')
+    _get_lot_size_contract = _blocking('_get_lot_size_contract')
+    get_lot_size = _blocking('get_lot_size')
+    place_stop_order = _blocking('place_stop_order')
+    get_position = _blocking('get_position')
+    get_open_orders = _blocking('get_open_orders')
+    iter_orders = _blocking('iter_orders')
+    close_position = _blocking('close_position')
+    place_order = _blocking('place_order')
+    order_legs = _blocking('order_legs')
+    place_legs = _blocking('place_legs')
+    execute_signal = _blocking('execute_signal')
+    plan_execution = _blocking('plan_execution')
+    plan_orders = _blocking('plan_orders')
+    execute_account = _blocking('execute_account')
+
+    @property
+    def contracts(self) -> ContractStore:
+        return ContractStore()
@@ -0,0 +1,48 @@
+import time
+import base64
+import hmac
+import hashlib
+from functools import lru_cache
+
+
+class KuCoinSigner:
+    """
+    Signing material of one API credential. The signed passphrase and the keyed HMAC state are derived
+    once, every request then only copies the prepared state and feeds it the string to sign.
+    """
+    __slots__ = ('api_key', 'passphrase', '_hmac')
+
+    KEY_VERSION = '2'
+
+    def __init__(self, api_key: str, api_secret: str, api_passphrase: str):
+        secret = api_secret.encode('utf-8')
+        self.api_key = api_key
+        self._hmac = hmac.new(secret, digestmod=hashlib.sha256)
+        self.passphrase = base64.b64encode(
+            hmac.new(secret, api_passphrase.encode('utf-8'), hashlib.sha256).digest()).decode()
+
+    def sign(self, str_to_sign: str) -> str:
+        mac = self._hmac.copy()
+        mac.update(str_to_sign.encode('utf-8'))
+        return base64.b64encode(mac.digest()).decode()
+
+    def get_header(self, method: str, endpoint: str, is_json=False, data=None) -> dict:
+        now = str(int(time.time() * 1000))
+        headers = {
+            "KC-API-SIGN": self.sign(f'{now}{method.upper()}{endpoint}{data or ""}'),
+            "KC-API-TIMESTAMP": now,
+            "KC-API-KEY": self.api_key,
+            "KC-API-PASSPHRASE": self.passphrase,
+            "KC-API-KEY-VERSION": self.KEY_VERSION
+        }
+
+        if is_json:
+            headers['Content-Type'] = 'application/json'
+
+        return headers
+
+
+@lru_cache(maxsize=1024 * 16)
+def get_signer(api_key: str, api_secret: str, api_passphrase: str) -> KuCoinSigner:
+    # Keyed by the whole credential, a rotated secret or passphrase gets a fresh signer
+    return KuCoinSigner(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase)
@@ -0,0 +1,96 @@
+from typing import NamedTuple
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce, Now
+from account.models import User
+from market.models import Signal
+
+
+class SignalSnapshot(NamedTuple):
+    """
+    The fields of a Signal an execution reads, with the attribute names of the model.
+    """
+    pk: int
+    pair: str
+    order_type: str
+    type: str
+    entry: float
+    targets: tuple
+    stop_loss: float
+    capital: float
+    leverage: int
+    # Unix time the signal was published at, executions are scheduled against it
+    created: float = None
+    # Executions of a trader's signals share one scheduling lane
+    trader_id: int = None
+
+    @classmethod
+    def from_signal(cls, signal: Signal):
+        return cls(pk=signal.pk, pair=signal.pair, order_type=signal.order_type, type=signal.type,
+                   entry=signal.entry, targets=tuple(signal.targets), stop_loss=signal.stop_loss,
+                   capital=signal.capital, leverage=signal.leverage,
+                   created=signal.created.timestamp() if signal.created else None, trader_id=signal.trader_id)
+
+
+class AccountSnapshot(NamedTuple):
+    """
+    A subscriber and its KuCoin credentials, it stands in for the User the services read.
+    """
+    pk: int
+    strategy: str
+    cap: float
+    api_key: str
+    api_secret: str
+    api_passphrase: str
+    # Price of the subscriber's current plan, higher tiers are executed first
+    tier: int = 0
+
+    @property
+    def auth(self) -> dict:
+        return dict(api_key=self.api_key, api_secret=self.api_secret, api_passphrase=self.api_passphrase)
+
+    def usable_balance(self, balance: float, signal: SignalSnapshot) -> float:
+        return balance * (self.cap, signal.capital)[not self.cap]
+
+
+class ExecutionSnapshot(NamedTuple):
+    """
+    Everything a signal fan-out needs, read in one query before any worker starts so that the workers never
+    touch the ORM (nor open database connections of their own).
+    """
+    signal: SignalSnapshot
+    accounts: tuple
+
+    FIELDS = ('id', 'strategy', 'cap', 'kucoin__api_key', 'kucoin__api_secret', 'kucoin__api_passphrase', 'tier')
+
+    @staticmethod
+    def _with_tier(users):
+        return users.annotate(tier=Coalesce(Max('payments__plan__price',
+                                                filter=Q(payments__is_accepted=True, payments__expired__gt=Now())), 0))
+
+    @staticmethod
+    def _army(signal: Signal):
+        # trader_id instead of signal.trader, the army is filtered without loading the trader
+        return User.objects.active().filter(user_trader_id=signal.trader_id, kucoin__isnull=False)
+
+    @classmethod
+    def load(cls, signal: Signal):
+        accounts = cls._with_tier(cls._army(signal)).values_list(*cls.FIELDS)
+        return cls(signal=SignalSnapshot.from_signal(signal),
+                   accounts=tuple(AccountSnapshot(*row) for row in accounts))
+
+    @classmethod
+    def army_ids(cls, signal: Signal) -> list:
+        return list(cls._army(signal).values_list('id', flat=True))
+
+    @classmethod
+    def load_accounts(cls, signal: SignalSnapshot, user_ids: list):
+        """
+        Snapshot of a part of the army, in one query, for workers that only received the signal and user ids.
+        """
+        accounts = cls._with_tier(User.objects.filter(id__in=user_ids,
+                                                      kucoin__isnull=False)).values_list(*cls.FIELDS)
+        return cls(signal=signal, accounts=tuple(AccountSnapshot(*row) for row in accounts))
+
+    @property
+    def api_keys(self) -> list:
+        return [account.api_key for account in self.accounts]
@@ -0,0 +1,235 @@
+import json
+import asyncio
+import logging
+import threading
+from uuid import uuid4
+from aiohttp import WSMsgType
+from .async_services import AsyncKuCoinService
+from .mirrors import AccountMirror, MirrorRegistry
+from .prices import MarkPriceBoard
+
+
+class BaseStream:
+    """
+    One KuCoin websocket connection: token negotiation, subscriptions, application pings and reconnects.
+    Subclasses choose the token request and topics and consume the pushed messages.
+    """
+    TOKEN_POINT = None
+    PRIVATE = False
+    RECONNECT_DELAY = 1
+    MAX_RECONNECT_DELAY = 30
+
+    def __init__(self, service: AsyncKuCoinService):
+        self.service = service
+        self._stopped = asyncio.Event()
+        self._ws = None
+
+    @property
+    def topics(self) -> list:
+        raise NotImplementedError
+
+    def _token_kwargs(self) -> dict:
+        return {}
+
+    async def _connect_url(self) -> (str, float,):
+        code, data = await self.service.request(point=self.TOKEN_POINT, **self._token_kwargs())
+        data = data.get('data')
+        server = data.get('instanceServers')[0]
+        return f'{server["endpoint"]}?token={data["token"]}&connectId={uuid4().hex}', server['pingInterval'] / 1000
+
+    async def _subscribe(self, ws, topic: str):
+        await ws.send_json({'id': uuid4().hex, 'type': 'subscribe', 'topic': topic,
+                            'privateChannel': self.PRIVATE, 'response': True})
+
+    @staticmethod
+    async def _ping(ws, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await ws.send_json({'id': uuid4().hex, 'type': 'ping'})
+
+    async def on_connected(self):
+        pass
+
+    def on_disconnected(self):
+        pass
+
+    def on_message(self, topic: str, subject: str, data: dict):
+        raise NotImplementedError
+
+    async def _session(self):
+        url, ping_interval = await self._connect_url()
+        async with self.service.session.ws_connect(url) as ws:
+            self._ws = ws
+            welcome = await ws.receive_json()
+            if welcome.get('type') != 'welcome':
+                raise ConnectionError(f'unexpected websocket greeting {welcome}')
+            for topic in self.topics:
+                await self._subscribe(ws, topic)
+
+            pinger = asyncio.ensure_future(self._ping(ws, ping_interval))
+            try:
+                await self.on_connected()
+                async for msg in ws:
+                    if msg.type != WSMsgType.TEXT:
+                        break
+                    message = json.loads(msg.data)
+                    if message.get('type') == 'message':
+                        self.on_message(message.get('topic'), message.get('subject'), message.get('data'))
+            finally:
+                pinger.cancel()
+                self.on_disconnected()
+
+    async def run(self):
+        delay = self.RECONNECT_DELAY
+        while not self._stopped.is_set():
+            try:
+                await self._session()
+                delay = self.RECONNECT_DELAY
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception('websocket session dropped!', extra={'stream': type(self).__name__})
+            if not self._stopped.is_set():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def stop(self):
+        self._stopped.set()
+        if self._ws is not None:
+            asyncio.ensure_future(self._ws.close())
+
+
+class PrivateStream(BaseStream):
+    """
+    Private trade-order, stop-order, wallet and position channels of one account mirrored into an AccountMirror.
+    The mirror is seeded from REST once the subscriptions are in, pushes buffered meanwhile are applied on top.
+    """
+    TOKEN_POINT = 'get_private_token'
+    PRIVATE = True
+    ORDER_TOPICS = ('/contractMarket/tradeOrders', '/contractMarket/advancedOrders')
+    POSITION_TOPIC = '/contract/position:{symbol}'
+    ALL_POSITIONS_TOPIC = '/contract/positionAll'
+    WALLET_TOPIC = '/contractAccount/wallet'
+
+    def __init__(self, service: AsyncKuCoinService, api_key: str, api_secret: str, api_passphrase: str,
+                 symbols: list = None, mirror: AccountMirror = None):
+        super(PrivateStream, self).__init__(service=service)
+        self.auth = dict(api_key=api_key, api_secret=api_secret, api_passphrase=api_passphrase)
+        self.symbols = symbols
+        self.mirror = mirror or MirrorRegistry().register(api_key)
+
+    @property
+    def topics(self) -> list:
+        if not self.symbols:
+            return [*self.ORDER_TOPICS, self.WALLET_TOPIC, self.ALL_POSITIONS_TOPIC]
+        return [*self.ORDER_TOPICS, self.WALLET_TOPIC,
+                *[self.POSITION_TOPIC.format(symbol=symbol) for symbol in self.symbols]]
+
+    def _token_kwargs(self) -> dict:
+        return self.auth
+
+    async def on_connected(self):
+        (_, orders), (_, stop_orders), (_, positions) = await asyncio.gather(
+            self.service.get_order_list(status='active', **self.auth),
+            self.service.get_untriggered_stop_order_list(**self.auth),
+            self.service.get_position_list(**self.auth))
+        self.mirror.load(orders=orders['data']['items'] + stop_orders['data']['items'],
+                         positions=positions['data'])
+
+    def on_disconnected(self):
+        # Until the next snapshot readers fall back to REST
+        self.mirror.ready = False
+
+    def on_message(self, topic: str, subject: str, data: dict):
+        if topic in self.ORDER_TOPICS:
+            change = dict(data)
+            change['changeType'] = change.pop('type', None)
+            self.mirror.apply_order(change)
+        elif topic == self.WALLET_TOPIC:
+            if subject == 'availableBalance.change':
+                self.mirror.apply_balance(data)
+        elif topic.startswith('/contract/position'):
+            if subject == 'position.change':
+                self.mirror.apply_position(data, symbol=topic.partition(':')[2] or None)
+
+
+class PublicStream(BaseStream):
+    """
+    Public mark-price and ticker channels of the followed symbols written into a MarkPriceBoard.
+    Symbols can be added while connected, they are subscribed on the live connection and kept for reconnects.
+    """
+    TOKEN_POINT = 'get_public_token'
+    MARK_PRICE_TOPIC = '/contract/instrument:{symbols}'
+    TICKER_TOPIC = '/contractMarket/ticker:{symbols}'
+    SYMBOLS_PER_TOPIC = 100
+
+    def __init__(self, service: AsyncKuCoinService, board: MarkPriceBoard, symbols: list):
+        super(PublicStream, self).__init__(service=service)
+        self.board = board
+        self.symbols = list(dict.fromkeys(symbols))
+
+    def _topics(self, symbols: list) -> list:
+        chunks = [','.join(symbols[it:it + self.SYMBOLS_PER_TOPIC])
+                  for it in range(0, len(symbols), self.SYMBOLS_PER_TOPIC)]
+        return [topic.format(symbols=chunk) for chunk in chunks for topic in (self.MARK_PRICE_TOPIC,
+                                                                              self.TICKER_TOPIC)]
+
+    @property
+    def topics(self) -> list:
+        return self._topics(self.symbols)
+
+    async def follow(self, symbols: list):
+        new = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self.symbols]
+        self.symbols += new
+        if new and self._ws is not None and not self._ws.closed:
+            for topic in self._topics(new):
+                await self._subscribe(self._ws, topic)
+
+    def on_message(self, topic: str, subject: str, data: dict):
+        symbol = data.get('symbol') or topic.partition(':')[2]
+        if subject == 'mark.index.price':
+            self.board.update(symbol, mark=data.get('markPrice'), ts=data.get('timestamp', 0) / 1000 or None)
+        elif subject == 'ticker' and data.get('price') is not None:
+            # A ticker push without a trade price leaves the last price as it is
+            self.board.update(symbol, last=float(data['price']))
+
+
+class PrivateFeed:
+    """
+    Runs the private streams of many accounts on one event loop, in a daemon thread when started from sync code,
+    so KuCoinService in the same process reads the mirrors registered by the streams.
+    """
+
+    def __init__(self, accounts: list, symbols: list = None):
+        """
+        :param accounts: (api_key, api_secret, api_passphrase) of every account to follow
+        """
+        self.accounts = accounts
+        self.symbols = symbols
+        self.streams = []
+        self.loop = None
+        self._future = None
+
+    async def run(self):
+        async with AsyncKuCoinService() as service:
+            self.streams = [PrivateStream(service, api_key=api_key, api_secret=api_secret,
+                                          api_passphrase=api_passphrase, symbols=self.symbols)
+                            for api_key, api_secret, api_passphrase in self.accounts]
+            self._future = asyncio.gather(*[stream.run() for stream in self.streams])
+            try:
+                await self._future
+            except asyncio.CancelledError:
+                pass
+
+    def start(self) -> threading.Thread:
+        def target():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.run())
+
+        thread = threading.Thread(target=target, name='private-feed', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self.loop is not None and self._future is not None:
+            self.loop.call_soon_threadsafe(self._future.cancel)
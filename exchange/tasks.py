@@ -1,6 +1,15 @@
+import asyncio
 from .services import KuCoinService
+from .async_services import AsyncKuCoinService
+from .streams import PrivateFeed
+from .fills import FillSync
+from .dispatch import SignalDispatcher
+from .scheduler import DeadlineScheduler
+from .ledger import ExecutionLedger
+from .plans import ExecutionPlanner
+from .kill_switch import KillSwitch
+from .snapshots import ExecutionSnapshot
 from market.models import Signal
-from concurrent.futures import ThreadPoolExecutor
 from account.models import User
 
 
@@ -12,12 +21,92 @@ class KuCoinTasks:
         service.refresh_session()
 
     @staticmethod
-    def _trade(signal: Signal, user: User):
-        user.kucoin.execute_signal(signal)
+    def start_private_feed() -> PrivateFeed:
+        # Mirrors live in memory, so the feed runs inside the worker process that trades
+        accounts = User.objects.active().filter(kucoin__isnull=False).values_list('kucoin__api_key',
+                                                                                 'kucoin__api_secret',
+                                                                                 'kucoin__api_passphrase')
+        feed = PrivateFeed(accounts=list(accounts))
+        feed.start()
+        return feed
 
     @classmethod
     def trade(cls, signal: Signal):
-        users = signal.trader.army.active()
+        # One query up front, the workers only read the snapshot and never touch the ORM
+        execution = ExecutionSnapshot.load(signal)
+        service: KuCoinService = KuCoinService()
+        snapshots = service.balances.get_many(execution.api_keys)
+
+        # Prepared when the signal was created (see ExecutionPlanner), the workers only send the orders
+        plan = ExecutionPlanner().plan(execution, snapshots=snapshots)
+
+        scheduler: DeadlineScheduler = DeadlineScheduler()
+        futures = scheduler.submit_execution(execution, snapshots, plan=plan)
+        results = [future.exception() or future.result() for future in futures]
+        # Every order is placed by now, the ledger of the signal is written before returning
+        ExecutionLedger().flush()
+        return results
+
+    @staticmethod
+    def trade_report(signal_id: int) -> dict:
+        scheduler: DeadlineScheduler = DeadlineScheduler()
+        return scheduler.report(signal_id)
+
+    @staticmethod
+    def dispatch(signal: Signal) -> int:
+        # Shards of the army for the dispatch_worker processes, on any node
+        dispatcher: SignalDispatcher = SignalDispatcher()
+        return dispatcher.dispatch(signal)
+
+    @staticmethod
+    def dispatch_progress(signal_id: int) -> dict:
+        dispatcher: SignalDispatcher = SignalDispatcher()
+        return dispatcher.progress(signal_id)
+
+    @staticmethod
+    def kill_switch(symbol: str = None, trader_id: int = None) -> dict:
+        # Blocks until every affected account is handled, poll kill_progress with its kill_id meanwhile
+        return KillSwitch(symbol=symbol, trader_id=trader_id).run()
 
-        with ThreadPoolExecutor() as executor:
-            executor.map(cls._trade, [signal] * users.count(), users)
+    @staticmethod
+    def kill_progress(kill_id: str) -> dict:
+        return KillSwitch.progress(kill_id)
+
+    @staticmethod
+    async def _trade_async(execution: ExecutionSnapshot):
+        async with AsyncKuCoinService() as service:
+            return await service.execute_signals(execution=execution)
+
+    @classmethod
+    def trade_async(cls, signal: Signal):
+        # The ORM is synchronous only, so the army and its credentials are loaded before entering the loop
+        results = asyncio.run(cls._trade_async(execution=ExecutionSnapshot.load(signal)))
+        ExecutionLedger().flush()
+        return results
+
+    @staticmethod
+    async def _refresh_balances(accounts: list) -> int:
+        async with AsyncKuCoinService() as service:
+            return await service.refresh_balances(accounts=accounts)
+
+    @classmethod
+    def refresh_balances(cls) -> int:
+        # Runs well within BalanceStore.MAX_AGE so signal executions find every snapshot fresh
+        accounts = User.objects.active().filter(kucoin__isnull=False).values('kucoin__api_key',
+                                                                            'kucoin__api_secret',
+                                                                            'kucoin__api_passphrase')
+        return asyncio.run(cls._refresh_balances(accounts=[dict(api_key=account['kucoin__api_key'],
+                                                                api_secret=account['kucoin__api_secret'],
+                                                                api_passphrase=account['kucoin__api_passphrase'])
+                                                           for account in accounts]))
+
+    @staticmethod
+    def sync_fills() -> dict:
+        accounts = User.objects.active().filter(kucoin__isnull=False).values_list('id',
+                                                                                 'kucoin__api_key',
+                                                                                 'kucoin__api_secret',
+                                                                                 'kucoin__api_passphrase')
+        service: FillSync = FillSync()
+        return service.sync(accounts=[(user_id, dict(api_key=api_key, api_secret=api_secret,
+                                                     api_passphrase=api_passphrase))
+                                      for user_id, api_key, api_secret, api_passphrase in accounts])
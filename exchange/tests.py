@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import json
+import hmac
+import base64
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from time import time, sleep
+from concurrent.futures import Future
+from unittest import mock
+from aiohttp import web
+from requests import Session
+from django.db.backends.signals import connection_created
+from django.test import SimpleTestCase, TestCase
+from _helpers import get_redis_client, RateLimiter, AsyncRateLimiter, SessionPool, PoolStats
+from _helpers import ConcurrencyLimiter, SingleFlight, AsyncSingleFlight
+from account.models import Trader, User
+from market.models import Signal
+from .async_services import AsyncKuCoinService
+from .balances import BalanceStore
+from .contracts import ContractStore
+from .dispatch import SignalDispatcher, ShardWorker
+from .fills import FillSync
+from .mirrors import AccountMirror
+from .mock_server import MockKuCoinServer
+from .responses import Order, Position, Contract
+from .plans import ExecutionPlanner
+from .prices import MarkPriceBoard, MarkPriceReader
+from .kill_switch import KillSwitch
+from .ledger import ExecutionLedger
+from .metrics import RequestMetrics
+from .models import KuCoin, Execution
+from .services import BaseKuCoinService, KuCoinService
+from .scheduler import DeadlineScheduler
+from .snapshots import SignalSnapshot, AccountSnapshot, ExecutionSnapshot
+from .streams import PrivateStream, PublicStream
+from .tasks import KuCoinTasks
 
-# Create your tests here.
+
+def hold_ledger(test_case: SimpleTestCase) -> ExecutionLedger:
+    """
+    Stops the ledger's background flush for the test, what it records is only written by an explicit flush,
+    inside the test's transaction, and is dropped at the end of the test.
+    """
+    ledger: ExecutionLedger = ExecutionLedger()
+    ledger.stop()
+    patcher = mock.patch.object(ledger, 'BACKGROUND_FLUSH', False)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    test_case.addCleanup(ledger._buffer.clear)
+    return ledger
+
+
+class PrivateStreamStandIn:
+    """
+    Local stand-in of the KuCoin token endpoint, REST snapshot endpoints and private websocket.
+    """
+
+    def __init__(self, pushes: list, subscriptions: int):
+        self.pushes = pushes
+        self.expected_subscriptions = subscriptions
+        self.subscriptions = []
+        self.runner = None
+        self.url = None
+
+    async def bullet(self, request):
+        return web.json_response({'code': '200000', 'data': {
+            'token': 'token',
+            'instanceServers': [{'endpoint': f'{self.url.replace("http", "ws")}/endpoint',
+                                 'pingInterval': 50000, 'pingTimeout': 10000, 'protocol': 'websocket'}]}})
+
+    async def orders(self, request):
+        items = [{'id': 'filled-later', 'symbol': 'XBTUSDTM', 'type': 'limit', 'status': 'open'}]
+        return web.json_response({'code': '200000', 'data': {'items': items}})
+
+    async def stop_orders(self, request):
+        return web.json_response({'code': '200000', 'data': {'items': []}})
+
+    async def positions(self, request):
+        return web.json_response({'code': '200000', 'data': [{'id': 'pos', 'symbol': 'XBTUSDTM', 'currentQty': 5}]})
+
+    async def endpoint(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({'id': 'welcome', 'type': 'welcome'})
+        for _ in range(self.expected_subscriptions):
+            subscription = await ws.receive_json()
+            self.subscriptions.append(subscription['topic'])
+            await ws.send_json({'id': subscription['id'], 'type': 'ack'})
+        for push in self.pushes:
+            await ws.send_json({'type': 'message', **push})
+        await ws.receive()
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/api/v1/bullet-private', self.bullet)
+        app.router.add_get('/api/v1/orders', self.orders)
+        app.router.add_get('/api/v1/stopOrders', self.stop_orders)
+        app.router.add_get('/api/v1/positions', self.positions)
+        app.router.add_get('/endpoint', self.endpoint)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class PrivateStreamTestCase(SimpleTestCase):
+
+    PUSHES = [
+        {'topic': '/contractMarket/tradeOrders', 'subject': 'orderChange',
+         'data': {'orderId': 'filled-later', 'symbol': 'XBTUSDTM', 'type': 'filled', 'status': 'done'}},
+        {'topic': '/contractMarket/tradeOrders', 'subject': 'orderChange',
+         'data': {'orderId': 'new', 'symbol': 'XBTUSDTM', 'type': 'open', 'status': 'open', 'size': 3}},
+        {'topic': '/contractAccount/wallet', 'subject': 'availableBalance.change',
+         'data': {'currency': 'USDT', 'availableBalance': '125.5', 'holdBalance': '0'}},
+        {'topic': '/contract/positionAll', 'subject': 'position.change',
+         'data': {'symbol': 'XBTUSDTM', 'currentQty': 8}},
+    ]
+
+    async def _wait_for(self, condition, timeout=5):
+        for _ in range(int(timeout / 0.01)):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('condition not met in time')
+
+    async def test_mirror_follows_private_feed(self):
+        mirror = AccountMirror()
+        stand_in = PrivateStreamStandIn(pushes=self.PUSHES, subscriptions=len(PrivateStream.ORDER_TOPICS) + 2)
+        await stand_in.start()
+
+        async with AsyncKuCoinService() as service:
+            service.BASE_URL = stand_in.url
+            service.RATE_LIMITED = False
+            stream = PrivateStream(service, api_key='key', api_secret='secret', api_passphrase='passphrase',
+                                   mirror=mirror)
+            task = asyncio.ensure_future(stream.run())
+
+            await self._wait_for(lambda: mirror.ready and getattr(mirror.position('XBTUSDTM'), 'current_qty', 0) == 8)
+            self.assertEqual([order.id for order in mirror.open_orders('XBTUSDTM')], ['new'])
+            self.assertEqual((mirror.order('new').status, mirror.order('new').size), ('open', 3))
+            self.assertEqual(mirror.balance('USDT', max_age=60), 125.5)
+            self.assertEqual(stand_in.subscriptions, list(stream.topics))
+
+            stream.stop()
+            task.cancel()
+
+        await stand_in.stop()
+
+
+class ResponseModelTestCase(SimpleTestCase):
+
+    def test_only_used_fields_are_decoded(self):
+        order = Order.from_json({'id': 'order', 'symbol': 'XBTUSDTM', 'size': 3, 'timeInForce': 'GTC', 'tags': ''})
+        self.assertEqual((order.id, order.size, order.stop_price), ('order', 3, None))
+        self.assertFalse(hasattr(order, '__dict__'))
+        order.update({'status': 'open', 'changeType': 'open'})
+        self.assertEqual(order, Order(id='order', symbol='XBTUSDTM', size=3, status='open'))
+
+        positions = [{'id': 'eth', 'symbol': 'ETHUSDTM', 'currentQty': 2}, {'id': 'xbt', 'symbol': 'XBTUSDTM'}]
+        self.assertEqual(Position.find(positions, 'XBTUSDTM').id, 'xbt')
+        self.assertIsNone(Position.find(positions, 'SOLUSDTM'))
+        contract = Contract.from_json({'symbol': 'XBTUSDTM', 'lotSize': 1, 'multiplier': 0.001})
+        self.assertEqual(contract.lot_size_contract, 0.001)
+
+
+class SignerTestCase(SimpleTestCase):
+
+    AUTH = dict(api_key='signer-key', api_secret='a3f1-secret', api_passphrase='pass phrase')
+    NOW = 1700000000.123
+
+    @staticmethod
+    def _legacy_header(api_key: str, api_secret: str, api_passphrase: str, method: str, endpoint: str,
+                       is_json=False, data=None) -> dict:
+        # The header as it was built before the signer, one HMAC from scratch per request
+        now = int(time() * 1000)
+        str_to_sign = '{now}{method}{endpoint}'.format(now=now, method=method.upper(), endpoint=endpoint)
+        if data:
+            str_to_sign += data
+        signature = base64.b64encode(hmac.new(api_secret.encode('utf-8'), str_to_sign.encode('utf-8'),
+                                              hashlib.sha256).digest())
+        passphrase = base64.b64encode(hmac.new(api_secret.encode('utf-8'), api_passphrase.encode('utf-8'),
+                                               hashlib.sha256).digest())
+        headers = {
+            "KC-API-SIGN": signature.decode(),
+            "KC-API-TIMESTAMP": str(now),
+            "KC-API-KEY": api_key,
+            "KC-API-PASSPHRASE": passphrase.decode(),
+            "KC-API-KEY-VERSION": "2"
+        }
+        if is_json:
+            headers['Content-Type'] = 'application/json'
+        return headers
+
+    def test_headers_match_the_legacy_signing(self):
+        requests = [('GET', '/api/v1/orders?status=active&symbol=XBTUSDTM', False, None),
+                    ('post', '/api/v1/orders', True, '{"remark":"take profit 1","price":"20000.5"}'),
+                    ('POST', '/api/v1/orders/multi', True, '[{"clientOid":"1-7-tp0","remark":"\u00e9t\u00e9"}]'),
+                    ('DELETE', '/api/v1/orders/5c35c02703aa673ceec2a168', True, '')]
+        with mock.patch('exchange.signing.time.time', return_value=self.NOW), \
+                mock.patch(f'{__name__}.time', return_value=self.NOW):
+            # Twice, the cached signer's prepared state must not carry over from one request to the next
+            for method, endpoint, is_json, data in requests * 2:
+                params = dict(method=method, endpoint=endpoint, is_json=is_json, data=data)
+                self.assertEqual(list(BaseKuCoinService.get_header(**self.AUTH, **params).items()),
+                                 list(self._legacy_header(**self.AUTH, **params).items()))
+
+
+class SessionPoolTestCase(SimpleTestCase):
+
+    @staticmethod
+    def _delta(before: dict) -> dict:
+        return {field: count - before[field] for field, count in PoolStats().snapshot().items()}
+
+    def test_rotation_waits_for_in_flight_requests(self):
+        pool = SessionPool(pool_size=2)
+        with mock.patch.object(Session, 'close', autospec=True) as close:
+            with pool.session() as retired:
+                pool.rotate()
+                with pool.session() as current:
+                    self.assertIsNot(current, retired)
+                self.assertEqual(pool.stats()['in_flight'], 0)
+                close.assert_not_called()
+            close.assert_called_once_with(retired)
+
+            # Nothing borrowed it, the next retired session is closed at once
+            pool.rotate()
+            self.assertEqual(close.call_args_list[-1], mock.call(current))
+
+    def test_stats_count_reused_connections(self):
+        server = MockKuCoinServer()
+        server.start()
+        self.addCleanup(server.stop)
+        pool = SessionPool(pool_size=2)
+        before = PoolStats().snapshot()
+
+        for _ in range(3):
+            with pool.session() as session:
+                self.assertEqual(session.get(f'{server.url}/api/v1/contracts/active').status_code, 200)
+        delta = self._delta(before)
+        self.assertEqual((delta['connections'], delta['misses'], delta['hits'], delta['handshakes']), (1, 1, 2, 0))
+
+        pool.rotate()
+        with pool.session() as session:
+            session.get(f'{server.url}/api/v1/contracts/active')
+        delta = self._delta(before)
+        self.assertEqual((delta['connections'], delta['rotations']), (2, 1))
+        self.assertEqual({field: pool.stats()[field] for field in ('in_flight', 'pool_size')},
+                         {'in_flight': 0, 'pool_size': 2})
+
+
+class SignedBodyTestCase(SimpleTestCase):
+
+    AUTH = dict(api_key='signed-key', api_secret='secret', api_passphrase='passphrase')
+    ORDER = dict(symbol='XBTUSDTM', side='buy', type='limit', price='20000', size='3', leverage='5',
+                 clientOid='1-7-main', remark='entry of signal 1, take profit 1: 21000')
+
+    def setUp(self):
+        self.server = MockKuCoinServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.add_account(**self.AUTH)
+        self.received = []
+        authenticate = self.server._authenticate
+
+        def received(request, body: str) -> bool:
+            self.received.append(body.encode('utf-8'))
+            return authenticate(request, body)
+
+        patcher = mock.patch.object(self.server, '_authenticate', side_effect=received)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _assert_received(self, service: BaseKuCoinService, response):
+        body = service._resolve('place_order', **self.ORDER)[2]
+        self.assertIn(' ', body)
+        self.assertTrue(BaseKuCoinService._accepted(response))
+        self.assertEqual(self.received, [body.encode('utf-8')])
+        self.assertEqual(self.server.counters['rejected_signatures'], 0)
+
+    def test_signed_body_is_sent_as_is(self):
+        service: KuCoinService = KuCoinService()
+        with mock.patch.object(service, 'BASE_URL', self.server.url), \
+                mock.patch.object(service, 'RATE_LIMITED', False):
+            response = service.request('place_order', **self.ORDER, **self.AUTH)
+        self._assert_received(service, response)
+
+    def test_async_signed_body_is_sent_as_is(self):
+        async def place_order():
+            async with AsyncKuCoinService() as service:
+                service.BASE_URL, service.RATE_LIMITED = self.server.url, False
+                return service, await service.request('place_order', **self.ORDER, **self.AUTH)
+
+        self._assert_received(*asyncio.run(place_order()))
+
+
+class ContractStoreTestCase(SimpleTestCase):
+
+    XBT = {'symbol': 'XBTUSDTM', 'lotSize': 1, 'multiplier': 0.001}
+    ETH = {'symbol': 'ETHUSDTM', 'lotSize': 1, 'multiplier': 0.01}
+
+    def setUp(self):
+        self.store: ContractStore = ContractStore()
+        self.store.stop()
+        self.addCleanup(self._restore, self.store._contracts, self.store._loaded, self.store._tried)
+        self.fetch = mock.Mock()
+        for patcher in (mock.patch.object(self.store, '_fetch', self.fetch),
+                        mock.patch.object(self.store, 'start')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _restore(self, contracts: dict, loaded: float, tried: float):
+        self.store._contracts, self.store._loaded, self.store._tried = contracts, loaded, tried
+
+    def _expire(self):
+        self.store._loaded -= self.store.TTL
+        self.store._tried -= self.store.RETRY
+
+    def test_stale_table_is_refreshed(self):
+        self.store.update([self.XBT])
+        self.fetch.return_value = [self.XBT, self.ETH]
+        self.assertEqual(self.store.get('XBTUSDTM').multiplier, 0.001)
+        self.fetch.assert_not_called()
+
+        self._expire()
+        self.assertEqual(self.store.get('ETHUSDTM').multiplier, 0.01)
+        self.assertTrue(self.store.is_fresh())
+        self.store.get('ETHUSDTM')
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_failed_refresh_keeps_the_previous_table(self):
+        self.store.update([self.XBT])
+        self._expire()
+        self.fetch.side_effect = ConnectionError('get_open_contract_list failed with 429')
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.store.get('XBTUSDTM').multiplier, 0.001)
+        self.assertFalse(self.store.is_fresh())
+        # Tried again after RETRY seconds only
+        self.store.get('XBTUSDTM')
+        self.assertEqual(self.fetch.call_count, 1)
+
+        self.store._tried -= self.store.RETRY
+        self.fetch.side_effect, self.fetch.return_value = None, [self.ETH]
+        self.assertEqual(self.store.symbols(), ['ETHUSDTM'])
+        self.assertTrue(self.store.is_fresh())
+
+    def test_failed_first_load_raises(self):
+        self._restore({}, 0.0, 0.0)
+        self.fetch.side_effect = ConnectionError('get_open_contract_list failed with 503')
+        with self.assertRaises(ConnectionError):
+            self.store.get('XBTUSDTM')
+
+    def test_failed_listing_is_not_an_empty_one(self):
+        service: KuCoinService = KuCoinService()
+        with mock.patch.object(service, 'request', return_value=(429, {'code': '429000', 'msg': 'Too Many'})):
+            with self.assertRaises(ConnectionError):
+                service.fetch_contracts()
+
+
+class MarkPriceBoardTestCase(SimpleTestCase):
+
+    NAME = 'cryptor-mark-prices-test'
+
+    def setUp(self):
+        # The readers share the feed's process here, they must not unregister its segment
+        for patcher in (mock.patch.object(MarkPriceBoard, 'NAME', self.NAME),
+                        mock.patch('exchange.prices.resource_tracker')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.reader: MarkPriceReader = MarkPriceReader()
+        self.reader.board, self.reader._tried = None, 0.0
+        self.addCleanup(setattr, self.reader, 'board', None)
+
+    def _feed(self) -> MarkPriceBoard:
+        board = MarkPriceBoard(create=True, slots=8)
+        self.addCleanup(board.close)
+        return board
+
+    def test_torn_slot_is_not_read(self):
+        board = self._feed()
+        board.update('XBTUSDTM', mark=20000.0)
+        self.assertEqual(board.read('XBTUSDTM')[0], 20000.0)
+        # The writer died between the two increments of the sequence
+        board.table['seq'][board._slot('XBTUSDTM')] += 1
+        self.assertIsNone(board.read('XBTUSDTM'))
+
+    def test_reader_follows_a_restarted_feed(self):
+        board = MarkPriceBoard(create=True, slots=8)
+        board.update('XBTUSDTM', mark=20000.0)
+        self.assertEqual(self.reader.get_mark_price('XBTUSDTM'), 20000.0)
+
+        board.close()
+        restarted = self._feed()
+        restarted.update('XBTUSDTM', mark=21000.0)
+        # Until the old segment goes stale its last price is still read
+        self.assertEqual(self.reader.get_mark_price('XBTUSDTM'), 20000.0)
+        self.reader._tried = 0.0
+        self.assertEqual(self.reader.get_mark_price('XBTUSDTM', max_age=-1), None)
+        self.assertIsNot(self.reader.board, None)
+        self.assertEqual(self.reader.get_mark_price('XBTUSDTM'), 21000.0)
+
+
+    def test_ticker_without_a_price_is_skipped(self):
+        board = self._feed()
+        stream = PublicStream(service=None, board=board, symbols=['XBTUSDTM'])
+        stream.on_message('/contractMarket/ticker:XBTUSDTM', 'ticker', {'symbol': 'XBTUSDTM', 'price': '20100.5'})
+        stream.on_message('/contractMarket/ticker:XBTUSDTM', 'ticker', {'symbol': 'XBTUSDTM', 'bestBidPrice': '1'})
+        self.assertEqual(board.read('XBTUSDTM')[1], 20100.5)
+
+
+class ExecutionLedgerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.ledger = hold_ledger(self)
+        for patcher in (mock.patch.object(self.ledger, 'MAX_BUFFER', 2),
+                        mock.patch.object(self.ledger, 'FULL_TIMEOUT', 0.05)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, self.ledger, 'dropped', self.ledger.dropped)
+
+    def test_full_buffer_counts_what_it_drops(self):
+        dropped = self.ledger.dropped
+        with self.assertLogs(level='ERROR'):
+            for user_id in range(3):
+                self.ledger.record(1, user_id, error=ValueError())
+
+        self.assertEqual(self.ledger.pending(), 2)
+        self.assertEqual(self.ledger.dropped, dropped + 1)
+        # The oldest entries are kept
+        self.assertEqual([entry[1] for entry in self.ledger._buffer], [0, 1])
+
+    def test_full_buffer_waits_for_a_flush(self):
+        for user_id in range(2):
+            self.ledger.record(1, user_id, error=ValueError())
+        threading.Timer(0.01, self.ledger._take).start()
+        with mock.patch.object(self.ledger, 'FULL_TIMEOUT', 5):
+            self.ledger.record(1, 2, error=ValueError())
+
+        self.assertEqual([entry[1] for entry in self.ledger._buffer], [2])
+
+    def test_failed_write_keeps_every_entry(self):
+        for user_id in range(2):
+            self.ledger.record(1, user_id, error=ValueError())
+        Execution = mock.Mock()
+
+        def bulk_create(rows):
+            # Recorded while the write runs, the buffer is full again once the batch is put back
+            self.ledger.record(1, 2, error=ValueError())
+            raise ConnectionError
+
+        Execution.objects.bulk_create.side_effect = bulk_create
+        with mock.patch('exchange.ledger.apps.get_model', return_value=Execution), \
+                mock.patch.object(self.ledger, '_row'), self.assertRaises(ConnectionError):
+            self.ledger.flush()
+
+        self.assertEqual([entry[1] for entry in self.ledger._buffer], [0, 1, 2])
+
+
+class DeadlineSchedulerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.ledger = hold_ledger(self)
+        self.scheduler: DeadlineScheduler = DeadlineScheduler()
+        # Without workers the jobs stay queued and are taken one by one
+        patcher = mock.patch.object(self.scheduler, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._drain)
+
+    def _drain(self):
+        self.scheduler._lanes.clear()
+        self.scheduler._queued = 0
+
+    @staticmethod
+    def _signal(pk: int, order_type: str, created: float) -> SignalSnapshot:
+        return SignalSnapshot(pk=pk, pair='XBTUSDTM', order_type=order_type, type=Signal.TypeChoices.LONG,
+                              entry=20000, targets=(21000,), stop_loss=19000, capital=0.1, leverage=5,
+                              created=created)
+
+    @staticmethod
+    def _account(pk: int, tier: int = 0) -> AccountSnapshot:
+        return AccountSnapshot(pk=pk, strategy=User.StrategyChoices.LOW, cap=None, api_key=f'key{pk}',
+                               api_secret='secret', api_passphrase='passphrase', tier=tier)
+
+    def test_earliest_deadline_first(self):
+        now = time()
+        limit = self._signal(pk=1001, order_type=Signal.OrderChoices.LIMIT, created=now - 1)
+        market = self._signal(pk=1002, order_type=Signal.OrderChoices.MARKET, created=now)
+        self.scheduler.submit(limit, self._account(1))
+        self.scheduler.submit(market, self._account(2))
+        self.scheduler.submit(market, self._account(3, tier=50))
+
+        order = [(job[3].pk, job[4].pk) for job in (self.scheduler._next() for _ in range(3))]
+        self.assertEqual(order, [(1002, 3), (1002, 2), (1001, 1)])
+
+    def test_late_jobs_are_dropped(self):
+        signal = self._signal(pk=1003, order_type=Signal.OrderChoices.MARKET, created=time() - 60)
+        future = self.scheduler.submit(signal, self._account(1))
+        with mock.patch.object(self.scheduler.service, 'execute_account') as execute_account:
+            self.scheduler._run(self.scheduler._next())
+
+        execute_account.assert_not_called()
+        self.assertIsInstance(future.exception(), TimeoutError)
+        report = self.scheduler.report(1003)
+        self.assertEqual((report['submitted'], report['executed'], report['dropped']), (1, 0, 1))
+        self.assertGreater(report['max_late'], 50)
+        # Recorded, and left for an explicit flush
+        self.assertEqual(self.ledger.pending(), 1)
+        self.assertIsNone(self.ledger._thread)
+
+    def test_finished_reports_expire(self):
+        signal = self._signal(pk=1009, order_type=Signal.OrderChoices.MARKET, created=time() - 60)
+        self.scheduler.submit(signal, self._account(1))
+        self.scheduler._run(self.scheduler._next())
+        self.assertIn('finished', self.scheduler.report(1009))
+
+        # Pruned by the next submit once the report is older than REPORT_TTL
+        with mock.patch.object(self.scheduler, 'REPORT_TTL', -1):
+            self.scheduler.submit(self._signal(pk=1010, order_type=Signal.OrderChoices.LIMIT, created=time()),
+                                  self._account(2))
+        self.assertNotIn(1009, self.scheduler._reports)
+        self.assertEqual(self.scheduler.report(1009)['submitted'], 0)
+        self.assertEqual(self.scheduler.report(1010)['submitted'], 1)
+
+    def test_workers_are_fixed_once_started(self):
+        workers, threads = self.scheduler.workers, self.scheduler._threads
+        self.addCleanup(setattr, self.scheduler, 'workers', workers)
+        self.addCleanup(setattr, self.scheduler, '_threads', threads)
+        self.scheduler._threads = []
+        self.scheduler.resize(workers + 1)
+        self.assertEqual(self.scheduler.workers, workers + 1)
+
+        self.scheduler._threads = [threading.current_thread()]
+        self.scheduler.resize(workers + 1)
+        with self.assertRaises(ValueError):
+            self.scheduler.resize(workers + 2)
+        self.assertEqual(self.scheduler.workers, workers + 1)
+
+        signal = self._signal(pk=1006, order_type=Signal.OrderChoices.MARKET, created=time() - 10)
+        execution = ExecutionSnapshot(signal, tuple(self._account(it) for it in range(2)))
+        small, big = self.scheduler.submit_execution(execution, army=2), \
+            self.scheduler.submit_execution(execution, army=1000)
+        with mock.patch.object(self.scheduler.service, 'execute_account', return_value=(None, [], None)):
+            for _ in range(4):
+                self.scheduler._run(self.scheduler._next())
+
+        self.assertEqual([type(future.exception()) for future in small], [TimeoutError, TimeoutError])
+        self.assertEqual([future.exception() for future in big], [None, None])
+
+    def test_budget_of_a_reclaimed_shard_starts_over(self):
+        signal = self._signal(pk=1007, order_type=Signal.OrderChoices.MARKET, created=time() - 120)
+        execution = ExecutionSnapshot(signal, (self._account(1),))
+        futures = self.scheduler.submit_execution(execution, army=100, since=time())
+        with mock.patch.object(self.scheduler.service, 'execute_account', return_value=(None, [], None)):
+            self.scheduler._run(self.scheduler._next())
+
+        self.assertIsNone(futures[0].exception())
+
+    def test_small_army_is_not_crowded_out(self):
+        now = time()
+        big = self._signal(pk=1004, order_type=Signal.OrderChoices.LIMIT, created=now)._replace(trader_id=1)
+        small = self._signal(pk=1005, order_type=Signal.OrderChoices.LIMIT, created=now)._replace(trader_id=2)
+        for it in range(100):
+            self.scheduler.submit(big, self._account(it))
+        for it in range(3):
+            self.scheduler.submit(small, self._account(100 + it))
+
+        started = [self.scheduler._next()[3].trader_id for _ in range(8)]
+        self.assertEqual(started.count(2), 3)
+        self.assertEqual(self.scheduler.lanes()[1], {'queued': 95, 'running': 5, 'weight': 10.0})
+
+
+class ShardDispatchTestCase(SimpleTestCase):
+
+    ARMY = 250
+    ACCEPTED = (200, {'code': '200000'})
+
+    def setUp(self):
+        hold_ledger(self)
+        self.dispatcher: SignalDispatcher = SignalDispatcher()
+        self.client = self.dispatcher.client
+        patcher = mock.patch.dict(self.dispatcher.REDIS_KEYS, {'stream': f'{self.dispatcher.PREFIX}:SHARDS:TEST'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.signal = Signal(pk=3001, trader_id=1, pair='XBTUSDTM', order_type=Signal.OrderChoices.MARKET,
+                             type=Signal.TypeChoices.LONG, entry=20000, targets=[21000], stop_loss=19000,
+                             capital=0.1, leverage=5)
+        self.addCleanup(self.client.delete, self.dispatcher.stream,
+                        self.dispatcher.REDIS_KEYS.get('progress').format(signal_id=self.signal.pk),
+                        self.dispatcher.REDIS_KEYS.get('done').format(signal_id=self.signal.pk))
+
+        # The execution itself is stubbed, every account is protected at once
+        self.submitted = []
+        scheduler: DeadlineScheduler = DeadlineScheduler()
+        service: KuCoinService = KuCoinService()
+        for patcher in (mock.patch.object(ExecutionSnapshot, 'army_ids', return_value=list(range(self.ARMY))),
+                        mock.patch.object(ExecutionSnapshot, 'load_accounts', side_effect=self._load_accounts),
+                        mock.patch.object(scheduler, 'submit_execution', side_effect=self._submit_execution),
+                        mock.patch.object(service.balances, 'get_many', return_value={}),
+                        mock.patch.object(ExecutionPlanner(), 'plan', return_value={})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _load_accounts(signal: SignalSnapshot, user_ids: list) -> ExecutionSnapshot:
+        return ExecutionSnapshot(signal, tuple(AccountSnapshot(pk=pk, strategy=User.StrategyChoices.LOW, cap=None,
+                                                               api_key=f'key{pk}', api_secret='secret',
+                                                               api_passphrase='passphrase', tier=0)
+                                               for pk in user_ids))
+
+    def _submit_execution(self, execution: ExecutionSnapshot, snapshots: dict = None, plan: dict = None,
+                          army: int = None, since: float = None) -> list:
+        self.submitted.append(([account.pk for account in execution.accounts], army, since))
+        futures = [Future() for _ in execution.accounts]
+        for future in futures:
+            future.set_result((None, [], self.ACCEPTED))
+        return futures
+
+    def _worker(self, name: str) -> ShardWorker:
+        worker = ShardWorker(name=name)
+        worker.BLOCK = 10
+        return worker
+
+    def test_army_is_sharded(self):
+        self.assertEqual(self.dispatcher.dispatch(self.signal), 3)
+
+        shards = [(json.loads(fields[b'users']), int(fields[b'army']))
+                  for _, fields in self.client.xrange(self.dispatcher.stream)]
+        self.assertEqual([len(users) for users, army in shards], [100, 100, 50])
+        self.assertEqual(sum((users for users, army in shards), []), list(range(self.ARMY)))
+        self.assertEqual({army for users, army in shards}, {self.ARMY})
+        progress = self.dispatcher.progress(self.signal.pk)
+        self.assertEqual((progress['accounts'], progress['shards']), (self.ARMY, 3))
+
+    def test_shards_are_executed_and_acknowledged(self):
+        self.dispatcher.dispatch(self.signal)
+        worker = self._worker('worker-a')
+
+        self.assertEqual([worker.run_once() for _ in range(4)], [True, True, True, False])
+        self.assertEqual([(len(user_ids), army, since) for user_ids, army, since in self.submitted],
+                         [(100, self.ARMY, None), (100, self.ARMY, None), (50, self.ARMY, None)])
+        self.assertEqual(self.client.xpending(self.dispatcher.stream, self.dispatcher.GROUP)['pending'], 0)
+        progress = self.dispatcher.progress(self.signal.pk)
+        self.assertEqual((progress['shards_done'], progress['executed'], progress['protected']), (3, 250, 250))
+
+    def test_stale_shard_is_reclaimed(self):
+        # One shard
+        with mock.patch.object(ExecutionSnapshot, 'army_ids', return_value=list(range(100))):
+            self.dispatcher.dispatch(self.signal)
+        # The first worker dies after 40 accounts of its shard completed
+        message_id, fields = self._worker('worker-a')._read()[0]
+        self.client.sadd(self.dispatcher.REDIS_KEYS.get('done').format(signal_id=self.signal.pk), *range(40))
+
+        worker = self._worker('worker-b')
+        self.assertFalse(worker.run_once())
+        worker.CLAIM_IDLE = 0
+        self.assertTrue(worker.run_once())
+
+        (user_ids, army, since), = self.submitted
+        self.assertEqual(user_ids, list(range(40, 100)))
+        self.assertGreater(since, time() - 60)
+        self.assertEqual(self.client.xpending(self.dispatcher.stream, self.dispatcher.GROUP)['pending'], 0)
+        progress = self.dispatcher.progress(self.signal.pk)
+        self.assertEqual((progress['reclaimed'], progress['executed'], progress['shards_done']), (1, 60, 1))
+
+
+class RateLimiterTestCase(SimpleTestCase):
+
+    NOW = 1700000000.0
+
+    def setUp(self):
+        self.name = f'test:{id(self)}'
+        self.addCleanup(get_redis_client().delete, RateLimiter.REDIS_KEYS['bucket'].format(name=self.name))
+        # The bucket does not refill while the test runs
+        patcher = mock.patch('_helpers.rate_limiter.time.time', return_value=self.NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_slots_are_reserved_in_order(self):
+        limiter = RateLimiter()
+        waits = [limiter.reserve(self.name, limit=2, period=1) for _ in range(4)]
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0])
+
+    def test_max_wait_rejects_without_spending(self):
+        limiter = RateLimiter()
+        for _ in range(3):
+            limiter.reserve(self.name, limit=2, period=1)
+        self.assertIsNone(limiter.reserve(self.name, limit=2, period=1, max_wait=0.9))
+        with mock.patch('_helpers.rate_limiter.time.sleep') as sleep_:
+            self.assertFalse(limiter.acquire(self.name, limit=2, period=1, max_wait=0.9))
+            self.assertTrue(limiter.acquire(self.name, limit=2, period=1, max_wait=1))
+        # The rejected calls left the bucket as it was
+        sleep_.assert_called_once_with(1.0)
+
+    def test_async_slots_are_reserved_in_order(self):
+        async def reserve():
+            limiter = AsyncRateLimiter()
+            try:
+                waits = [await limiter.reserve(self.name, limit=2, period=1) for _ in range(3)]
+                return waits + [await limiter.reserve(self.name, limit=2, period=1, max_wait=0.9)]
+            finally:
+                await limiter.client.close()
+
+        self.assertEqual(asyncio.run(reserve()), [0.0, 0.0, 0.5, None])
+
+
+class ConcurrencyLimiterTestCase(SimpleTestCase):
+
+    @staticmethod
+    def _window(limiter: ConcurrencyLimiter) -> float:
+        return limiter.stats()['points']['place_order']['limit']
+
+    def _load(self, limiter: ConcurrencyLimiter, responses: int, status=200, latency=0.05):
+        # A fan-out keeps the window full, every response makes room for the next request
+        window = lambda: int(min(limiter.total.limit, limiter._point('place_order').limit))
+        while limiter.total.in_flight < window():
+            limiter.acquire('place_order')
+        for _ in range(responses):
+            limiter.release('place_order', status, latency)
+            while limiter.total.in_flight < window():
+                limiter.acquire('place_order')
+
+    def test_healthy_responses_open_the_window(self):
+        limiter = ConcurrencyLimiter(maximum=64)
+        self._load(limiter, responses=100)
+        self.assertEqual(self._window(limiter), 64)
+        self.assertEqual(limiter.stats()['total'], {'limit': 64, 'in_flight': 64})
+
+    def test_isolated_rejections_are_tolerated(self):
+        limiter = ConcurrencyLimiter(maximum=64)
+        self._load(limiter, responses=100)
+        self._load(limiter, responses=1, status=429)
+        self.assertEqual(self._window(limiter), 64)
+
+    def test_overload_cuts_the_window(self):
+        limiter = ConcurrencyLimiter(maximum=64)
+        self._load(limiter, responses=100)
+        # A burst of 5xx is a single cut, the next one waits for a round trip
+        self._load(limiter, responses=10, status=503)
+        self.assertEqual(self._window(limiter), 32)
+        limiter._point('place_order').decreased = limiter.total.decreased = 0
+        self._load(limiter, responses=1, status=None)
+        self.assertEqual(self._window(limiter), 16)
+        self.assertEqual(limiter.stats()['total']['limit'], 16)
+
+
+class RequestMetricsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.metrics: RequestMetrics = RequestMetrics()
+        prefix = f'{self.metrics.PREFIX}:TEST'
+        for patcher in (mock.patch.dict(self.metrics.REDIS_KEYS, {'process': f'{prefix}:''{process}',
+                                                                  'pattern': f'{prefix}:*'}),
+                        mock.patch.object(self.metrics, '_points', {}),
+                        mock.patch.object(self.metrics, '_lanes', {}),
+                        mock.patch.object(self.metrics, 'start')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.metrics.reset)
+
+    def _publish_other_process(self):
+        # Another worker's state, as it publishes it
+        for status in (200, 200, 429):
+            self.metrics.record('place_order', status, wait=0.0, sign=0.0001, http=0.05)
+        self.metrics.record_retry('place_order', amount=2)
+        self.metrics.record_queue('trader:1', 0.2)
+        self.metrics.client.set(self.metrics.REDIS_KEYS.get('process').format(process='other:1'),
+                                self.metrics._dump(), ex=self.metrics.TTL)
+        self.metrics._points, self.metrics._lanes = {}, {}
+
+    def test_processes_are_merged(self):
+        self._publish_other_process()
+        self.metrics.record('place_order', 200, wait=0.0, sign=0.0001, http=1.0)
+        self.metrics.record('place_order', 429, wait=0.0, sign=0.0001, http=1.0)
+        self.metrics.record('place_order', self.metrics.ERROR, wait=0.0, sign=0.0001, http=1.0)
+        self.metrics.record_retry('place_order')
+        self.metrics.record_queue('trader:1', 0.4)
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['processes'], 2)
+        point = snapshot['points']['place_order']
+        self.assertEqual({field: point[field] for field in ('count', 'statuses', 'throttled', 'retries')},
+                         {'count': 6, 'statuses': {'200': 3, '429': 2, 'error': 1}, 'throttled': 2, 'retries': 3})
+        # Quantiles of the merged sketches, within their relative accuracy
+        self.assertAlmostEqual(point['latency_ms']['http']['p50'], 50, delta=50 * self.metrics.RELATIVE_ACCURACY)
+        self.assertAlmostEqual(point['latency_ms']['http']['max'], 1000, delta=1000 * self.metrics.RELATIVE_ACCURACY)
+        lane = snapshot['lanes']['trader:1']
+        self.assertEqual(lane['count'], 2)
+        self.assertAlmostEqual(lane['delay_ms']['max'], 400, delta=400 * self.metrics.RELATIVE_ACCURACY)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+
+    def test_calls_in_flight_are_shared(self):
+        single_flight = SingleFlight()
+        release, calls = threading.Event(), []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return {'data': 'contracts'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do('contracts', '/active', fetch)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while single_flight.stats().get('contracts', {}).get('calls') != 10:
+            sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 9)
+        self.assertEqual(single_flight.stats(), {'contracts': {'calls': 10, 'shared': 9}})
+        # Nothing is cached, the next call runs again
+        single_flight.do('contracts', '/active', fetch)
+        self.assertEqual(len(calls), 2)
+
+    def test_failures_are_shared(self):
+        single_flight = AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ConnectionError('contracts')
+
+        async def run():
+            return await asyncio.gather(*[single_flight.do('contracts', '/active', fetch) for _ in range(3)],
+                                        return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(single_flight.stats(), {'contracts': {'calls': 3, 'shared': 2}})
+
+
+class BalanceStoreTestCase(SimpleTestCase):
+
+    AUTH = dict(api_key='balance-key', api_secret='secret', api_passphrase='passphrase')
+    OVERVIEW = (200, {'code': '200000', 'data': {'currency': 'USDT', 'availableBalance': 1500.0}})
+
+    def setUp(self):
+        self.store: BalanceStore = BalanceStore()
+        self.addCleanup(self.store.client.delete, *[self.store._key(api_key, 'USDT')
+                                                    for api_key in ('balance-key', 'stale-key', 'missing-key')])
+
+    def test_stale_snapshots_are_not_read(self):
+        self.store.put('balance-key', 1000.0)
+        self.store.put_many({'stale-key': 2000.0}, ts=time() - self.store.MAX_AGE - 1)
+
+        self.assertEqual(self.store.get('balance-key'), 1000.0)
+        self.assertIsNone(self.store.get('stale-key'))
+        self.assertEqual(self.store.get('stale-key', max_age=self.store.MAX_AGE * 2), 2000.0)
+        self.assertEqual(self.store.get_many(['balance-key', 'stale-key', 'missing-key']), {'balance-key': 1000.0})
+
+    def test_recent_balance_falls_back_to_the_exchange(self):
+        service: KuCoinService = KuCoinService()
+        with mock.patch.object(service, 'request', return_value=self.OVERVIEW) as request:
+            self.store.put('balance-key', 1000.0)
+            self.assertEqual(service.get_recent_balance(**self.AUTH), 1000.0)
+            request.assert_not_called()
+
+            # A stale snapshot is fetched live and written back for the other workers
+            self.store.put('balance-key', 1000.0, ts=time() - self.store.MAX_AGE - 1)
+            self.assertEqual(service.get_recent_balance(**self.AUTH), 1500.0)
+            self.assertEqual(self.store.get('balance-key'), 1500.0)
+            self.assertEqual(request.call_count, 1)
+
+            # Prefetched snapshots are read instead of Redis, an account missing from them goes live
+            self.assertEqual(service.get_recent_balance(**self.AUTH, snapshots={'balance-key': 900.0}), 900.0)
+            self.assertEqual(service.get_recent_balance(**self.AUTH, snapshots={}), 1500.0)
+            self.assertEqual(request.call_count, 2)
+
+
+class PlaceLegsTestCase(SimpleTestCase):
+
+    LEGS = [{'clientOid': f'leg-{it}', 'symbol': 'XBTUSDTM'} for it in range(5)]
+
+    @staticmethod
+    def _request(point: str, orders: list = None, **kwargs):
+        if point == 'place_order':
+            return 200, {'code': '200000', 'data': {'orderId': kwargs['clientOid']}}
+        if orders[0]['clientOid'] == 'leg-2':
+            raise ConnectionError('reset by peer')
+        if orders[0]['clientOid'] == 'leg-4':
+            return 404, None
+        return 200, {'code': '200000', 'data': [{'clientOid': order['clientOid'], 'orderId': order['clientOid'],
+                                                 'code': '200000'} for order in orders]}
+
+    def test_batch_errors_stay_with_their_legs(self):
+        service = KuCoinService()
+        with mock.patch.object(service, 'batch_orders', True), \
+                mock.patch.object(BaseKuCoinService, 'BATCH_ORDERS_LIMIT', 2), \
+                mock.patch.object(service, 'request', side_effect=self._request) as request:
+            placed = service.place_legs({'symbol': 'XBTUSDTM', 'clientOid': 'main'}, self.LEGS[:-1], self.LEGS[-1],
+                                        legs_mode=service.LEGS_BATCH)
+            self.assertFalse(service.batch_orders)
+
+        main_order, tp_orders, sl_order = placed
+        self.assertEqual([leg[1]['data']['orderId'] for leg in tp_orders[:2]], ['leg-0', 'leg-1'])
+        self.assertEqual([type(leg) for leg in tp_orders[2:]], [ConnectionError, ConnectionError])
+        # Only the batch that got a 404 is placed again, one by one
+        self.assertEqual(sl_order[1]['data']['orderId'], 'leg-4')
+        self.assertEqual([call.kwargs['clientOid'] for call in request.call_args_list
+                          if call.kwargs['point'] == 'place_order'], ['main', 'leg-4'])
+
+
+class SizeArmyTestCase(SimpleTestCase):
+
+    SIGNAL = SignalSnapshot(pk=1, pair='XBTUSDTM', order_type=Signal.OrderChoices.LIMIT, type=Signal.TypeChoices.LONG,
+                            entry=20000, targets=(21000, 22000, 23000), stop_loss=19000, capital=0.1, leverage=5)
+
+    def test_sizes_match_one_by_one_sizing(self):
+        balances = np.array([1000.0, 2500.0, 12345.0, 3.0])
+        caps = np.array([0.0, 0.2, np.nan, 0.0])
+        strategies = [User.StrategyChoices.LOW, User.StrategyChoices.MEDIUM, User.StrategyChoices.HIGH,
+                      User.StrategyChoices.HIGH]
+        sizes, tp_sizes = BaseKuCoinService.size_army(self.SIGNAL, lot_size_contract=0.001, balances=balances,
+                                                      caps=caps, strategies=strategies)
+
+        for balance, cap, strategy, size, tps in zip(balances, caps, strategies, sizes, tp_sizes):
+            usable_balance = balance * (cap if cap == cap and cap else self.SIGNAL.capital)
+            expected = BaseKuCoinService._calculate_lot_size(0.001, balance=usable_balance, price=20000, leverage=5)
+            self.assertEqual(size, expected)
+            self.assertEqual(tps.sum(), size)
+            exact = np.array(BaseKuCoinService.target_shares(strategy, 3)) * size
+            self.assertTrue((np.abs(tps - exact) < 1).all())
+
+    def test_one_by_one_sizing_splits_whole_lots(self):
+        user = AccountSnapshot(pk=1, strategy=User.StrategyChoices.MEDIUM, cap=None, api_key='key1',
+                               api_secret='secret', api_passphrase='passphrase', tier=0)
+        order = BaseKuCoinService._signal_order(self.SIGNAL, user=user, usable_balance_lot=7)
+        sizes, tp_sizes = BaseKuCoinService.size_army(self.SIGNAL, lot_size_contract=0.0035,
+                                                      balances=np.array([1000.0]), caps=np.array([0.0]),
+                                                      strategies=[user.strategy])
+
+        self.assertEqual(sizes.tolist(), [7])
+        self.assertEqual(order['tp_sizes'], tp_sizes[0].tolist())
+        self.assertTrue(all(isinstance(size, int) for size in order['tp_sizes']))
+
+    def test_missing_contract_falls_back_to_one_by_one_execution(self):
+        account = AccountSnapshot(pk=1, strategy=User.StrategyChoices.LOW, cap=None, api_key='key1',
+                                  api_secret='secret', api_passphrase='passphrase', tier=0)
+        service: KuCoinService = KuCoinService()
+        with mock.patch.object(ContractStore(), 'contracts', return_value={}):
+            self.assertEqual(service.plan_orders(ExecutionSnapshot(self.SIGNAL, (account,)),
+                                                 snapshots={'key1': 1000.0}), {})
+            # Each account then fails on its own, where the scheduler records it
+            with self.assertRaises(KeyError):
+                service.execute_account(self.SIGNAL, account, snapshots={'key1': 1000.0})
+
+
+class IterOrdersTestCase(SimpleTestCase):
+
+    AUTH = dict(api_key='orders-key', api_secret='secret', api_passphrase='passphrase')
+    DAY = 24 * 60 * 60 * 1000
+
+    def setUp(self):
+        self.server = MockKuCoinServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.add_account(**self.AUTH)
+        self.end_at = int(time() * 1000)
+        # One done order every other day over three weeks, three windows of three or four orders
+        self.server.add_done_orders(self.AUTH['api_key'], [{'id': f'order{it}', 'symbol': 'XBTUSDTM',
+                                                            'createdAt': self.end_at - (2 * it + 1) * self.DAY}
+                                                           for it in range(10)])
+
+        self.service: KuCoinService = KuCoinService()
+        for patcher in (mock.patch.object(self.service, 'BASE_URL', self.server.url),
+                        mock.patch.object(self.service, 'RATE_LIMITED', False),
+                        mock.patch.object(BaseKuCoinService, 'ORDERS_PAGE_SIZE', 2)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _window(self, created: int) -> int:
+        return next(it for it, (start, end) in enumerate(self.service._windows(self.end_at - 20 * self.DAY,
+                                                                               self.end_at))
+                    if start <= created <= end)
+
+    def test_windows_and_pages_are_walked_oldest_first(self):
+        orders = list(self.service.iter_orders(start_at=self.end_at - 20 * self.DAY, end_at=self.end_at,
+                                               concurrency=2, **self.AUTH))
+
+        self.assertEqual(sorted(order['id'] for order in orders), sorted(f'order{it}' for it in range(10)))
+        windows = [self._window(order['createdAt']) for order in orders]
+        self.assertEqual(windows, sorted(windows))
+        # Two pages of two orders for every window
+        self.assertEqual(self.server.counters['requests'], 6)
+
+    def test_closing_early_stops_fetching(self):
+        orders = self.service.iter_orders(start_at=self.end_at - 20 * self.DAY, end_at=self.end_at, **self.AUTH)
+        self.assertEqual(self._window(next(orders)['createdAt']), 0)
+        orders.close()
+        # Pages already on the wire land, nothing else is fetched: the page in hand, the next one and the next
+        # window's first page at most, of the six of the whole walk
+        sleep(0.2)
+        self.assertLessEqual(self.server.counters['requests'], 3)
+
+    def test_async_pages_are_walked(self):
+        async def walk() -> list:
+            async with AsyncKuCoinService() as service:
+                service.BASE_URL, service.RATE_LIMITED = self.server.url, False
+                orders = []
+                async for order in service.iter_orders(start_at=self.end_at - 6 * self.DAY, end_at=self.end_at,
+                                                       **self.AUTH):
+                    orders.append(order['id'])
+                return orders
+
+        self.assertEqual(asyncio.run(walk()), ['order0', 'order1', 'order2'])
+
+
+class FillSyncTestCase(SimpleTestCase):
+
+    AUTH = dict(api_key='fills-key', api_secret='secret', api_passphrase='passphrase')
+    USER_ID = 7
+
+    def setUp(self):
+        self.server = MockKuCoinServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.server.add_account(**self.AUTH)
+        self.fills: FillSync = FillSync()
+        self.client = self.fills.client
+        self.addCleanup(self.client.delete, *[key.format(user_id=self.USER_ID, signal_id=1)
+                                              for key in self.fills.REDIS_KEYS.values()])
+
+        self.nets = {}
+        for patcher in (mock.patch.dict(BaseKuCoinService.URLS, {'URL': self.server.url}),
+                        mock.patch.object(BaseKuCoinService, 'RATE_LIMITED', False),
+                        mock.patch.object(self.fills, '_write', side_effect=self._write)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _write(self, nets: dict) -> (int, int,):
+        self.nets.update(nets)
+        return 0, len(nets)
+
+    def _order(self, leg: str, side: str, placed: int, stop: str = None) -> str:
+        order_id = self.server._new_order(self.AUTH['api_key'], {'symbol': 'XBTUSDTM', 'side': side, 'size': 10,
+                                                                  'clientOid': f'1-{self.USER_ID}-{leg}',
+                                                                  'stop': stop})
+        self.server.orders[self.AUTH['api_key']][order_id]['createdAt'] = placed
+        return order_id
+
+    def _sync(self) -> dict:
+        return self.fills.sync([(self.USER_ID, self.AUTH)])
+
+    def test_legs_done_after_the_cursor_are_synced(self):
+        self.fills.OPEN_REFRESH, open_refresh = 0, self.fills.OPEN_REFRESH
+        self.addCleanup(setattr, self.fills, 'OPEN_REFRESH', open_refresh)
+        placed = int(time() * 1000) - 60 * 60 * 1000
+        main = self._order('main', 'buy', placed)
+        tp = self._order('tp0', 'sell', placed)
+        self._order('sl', 'sell', placed, stop='down')
+        self.server.fill_order(self.AUTH['api_key'], main, deal_value=200.0)
+
+        self.assertEqual(self._sync()['fills'], 1)
+        self.assertEqual(self.nets, {(1, self.USER_ID): 0.0})
+        cursor, open_since, listed = self.fills._cursors([self.USER_ID])[self.USER_ID]
+        self.assertEqual((open_since, listed), (placed, cursor))
+        # The legs were placed long before the cursor, they are listed again while one is open
+        self.assertLess(self.fills._start_at(cursor, open_since, listed, end_at=cursor), cursor - self.fills.LOOKBACK)
+
+        self.server.fill_order(self.AUTH['api_key'], tp, deal_value=210.0)
+        self.assertEqual(self._sync()['fills'], 2)
+        self.assertEqual(self.nets, {(1, self.USER_ID): 10.0})
+        # The take profit closed the trade, its stop loss is still open but no longer waited for
+        self.assertEqual(len(self.server.orders[self.AUTH['api_key']]), 1)
+        self.assertEqual(self.fills._cursors([self.USER_ID])[self.USER_ID][1], None)
+
+    def test_legs_of_an_unfilled_main_order_are_not_waited_for(self):
+        placed = int(time() * 1000) - 60 * 60 * 1000
+        main = self._order('main', 'buy', placed)
+        self._order('sl', 'sell', placed, stop='down')
+
+        self._sync()
+        self.assertEqual(self.fills._cursors([self.USER_ID])[self.USER_ID][1], placed)
+        self.server.orders[self.AUTH['api_key']].pop(main)
+        self.fills.OPEN_REFRESH, open_refresh = 0, self.fills.OPEN_REFRESH
+        self.addCleanup(setattr, self.fills, 'OPEN_REFRESH', open_refresh)
+        self._sync()
+        self.assertEqual(self.fills._cursors([self.USER_ID])[self.USER_ID][1], None)
+
+    def test_open_orders_are_listed_every_open_refresh(self):
+        self._sync()
+        _, _, listed = self.fills._cursors([self.USER_ID])[self.USER_ID]
+        with mock.patch.object(self.fills, '_open_orders', wraps=self.fills._open_orders) as open_orders:
+            self._sync()
+        open_orders.assert_not_called()
+        self.assertEqual(self.fills._cursors([self.USER_ID])[self.USER_ID][2], listed)
+        self.assertFalse(self.fills._relists(listed, end_at=listed + self.fills.OPEN_REFRESH - 1))
+        self.assertTrue(self.fills._relists(listed, end_at=listed + self.fills.OPEN_REFRESH))
+
+    def test_first_sync_looks_one_window_back(self):
+        self.assertEqual(self.fills._start_at(None, None, None, end_at=BaseKuCoinService.ORDERS_WINDOW * 2),
+                         BaseKuCoinService.ORDERS_WINDOW)
+        self.assertEqual(self.fills._start_at(100000, None, None, end_at=200000), 100000 - self.fills.LOOKBACK)
+        # Orders placed since the last listing may be open
+        self.assertEqual(self.fills._start_at(100000, None, 50000, end_at=200000), 50000 - self.fills.LOOKBACK)
+
+    def test_lookback_is_bounded(self):
+        end_at = self.fills.MAX_LOOKBACK * 10
+        self.assertEqual(self.fills._start_at(end_at - 1000, 0, end_at - 1000, end_at=end_at),
+                         end_at - self.fills.MAX_LOOKBACK)
+
+    def test_net_charges_the_closed_part_of_the_entry(self):
+        main = {'side': 'buy', 'size': 10.0, 'value': 200.0}
+        self.assertIsNone(self.fills.calculate_net({'tp0': {'side': 'sell', 'size': 5.0, 'value': 110.0}}))
+        self.assertEqual(self.fills.calculate_net({'main': main}), 0.0)
+        self.assertEqual(self.fills.calculate_net({'main': main, 'tp0': {'side': 'sell', 'size': 5.0, 'value': 110.0}}),
+                         10.0)
+        # A short gains when it buys back cheaper
+        self.assertEqual(self.fills.calculate_net({'main': dict(main, side='sell'),
+                                                 'sl': {'side': 'buy', 'size': 10.0, 'value': 190.0}}), 10.0)
+
+
+class TradeFanOutTestCase(TestCase):
+
+    ARMY = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        trader = Trader.objects.create(name='trader', email='trader@cryptor.io', number='100', user_id='100')
+        for it in range(cls.ARMY + 1):
+            # The last subscriber has not applied, it must stay out of the fan-out
+            user = User.objects.create(name=f'user{it}', email=f'user{it}@cryptor.io', number=str(it),
+                                       user_id=str(it), user_trader=trader, vip=True, user_apply=it < cls.ARMY)
+            KuCoin.objects.create(user=user, api_key=f'key{it}', api_secret=f'secret{it}',
+                                  api_passphrase=f'passphrase{it}')
+        cls.signal = Signal.objects.create(trader=trader, pair='XBTUSDTM', order_type=Signal.OrderChoices.LIMIT,
+                                           type=Signal.TypeChoices.LONG, entry=20000,
+                                           targets=[21000, 22000, 23000], stop_loss=19000, capital=0.1,
+                                           leverage=5, timeframe=Signal.TimeframeChoices.H_1)
+
+    def setUp(self):
+        hold_ledger(self)
+        self.server = MockKuCoinServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        for kucoin in KuCoin.objects.all():
+            self.server.add_account(kucoin.api_key, kucoin.api_secret, kucoin.api_passphrase)
+
+        service: KuCoinService = KuCoinService()
+        base_url, rate_limited = service.BASE_URL, service.RATE_LIMITED
+        service.BASE_URL, service.RATE_LIMITED = self.server.url, False
+        self.addCleanup(setattr, service, 'BASE_URL', base_url)
+        self.addCleanup(setattr, service, 'RATE_LIMITED', rate_limited)
+        ContractStore().update(service.fetch_contracts())
+
+    def test_army_loads_in_one_query(self):
+        signal = Signal.objects.get(pk=self.signal.pk)
+        with self.assertNumQueries(1):
+            execution = ExecutionSnapshot.load(signal)
+        self.assertEqual(sorted(execution.api_keys), [f'key{it}' for it in range(self.ARMY)])
+
+    def test_workers_do_not_touch_the_database(self):
+        signal = Signal.objects.get(pk=self.signal.pk)
+        opened = []
+
+        def on_connection_created(sender, connection, **kwargs):
+            opened.append(connection)
+
+        connection_created.connect(on_connection_created)
+        self.addCleanup(connection_created.disconnect, on_connection_created)
+        # The army, then the ledger in one bulk insert once every order is placed
+        with self.assertNumQueries(2):
+            results = KuCoinTasks.trade(signal)
+
+        self.assertEqual(opened, [])
+        self.assertEqual(len(results), self.ARMY)
+        self.assertTrue(all(BaseKuCoinService._accepted(sl) for main, tps, sl in results))
+
+    def test_executions_are_recorded(self):
+        signal = Signal.objects.get(pk=self.signal.pk)
+        KuCoinTasks.trade(signal)
+
+        summary = Execution.objects.summary(signal.pk)
+        self.assertEqual(summary['count'], self.ARMY)
+        self.assertEqual(summary['statuses'], {Execution.StatusChoices.PROTECTED: self.ARMY})
+        execution = Execution.objects.of_signal(signal.pk).first()
+        self.assertTrue(execution.main_order_id and execution.tp_order_ids and execution.sl_order_id)
+
+    def test_prepared_orders_are_sent(self):
+        signal = Signal.objects.get(pk=self.signal.pk)
+        BalanceStore().put_many({f'key{it}': 1000.0 for it in range(self.ARMY)})
+        self.assertEqual(ExecutionPlanner().prepare(signal), self.ARMY)
+
+        # A subscriber whose balance moved since is planned again, alone
+        BalanceStore().put('key0', 2000.0)
+        service: KuCoinService = KuCoinService()
+        with mock.patch.object(service, 'plan_orders', wraps=service.plan_orders) as plan_orders:
+            results = KuCoinTasks.trade(signal)
+
+        self.assertEqual([len(call.args[0].accounts) for call in plan_orders.call_args_list], [1])
+        self.assertTrue(all(BaseKuCoinService._accepted(sl) for main, tps, sl in results))
+
+    def test_kill_switch_gets_the_army_out(self):
+        kucoin = KuCoin.objects.get(api_key='key0')
+        self.server._new_order('key0', {'symbol': 'XBTUSDTM', 'type': 'limit'})
+        self.server._new_order('key0', {'symbol': 'XBTUSDTM', 'stop': 'down'})
+        self.server._new_order('key0', {'symbol': 'ETHUSDTM', 'type': 'limit'})
+
+        with mock.patch.dict(BaseKuCoinService.URLS, {'URL': self.server.url}):
+            progress = KillSwitch(symbol='XBTUSDTM', trader_id=kucoin.user.user_trader_id).run()
+
+        # Subscribers that did not apply may still hold positions, they get out too
+        self.assertEqual({field: progress[field] for field in ('accounts', 'done', 'failed', 'positions')},
+                         {'accounts': self.ARMY + 1, 'done': self.ARMY + 1, 'failed': 0, 'positions': self.ARMY + 1})
+        self.assertEqual((progress['limit_orders'], progress['stop_orders']), (1, 1))
+        self.assertGreaterEqual(progress['elapsed'], 0)
+        left = [order['symbol'] for order in self.server.orders['key0'].values() if not order.get('closeOrder')]
+        self.assertEqual(left, ['ETHUSDTM'])
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('metrics/', views.request_metrics, name='request-metrics'),
+    path('dispatch/<int:signal_id>/', views.dispatch_progress, name='dispatch-progress'),
+    path('executions/<int:signal_id>/', views.signal_executions, name='signal-executions'),
+    path('kill/<str:kill_id>/', views.kill_progress, name='kill-progress'),
+]
@@ -1,3 +1,28 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from .metrics import RequestMetrics
+from .dispatch import SignalDispatcher
+from .kill_switch import KillSwitch
+from .models import Execution
 
-# Create your views here.
+
+@staff_member_required
+def request_metrics(request):
+    metrics: RequestMetrics = RequestMetrics()
+    return JsonResponse(metrics.snapshot())
+
+
+@staff_member_required
+def dispatch_progress(request, signal_id: int):
+    dispatcher: SignalDispatcher = SignalDispatcher()
+    return JsonResponse(dispatcher.progress(signal_id))
+
+
+@staff_member_required
+def signal_executions(request, signal_id: int):
+    return JsonResponse(Execution.objects.summary(signal_id))
+
+
+@staff_member_required
+def kill_progress(request, kill_id: str):
+    return JsonResponse(KillSwitch.progress(kill_id))
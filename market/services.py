@@ -52,6 +52,11 @@ class MarketService:
         days = DateTimeService.diff_days(since=since)
         return signals / days
 
+    @staticmethod
+    def get_open_pairs() -> list:
+        return list(Signal.objects.filter(status__in=[Signal.StatusChoices.NOT_FILLED, Signal.StatusChoices.FILLED])
+                    .values_list('pair', flat=True).distinct())
+
     @staticmethod
     def calculate_net(start=RELEASE_DATE, end=timezone.now, queryset=None) -> float:
         if queryset: